@@ -0,0 +1,108 @@
+import math
+import numpy as np
+import faiss
+
+from .config import (
+    HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, IVF_NPROBE, PQ_M, ANN_TRAIN_SAMPLE,
+)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+ADD_BATCH = 65536
+EXACT_BLOCK = 16384  # rows scored per matmul in exact search
+MAX_EF_SEARCH = 4096
+
+
+def index_kind(index) -> str:
+    """Kind of a FAISS index; None (no ANN index, exact search) counts as flat."""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def _nlist(n_vectors: int) -> int:
+    # ~4*sqrt(n) lists, with enough vectors per centroid to train on
+    return int(max(1, min(4 * math.sqrt(n_vectors), n_vectors // 39, 65536)))
+
+
+def _pq_m(dim: int) -> int:
+    """Largest number of PQ sub-quantizers <= PQ_M that divides dim."""
+    return next(m for m in range(min(PQ_M, dim), 0, -1) if dim % m == 0)
+
+
+def build_index(kind: str, dim: int, n_vectors: int = 0):
+    """Create an empty (possibly untrained) inner-product index of the given kind."""
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, _nlist(n_vectors), faiss.METRIC_INNER_PRODUCT)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, _nlist(n_vectors), _pq_m(dim), 8, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Invalid index type: {kind}")
+    index.nprobe = IVF_NPROBE
+    return index
+
+
+def build_trained(kind: str, vectors: np.ndarray, sample_size: int = ANN_TRAIN_SAMPLE, seed: int = 0):
+    """Build an index of `kind`, train it on a sample of `vectors` and add all of them."""
+    n, dim = vectors.shape
+    index = build_index(kind, dim, n)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    for start in range(0, n, ADD_BATCH):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH], dtype=np.float32))
+    return index
+
+
+def search_params(index, nprobe: int = None, ef_search: int = None, selector=None, selectivity: float = 1.0):
+    """
+    Per-query recall knobs for the index kind; None keeps the index defaults. With an ID
+    `selector` matching `selectivity` of the vectors, HNSW and IVF search proportionally
+    wider, since filtered-out vectors still use up their search budget.
+    """
+    kind = index_kind(index)
+    kwargs = {} if selector is None else {"sel": selector}
+    widen = 1.0 / max(selectivity, 1e-3) if selector is not None else 1.0
+    if kind == "hnsw":
+        if ef_search or selector is not None:
+            kwargs["efSearch"] = int(min((ef_search or index.hnsw.efSearch) * widen, MAX_EF_SEARCH))
+        return faiss.SearchParametersHNSW(**kwargs) if kwargs else None
+    if kind in ("ivf_flat", "ivf_pq"):
+        if nprobe or selector is not None:
+            kwargs["nprobe"] = int(min((nprobe or index.nprobe) * widen, index.nlist))
+        return faiss.SearchParametersIVF(**kwargs) if kwargs else None
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+
+def exact_search(vectors: np.ndarray, qv: np.ndarray, k: int, positions: np.ndarray = None, block: int = EXACT_BLOCK):
+    """
+    Exact inner-product top-k of each query row over `vectors` (only `positions` if given),
+    as unsorted (positions, scores) matrices. Rows are scored in blocks, so no index or
+    full copy of the matrix is needed.
+    """
+    n = len(vectors) if positions is None else positions.size
+    k = min(k, n)
+    best_I = np.empty((len(qv), 0), dtype=np.int64)
+    best_D = np.empty((len(qv), 0), dtype=np.float32)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        ids = np.arange(start, end) if positions is None else positions[start:end]
+        rows = vectors[start:end] if positions is None else vectors[ids]
+        D = np.concatenate([best_D, qv @ rows.T], axis=1)
+        I = np.concatenate([best_I, np.broadcast_to(ids, (len(qv), ids.size))], axis=1)
+        if D.shape[1] > k:
+            top = np.argpartition(-D, k - 1, axis=1)[:, :k]
+            D, I = np.take_along_axis(D, top, axis=1), np.take_along_axis(I, top, axis=1)
+        best_I, best_D = I, D
+    return best_I, best_D
@@ -0,0 +1,370 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .schema import Chunk
+
+
+class Column:
+    """Append-only numpy column (1-D, or rows of `width`) that grows by doubling."""
+
+    def __init__(self, dtype, width: int = None, data: np.ndarray = None):
+        self.dtype = np.dtype(dtype)
+        self._tail = () if width is None else (width,)
+        self._data = data if data is not None else np.zeros((0,) + self._tail, dtype=self.dtype)
+        self._n = len(self._data)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def view(self) -> np.ndarray:
+        return self._data[:self._n]
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.dtype).reshape((-1,) + self._tail)
+        need = self._n + len(values)
+        # Loaded columns may be read-only memory maps; the first append copies them
+        if need > len(self._data) or not self._data.flags.writeable:
+            grown = np.empty((max(need, 2 * len(self._data), 1024),) + self._tail, dtype=self.dtype)
+            grown[:self._n] = self._data[:self._n]
+            self._data = grown
+        self._data[self._n:need] = values
+        self._n = need
+
+    def assign(self, positions: np.ndarray, value):
+        """Overwrite existing rows in a copy, so arrays `view` handed out keep their values."""
+        data = np.array(self._data)
+        data[positions] = value
+        self._data = data
+
+    def take(self, positions: np.ndarray) -> "Column":
+        return Column(self.dtype, data=self._data[positions], width=self._tail[0] if self._tail else None)
+
+
+class RaggedColumn:
+    """Variable-length rows stored flat, with an offsets column (row i is values[off[i]:off[i+1]])."""
+
+    def __init__(self, dtype, values: np.ndarray = None, offsets: np.ndarray = None):
+        self.values = Column(dtype, data=values)
+        self.offsets = Column(np.int64, data=offsets if offsets is not None else np.zeros(1, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        off = self.offsets.view
+        return self.values.view[off[i]:off[i + 1]]
+
+    def take(self, positions: np.ndarray) -> "RaggedColumn":
+        """A new column holding rows `positions`, in that order."""
+        off = self.offsets.view
+        lengths = off[positions + 1] - off[positions]
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat = np.repeat(off[positions] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        column = type(self).__new__(type(self))
+        RaggedColumn.__init__(column, self.values.dtype, self.values.view[flat], offsets)
+        return column
+
+    def extend(self, rows):
+        rows = list(rows)
+        lengths = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+        self.offsets.extend(self.offsets.view[-1] + np.cumsum(lengths))
+        if lengths.sum():
+            self.values.extend(np.concatenate([np.asarray(r, dtype=self.values.dtype) for r in rows]))
+
+
+class StringColumn(RaggedColumn):
+    """Strings as one utf-8 byte column with offsets."""
+
+    def __init__(self, values: np.ndarray = None, offsets: np.ndarray = None):
+        super().__init__(np.uint8, values, offsets)
+
+    def __getitem__(self, i: int) -> str:
+        return super().__getitem__(i).tobytes().decode("utf-8")
+
+    def extend(self, strings):
+        super().extend(np.frombuffer(s.encode("utf-8"), dtype=np.uint8) for s in strings)
+
+
+class ChunkStore:
+    """
+    Columnar chunk storage.
+
+    Vectors live in one (n, dim) float32 matrix, token ids and extracted numbers in flat
+    arrays with offsets, and chunk ids / texts as utf-8 byte columns. Documents and sources
+    are interned: chunks hold int32 codes into per-document (doc_id, title, meta) and
+    per-source tables. Title and meta are stored once per document. `store[i]` rebuilds a
+    Chunk with the usual fields for callers.
+
+    Deleting a document only tombstones its rows, and searches skip them. `compact` builds
+    a new store without them. Deleted positions are also kept in order in `deleted_log`, so
+    persistence can append just the deletions since its last save.
+
+    Rows are only appended and tombstones are replaced rather than changed, so a reader
+    holding `len(store)` and `tombstones.view` from one moment keeps a consistent prefix
+    while a single writer goes on (see RetrieverEngine's snapshots).
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.vectors_col = Column(np.float32, width=dim)
+        self.doc_codes_col = Column(np.int32)
+        self.source_codes_col = Column(np.int32)
+        self.chunk_ids = StringColumn()
+        self.texts = StringColumn()
+        self.tokens = RaggedColumn(np.int32)
+        self.numbers = RaggedColumn(np.float64)
+        self.tombstones = Column(np.bool_)
+        self.deleted_log = Column(np.int64)
+        self.n_deleted = 0
+        self.persisted = None  # manifest of the snapshot this store was loaded from or saved as
+
+        self.doc_ids: List[str] = []
+        self.titles: List[Optional[str]] = []
+        self.metas: List[Dict] = []
+        self.sources: List[str] = []
+        self._doc_index: Dict[str, int] = {}
+        self._retired: Dict[str, List[int]] = {}  # doc_id -> codes of its deleted versions
+        self._source_index: Dict[str, int] = {}
+        self.terms: List[str] = []  # token id -> term, shared with the lexical index
+
+    def __len__(self):
+        return len(self.doc_codes_col)
+
+    # -------- Columns --------
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.vectors_col.view
+
+    @property
+    def doc_codes(self) -> np.ndarray:
+        return self.doc_codes_col.view
+
+    @property
+    def source_codes(self) -> np.ndarray:
+        return self.source_codes_col.view
+
+    # -------- Append --------
+    def _doc_code(self, chunk: Chunk) -> int:
+        code = self._doc_index.get(chunk.doc_id)
+        if code is None:
+            code = self._doc_index[chunk.doc_id] = len(self.doc_ids)
+            self.doc_ids.append(chunk.doc_id)
+            self.titles.append(chunk.title)
+            self.metas.append(chunk.meta or {})
+        return code
+
+    def _source_code(self, source: str) -> int:
+        code = self._source_index.get(source)
+        if code is None:
+            code = self._source_index[source] = len(self.sources)
+            self.sources.append(source)
+        return code
+
+    def extend(self, chunks: List[Chunk], token_ids: Iterable[np.ndarray]):
+        """Append chunks (with vectors) and their interned token ids."""
+        self.chunk_ids.extend(c.chunk_id for c in chunks)
+        self.texts.extend(c.text for c in chunks)
+        self.tokens.extend(token_ids)
+        self.numbers.extend(c.raw_numbers or () for c in chunks)
+        self.source_codes_col.extend([self._source_code(c.source) for c in chunks])
+        self.vectors_col.extend(np.stack([c.vector for c in chunks]))
+        self.tombstones.extend(np.zeros(len(chunks), dtype=np.bool_))
+        # Written last: len(store) only covers chunks whose columns are complete
+        self.doc_codes_col.extend([self._doc_code(c) for c in chunks])
+
+    def delete_docs(self, doc_ids) -> np.ndarray:
+        """Tombstone every chunk of the given documents; returns their positions."""
+        codes = [self._retire(d) for d in set(doc_ids) if d in self._doc_index]
+        if not codes:
+            return np.empty(0, dtype=np.int64)
+        positions = np.flatnonzero(np.isin(self.doc_codes, codes))
+        positions = positions[~self.tombstones.view[positions]]
+        self.tombstones.assign(positions, True)
+        self.deleted_log.extend(positions)
+        self.n_deleted += positions.size
+        return positions
+
+    def _retire(self, doc_id: str) -> int:
+        # Snapshots from before the deletion still filter by the old code
+        code = self._doc_index.pop(doc_id)
+        self._retired.setdefault(doc_id, []).append(code)
+        return code
+
+    def compact(self, n: int):
+        """(new store, old positions) holding the live rows among the first n, in order."""
+        keep = np.flatnonzero(~self.tombstones.view[:n])
+        store = ChunkStore(self.dim)
+        store.vectors_col = self.vectors_col.take(keep)
+        store.tombstones = Column(np.bool_, data=np.zeros(keep.size, dtype=np.bool_))
+        store.chunk_ids = self.chunk_ids.take(keep)
+        store.texts = self.texts.take(keep)
+        store.tokens = self.tokens.take(keep)
+        store.numbers = self.numbers.take(keep)
+        store.terms = self.terms
+
+        # Re-intern only documents and sources that still have chunks
+        docs, doc_codes = np.unique(self.doc_codes[keep], return_inverse=True)
+        store.doc_codes_col = Column(np.int32, data=doc_codes.astype(np.int32))
+        store.doc_ids = [self.doc_ids[d] for d in docs]
+        store.titles = [self.titles[d] for d in docs]
+        store.metas = [self.metas[d] for d in docs]
+        store._doc_index = {d: i for i, d in enumerate(store.doc_ids)}
+        sources, source_codes = np.unique(self.source_codes[keep], return_inverse=True)
+        store.source_codes_col = Column(np.int32, data=source_codes.astype(np.int32))
+        store.sources = [self.sources[s] for s in sources]
+        store._source_index = {s: i for i, s in enumerate(store.sources)}
+        return store, keep
+
+    def copy_rows(self, source: "ChunkStore", positions: np.ndarray):
+        """Append rows `positions` of another store."""
+        if positions.size:
+            self.extend([source[int(i)] for i in positions], [source.tokens[int(i)] for i in positions])
+
+    # -------- Access --------
+    def live_mask(self, n: int) -> np.ndarray:
+        return ~self.tombstones.view[:n]
+
+    def has_doc(self, doc_id: str) -> bool:
+        return doc_id in self._doc_index
+
+    def doc_id(self, i: int) -> str:
+        return self.doc_ids[self.doc_codes_col.view[i]]
+
+    def source(self, i: int) -> str:
+        return self.sources[self.source_codes_col.view[i]]
+
+    def raw_numbers(self, i: int) -> List[float]:
+        return self.numbers[i].tolist()
+
+    def __getitem__(self, i: int) -> Chunk:
+        doc = self.doc_codes_col.view[i]
+        return Chunk(
+            chunk_id=self.chunk_ids[i],
+            doc_id=self.doc_ids[doc],
+            title=self.titles[doc],
+            text=self.texts[i],
+            meta=self.metas[doc],
+            raw_numbers=self.raw_numbers(i),
+            source=self.source(i),
+            vector=self.vectors_col.view[i],
+            tokens=[self.terms[t] for t in self.tokens[i]] if self.terms else None,
+        )
+
+    def positions_for_docs(self, doc_ids, n: int) -> np.ndarray:
+        """Positions (< n) of the given documents, including deleted versions; callers drop tombstoned rows."""
+        codes = [code for d in set(doc_ids) for code in self._retired.get(d, ())]
+        codes += [self._doc_index[d] for d in set(doc_ids) if d in self._doc_index]
+        return np.flatnonzero(np.isin(self.doc_codes[:n], codes))
+
+    def positions_for_sources(self, sources, n: int) -> Optional[np.ndarray]:
+        """Positions in the given sources, or None when they cover every source."""
+        codes = [self._source_index[s] for s in set(sources) if s in self._source_index]
+        if len(codes) == len(self.sources):
+            return None
+        return np.flatnonzero(np.isin(self.source_codes[:n], codes))
+
+    def source_counts(self, n: int = None, live: np.ndarray = None) -> Dict[str, int]:
+        """Live chunks per source among the first n, or among those `live` marks."""
+        n = len(self) if n is None else n
+        live = self.live_mask(n) if live is None else live
+        counts = np.bincount(self.source_codes[:n][live], minlength=len(self.sources))
+        return {src: int(counts[code]) for code, src in enumerate(self.sources)}
+
+    # -------- Persistence --------
+    def _columns(self, n: int) -> Dict[str, np.ndarray]:
+        columns = {
+            "vectors": self.vectors[:n],
+            "doc_codes": self.doc_codes[:n],
+            "source_codes": self.source_codes[:n],
+            "tombstones": self.tombstones.view[:n],
+        }
+        for name, col in (("chunk_ids", self.chunk_ids), ("texts", self.texts),
+                          ("tokens", self.tokens), ("numbers", self.numbers)):
+            columns[f"{name}_values"] = col.values.view[:col.offsets.view[n]]
+            columns[f"{name}_offsets"] = col.offsets.view[:n + 1]
+        return columns
+
+    def log_columns(self, n: int) -> Dict[str, np.ndarray]:
+        """
+        Columns of the first n chunks as append-only arrays: a save only needs each one's
+        elements past what it already wrote. Tombstones are replaced by the deletion log.
+        """
+        columns = self._columns(n)
+        del columns["tombstones"]
+        columns["deleted"] = self.deleted_log.view
+        return columns
+
+    @classmethod
+    def from_columns(cls, dim: int, data: Dict[str, np.ndarray], tables: Dict[str, list]) -> "ChunkStore":
+        """A store over column arrays (as written by `log_columns`) and the interned tables."""
+        store = cls(dim)
+        n = len(data["doc_codes"])
+        store.vectors_col = Column(np.float32, width=dim, data=data["vectors"])
+        store.doc_codes_col = Column(np.int32, data=data["doc_codes"])
+        store.source_codes_col = Column(np.int32, data=data["source_codes"])
+        if "deleted" in data:
+            tombstones = np.zeros(n, dtype=np.bool_)
+            tombstones[data["deleted"]] = True
+            deleted = data["deleted"]
+        else:
+            tombstones = data["tombstones"] if "tombstones" in data else np.zeros(n, dtype=np.bool_)
+            deleted = np.flatnonzero(tombstones)
+        store.tombstones = Column(np.bool_, data=tombstones)
+        store.deleted_log = Column(np.int64, data=deleted)
+        store.chunk_ids = StringColumn(data["chunk_ids_values"], data["chunk_ids_offsets"])
+        store.texts = StringColumn(data["texts_values"], data["texts_offsets"])
+        store.tokens = RaggedColumn(np.int32, data["tokens_values"], data["tokens_offsets"])
+        store.numbers = RaggedColumn(np.float64, data["numbers_values"], data["numbers_offsets"])
+        store.doc_ids, store.titles, store.metas, store.sources = (
+            tables["doc_ids"], tables["titles"], tables["metas"], tables["sources"]
+        )
+        # A replaced document keeps its old (deleted) table entry until compaction
+        live = store.live_mask(n)
+        store.n_deleted = int(n - live.sum())
+        store._doc_index = {store.doc_ids[code]: int(code) for code in np.unique(store.doc_codes[live])}
+        for code in np.unique(store.doc_codes[~live]):
+            if store._doc_index.get(store.doc_ids[code]) != code:
+                store._retired.setdefault(store.doc_ids[code], []).append(int(code))
+        store._source_index = {s: i for i, s in enumerate(store.sources)}
+        return store
+
+    def follow(self, data: Dict[str, np.ndarray], tables: Dict[str, list]):
+        """
+        Catch up in place with a longer snapshot of the same log (a reader following the
+        writer): `data` holds the full columns, `tables` the documents and sources added.
+        Rows only become visible, through len(store), once their columns and tombstones are in.
+        """
+        n = len(data["doc_codes"])
+        for doc_id, title, meta in zip(tables["doc_ids"], tables["titles"], tables["metas"]):
+            self._doc_index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.titles.append(title)
+            self.metas.append(meta)
+        for source in tables["sources"]:
+            self._source_index[source] = len(self.sources)
+            self.sources.append(source)
+
+        self.vectors_col = Column(np.float32, width=self.dim, data=data["vectors"])
+        self.source_codes_col = Column(np.int32, data=data["source_codes"])
+        self.chunk_ids = StringColumn(data["chunk_ids_values"], data["chunk_ids_offsets"])
+        self.texts = StringColumn(data["texts_values"], data["texts_offsets"])
+        self.tokens = RaggedColumn(np.int32, data["tokens_values"], data["tokens_offsets"])
+        self.numbers = RaggedColumn(np.float64, data["numbers_values"], data["numbers_offsets"])
+        self.tombstones.extend(np.zeros(n - len(self.tombstones), dtype=np.bool_))
+
+        positions = np.asarray(data["deleted"][len(self.deleted_log):])
+        if positions.size:
+            self.tombstones.assign(positions, True)
+            self.deleted_log = Column(np.int64, data=data["deleted"])
+            self.n_deleted += positions.size
+            # The new version of a replaced document may already be in _doc_index (added above)
+            for code in np.unique(data["doc_codes"][positions]).tolist():
+                doc_id = self.doc_ids[code]
+                if self._doc_index.get(doc_id) == code:
+                    self._retire(doc_id)
+                elif code not in self._retired.get(doc_id, ()):
+                    self._retired.setdefault(doc_id, []).append(code)
+        self.doc_codes_col = Column(np.int32, data=data["doc_codes"])
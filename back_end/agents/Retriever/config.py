@@ -6,8 +6,142 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "embed-english-v3.0")
+OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+EMBED_DIM = int(os.getenv("EMBEDDING_DIM", "0")) or None  # override for models not listed below
+
+# Embedding provider: auto (OpenAI or Cohere, by which key is set) | openai | cohere | local | hashing
+EMBED_PROVIDER = os.getenv("RETRIEVER_EMBED_PROVIDER", "auto")
+# local: a sentence-transformers model name or directory, run on CPU; backend torch | onnx,
+# LOCAL_EMBED_INT8 quantizes the torch model, LOCAL_EMBED_ONNX_FILE selects an (e.g. int8) ONNX export
+LOCAL_EMBED_MODEL = os.getenv("RETRIEVER_LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_DEVICE = os.getenv("RETRIEVER_LOCAL_EMBED_DEVICE", "cpu")
+LOCAL_EMBED_THREADS = int(os.getenv("RETRIEVER_LOCAL_EMBED_THREADS", "0"))  # 0 keeps the library default
+LOCAL_EMBED_BATCH_SIZE = int(os.getenv("RETRIEVER_LOCAL_EMBED_BATCH_SIZE", "64"))
+LOCAL_EMBED_BACKEND = os.getenv("RETRIEVER_LOCAL_EMBED_BACKEND", "torch")
+LOCAL_EMBED_INT8 = os.getenv("RETRIEVER_LOCAL_EMBED_INT8", "0").lower() in ("1", "true", "yes")
+LOCAL_EMBED_ONNX_FILE = os.getenv("RETRIEVER_LOCAL_EMBED_ONNX_FILE") or None
+HASHING_EMBED_DIM = int(os.getenv("RETRIEVER_HASHING_EMBED_DIM", "256"))
+READY_TIMEOUT = float(os.getenv("RETRIEVER_READY_TIMEOUT", "30"))
 PERSIST_DIR = os.getenv("RETRIEVER_PERSIST_DIR", "./persist")
 EPS = 1e-12
+RRF_K = int(os.getenv("RETRIEVER_RRF_K", "60"))
+
+# Content-addressed cache of document embeddings: local (SQLite in PERSIST_DIR) | redis | off
+EMBED_CACHE_BACKEND = os.getenv("RETRIEVER_EMBED_CACHE", "local")
+EMBED_CACHE_REDIS_URL = os.getenv("RETRIEVER_EMBED_CACHE_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+EMBED_CACHE_TTL = int(os.getenv("RETRIEVER_EMBED_CACHE_TTL", "0"))  # seconds, redis only; 0 keeps forever
+
+# Ingest embedding: texts are sent in batches of EMBED_BATCH_SIZE, EMBED_CONCURRENCY at a time
+EMBED_BATCH_SIZE = int(os.getenv("RETRIEVER_EMBED_BATCH_SIZE", "96"))
+EMBED_CONCURRENCY = int(os.getenv("RETRIEVER_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("RETRIEVER_EMBED_MAX_RETRIES", "3"))
+EMBED_RETRY_BACKOFF = float(os.getenv("RETRIEVER_EMBED_RETRY_BACKOFF", "1.0"))
+
+# Query embeddings: LRU cache (TTL in seconds, 0 = no expiry) and a micro-batching window
+# that merges concurrent cache misses into one provider call (0 disables batching)
+QUERY_CACHE_SIZE = int(os.getenv("RETRIEVER_QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_TTL = float(os.getenv("RETRIEVER_QUERY_CACHE_TTL", "0"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("RETRIEVER_QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_MAX_BATCH = int(os.getenv("RETRIEVER_QUERY_MAX_BATCH", "64"))
+
+# PDF parsing runs in a process pool (threads in Celery's prefork workers, which may not start
+# processes); files longer than PDF_PAGES_PER_TASK are split into page ranges, and a file
+# taking longer than PDF_TIMEOUT seconds fails
+PDF_WORKERS = int(os.getenv("RETRIEVER_PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("RETRIEVER_PDF_PAGES_PER_TASK", "25"))
+PDF_TIMEOUT = float(os.getenv("RETRIEVER_PDF_TIMEOUT", "300"))
+
+# URL fetching: one pooled async client (FETCH_MAX_CONNECTIONS sockets, at most
+# FETCH_PER_HOST requests in flight per host), HTML parsed in FETCH_PARSE_WORKERS processes;
+# validators and text of the last FETCH_VALIDATOR_CACHE pages enable conditional re-fetches
+FETCH_MAX_CONNECTIONS = int(os.getenv("RETRIEVER_FETCH_MAX_CONNECTIONS", "100"))
+FETCH_PER_HOST = int(os.getenv("RETRIEVER_FETCH_PER_HOST", "8"))
+FETCH_TIMEOUT = float(os.getenv("RETRIEVER_FETCH_TIMEOUT", "15"))
+FETCH_PARSE_WORKERS = int(os.getenv("RETRIEVER_FETCH_PARSE_WORKERS", str(min(4, os.cpu_count() or 2))))
+FETCH_VALIDATOR_CACHE = int(os.getenv("RETRIEVER_FETCH_VALIDATOR_CACHE", "256"))
+
+# Approximate nearest-neighbour tiers: the index starts exact (flat) and is promoted to
+# ANN_INDEX_TYPE once it holds ANN_PROMOTE_THRESHOLD chunks ("flat" disables this)
+ANN_INDEX_TYPE = os.getenv("RETRIEVER_ANN_INDEX", "hnsw")
+ANN_PROMOTE_THRESHOLD = int(os.getenv("RETRIEVER_ANN_THRESHOLD", "200000"))
+# The published ANN index is never modified while queries search it: new chunks are searched
+# exactly beside it until ANN_TAIL_MAX of them accumulate, then a copy of the index extended
+# with them is built in the background (briefly holding the index twice) and swapped in
+ANN_TAIL_MAX = int(os.getenv("RETRIEVER_ANN_TAIL_MAX", "5000"))
+ANN_TRAIN_SAMPLE = int(os.getenv("RETRIEVER_ANN_TRAIN_SAMPLE", "100000"))
+HNSW_M = int(os.getenv("RETRIEVER_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RETRIEVER_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RETRIEVER_HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("RETRIEVER_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("RETRIEVER_PQ_M", "64"))
+
+# Source / document filters matching at most FILTER_EXACT_MAX chunks are scored exactly
+# against just those vectors; broader ones search the index with an ID selector
+FILTER_EXACT_MAX = int(os.getenv("RETRIEVER_FILTER_EXACT_MAX", "4096"))
+
+# Deleted and replaced documents are tombstoned until a background compaction drops them,
+# which starts once COMPACT_RATIO of the index (and at least COMPACT_MIN_DELETED chunks) is
+# deleted. Unfiltered searches over-fetch by up to DELETED_OVERFETCH_MAX tombstoned chunks
+# and filter to the live ones beyond that.
+COMPACT_RATIO = float(os.getenv("RETRIEVER_COMPACT_RATIO", "0.2"))
+COMPACT_MIN_DELETED = int(os.getenv("RETRIEVER_COMPACT_MIN_DELETED", "1000"))
+DELETED_OVERFETCH_MAX = int(os.getenv("RETRIEVER_DELETED_OVERFETCH_MAX", "1024"))
+
+# Multi-process serving: a "writer" (the default) loads, ingests and publishes each save as
+# an immutable snapshot generation; "reader" processes memory-map the current generation,
+# reject writes and check for a newer generation every SNAPSHOT_POLL seconds. Only the
+# process holding the writer lock in PERSIST_DIR writes, so with several uvicorn workers
+# the first to start is the writer and the others become readers. The newest SNAPSHOT_KEEP
+# generations are kept on disk.
+RETRIEVER_ROLE = os.getenv("RETRIEVER_ROLE", "writer")
+SNAPSHOT_POLL = float(os.getenv("RETRIEVER_SNAPSHOT_POLL", "2"))
+SNAPSHOT_KEEP = int(os.getenv("RETRIEVER_SNAPSHOT_KEEP", "3"))
+
+# Each save appends only what changed to the snapshot's column logs and writes the new chunks'
+# postings as one immutable segment; past SEGMENT_MAX segments, a background merge joins the
+# SEGMENT_MERGE_FACTOR adjacent ones holding the fewest postings. The ANN index is rewritten
+# once the vectors it lacks exceed ANN_REWRITE_RATIO of it; a restarted writer adds them back
+# and readers search them exactly.
+SEGMENT_MAX = int(os.getenv("RETRIEVER_SEGMENT_MAX", "8"))
+SEGMENT_MERGE_FACTOR = max(2, int(os.getenv("RETRIEVER_SEGMENT_MERGE_FACTOR", "4")))
+ANN_REWRITE_RATIO = float(os.getenv("RETRIEVER_ANN_REWRITE_RATIO", "0.1"))
+
+# Ingest jobs: /retriever/ingest queues one Celery task per INGEST_TASK_ITEMS documents, which
+# extracts, chunks and embeds them (workers load no index) and queues each document with its
+# chunk vectors; the writer then indexes prepared documents up to INGEST_APPLY_BATCH at a time,
+# saving after each batch, and checks for more every INGEST_POLL seconds. Finished jobs expire
+# after INGEST_JOB_TTL.
+INGEST_REDIS_URL = os.getenv("RETRIEVER_INGEST_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+INGEST_POLL = float(os.getenv("RETRIEVER_INGEST_POLL", "1"))
+INGEST_APPLY_BATCH = int(os.getenv("RETRIEVER_INGEST_APPLY_BATCH", "200"))
+INGEST_TASK_ITEMS = max(1, int(os.getenv("RETRIEVER_INGEST_TASK_ITEMS", "8")))
+INGEST_TASK_RETRIES = int(os.getenv("RETRIEVER_INGEST_TASK_RETRIES", "3"))
+INGEST_JOB_TTL = int(os.getenv("RETRIEVER_INGEST_JOB_TTL", str(7 * 86400)))
+
+# Extracted text of URL and PDF ingest items, cached in Redis so re-ingest skips fetching and
+# parsing (redis | off). A file's key includes its size and mtime, so an edited file misses;
+# pages cannot be fingerprinted before fetching them, so they expire after DOC_CACHE_URL_TTL.
+# Payloads are compressed with DOC_CACHE_CODEC: zstd | lz4 (needing the zstandard / lz4
+# packages, zlib otherwise) | zlib | none. The client pools at most DOC_CACHE_MAX_CONNECTIONS
+# connections and gives up after DOC_CACHE_TIMEOUT seconds, treating the lookup as a miss.
+DOC_CACHE_BACKEND = os.getenv("RETRIEVER_DOC_CACHE", "redis")
+DOC_CACHE_URL = os.getenv("RETRIEVER_DOC_CACHE_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+DOC_CACHE_TTL = int(os.getenv("RETRIEVER_DOC_CACHE_TTL", "86400"))
+DOC_CACHE_URL_TTL = int(os.getenv("RETRIEVER_DOC_CACHE_URL_TTL", "3600"))
+DOC_CACHE_CODEC = os.getenv("RETRIEVER_DOC_CACHE_CODEC", "zstd")
+DOC_CACHE_MAX_CONNECTIONS = int(os.getenv("RETRIEVER_DOC_CACHE_MAX_CONNECTIONS", "16"))
+DOC_CACHE_TIMEOUT = float(os.getenv("RETRIEVER_DOC_CACHE_TIMEOUT", "2"))
+
+# Output dimension of known embedding models, so startup needs no probe request
+KNOWN_EMBED_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+    "embed-english-v3.0": 1024,
+    "embed-multilingual-v3.0": 1024,
+    "embed-english-light-v3.0": 384,
+    "embed-multilingual-light-v3.0": 384,
+}
 
 import logging
 logging.basicConfig(level=logging.INFO)
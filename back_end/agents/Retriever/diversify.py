@@ -0,0 +1,52 @@
+import numpy as np
+from .config import EPS
+
+
+def mmr_select(relevance, k: int, vectors=None, lambda_: float = None, groups=None, max_per_group: int = None) -> np.ndarray:
+    """
+    Pick up to k candidates greedily by maximal marginal relevance.
+
+    Each step takes the candidate maximizing `lambda_ * rel - (1 - lambda_) * max_sim`, where
+    rel is the min-max normalized relevance and max_sim its cosine similarity to the closest
+    candidate already picked. All candidate-candidate similarities come from one matrix
+    product over the (normalized) `vectors`; a step is then a few vector ops. With
+    `lambda_=None` candidates are taken by relevance alone. `groups` (e.g. document codes)
+    with `max_per_group` caps how many picks share a group.
+
+    Returns indices into the candidate arrays, in pick order.
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    m = relevance.size
+    k = min(k, m)
+    if not k:
+        return np.empty(0, dtype=np.int64)
+
+    rel = (relevance - relevance.min()) / (relevance.max() - relevance.min() + EPS)
+    sim = None
+    if lambda_ is not None and lambda_ < 1.0:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sim = vectors @ vectors.T
+    if groups is not None and max_per_group is not None:
+        _, groups = np.unique(groups, return_inverse=True)
+        room = np.full(groups.max() + 1, max_per_group)
+    else:
+        groups = None
+
+    available = np.ones(m, dtype=bool)
+    max_sim = np.zeros(m)
+    picked = []
+    for step in range(k):
+        score = rel if sim is None else lambda_ * rel - (1.0 - lambda_) * max_sim
+        score = np.where(available, score, -np.inf)
+        j = int(np.argmax(score))
+        if not available[j]:
+            break  # every remaining candidate is in a full group
+        picked.append(j)
+        available[j] = False
+        if sim is not None:
+            max_sim = sim[j] if step == 0 else np.maximum(max_sim, sim[j])
+        if groups is not None:
+            room[groups[j]] -= 1
+            if not room[groups[j]]:
+                available[groups == groups[j]] = False
+    return np.asarray(picked, dtype=np.int64)
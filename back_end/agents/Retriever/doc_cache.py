@@ -0,0 +1,181 @@
+import os
+import zlib
+import hashlib
+import logging
+from typing import List, Optional, Tuple
+
+from .config import (
+    DOC_CACHE_BACKEND, DOC_CACHE_URL, DOC_CACHE_TTL, DOC_CACHE_URL_TTL, DOC_CACHE_CODEC,
+    DOC_CACHE_MAX_CONNECTIONS, DOC_CACHE_TIMEOUT,
+)
+
+
+# -------- Codecs --------
+def _zstd():
+    import zstandard
+
+    # Compressor objects are not thread-safe, so each call makes its own
+    return (lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def _lz4():
+    import lz4.frame
+
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+def _zlib():
+    return (lambda data: zlib.compress(data, 6)), zlib.decompress
+
+
+def _none():
+    return bytes, bytes
+
+
+# name -> (one-byte tag stored before the payload, loader of (compress, decompress))
+CODECS = {"zstd": (b"z", _zstd), "lz4": (b"l", _lz4), "zlib": (b"d", _zlib), "none": (b"n", _none)}
+_TAGS = {tag: name for name, (tag, _) in CODECS.items()}
+_decompressors = {}
+
+
+def load_codec(name: str):
+    """(name, compress, decompress) of a codec, or of zlib if its package is not installed."""
+    if name not in CODECS:
+        raise ValueError(f"Invalid document cache codec: {name}")
+    try:
+        return (name,) + CODECS[name][1]()
+    except ImportError:
+        logging.warning(f"The {name} codec needs its package; compressing cached documents with zlib.")
+        return ("zlib",) + _zlib()
+
+
+def encode_text(text: str, codec) -> bytes:
+    name, compress, _ = codec
+    return CODECS[name][0] + compress(text.encode("utf-8"))
+
+
+def decode_text(blob: bytes) -> Optional[str]:
+    """Text of a cached payload, whatever codec wrote it; None if that codec is unavailable here."""
+    name = _TAGS.get(blob[:1])
+    if name is None:
+        return None
+    try:
+        if name not in _decompressors:
+            _decompressors[name] = CODECS[name][1]()[1]
+        return _decompressors[name](blob[1:]).decode("utf-8")
+    except Exception as e:
+        logging.warning(f"Unreadable cached document ({name}): {e}")
+        return None
+
+
+# -------- Cache --------
+class DocumentCache:
+    """
+    Extracted text of ingest items, keyed by where it came from and a fingerprint of it.
+
+    A file's key includes its absolute path, size and mtime, so an edited file at the same
+    path misses; a URL's key is the URL, and entries expire after DOC_CACHE_URL_TTL as a
+    page cannot be fingerprinted without fetching it. Raw-text items carry their text and
+    are not cached. Compute keys before extracting, so text read from a file is stored
+    under the fingerprint it had when read. This base class caches nothing.
+    """
+
+    PREFIX = "doc:"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(item: dict) -> Optional[str]:
+        if item.get("text"):
+            return None
+        if item.get("url"):
+            locator = f"url\x00{item['url']}"
+        elif item.get("file_path"):
+            try:
+                st = os.stat(item["file_path"])
+            except OSError:
+                return None  # extraction reports the missing file
+            locator = f"file\x00{os.path.abspath(item['file_path'])}\x00{st.st_size}\x00{st.st_mtime_ns}"
+        else:
+            return None
+        return DocumentCache.PREFIX + hashlib.sha256(locator.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def ttl(item: dict) -> int:
+        return DOC_CACHE_URL_TTL if item.get("url") else DOC_CACHE_TTL
+
+    def lookup(self, keys: List[Optional[str]]) -> List[Optional[str]]:
+        """Cached text per key (None for misses and None keys), in one round trip."""
+        wanted = [k for k in keys if k is not None]
+        found = {}
+        if wanted:
+            try:
+                found = dict(zip(wanted, self._get_many(wanted)))
+            except Exception as e:
+                logging.warning(f"Document cache lookup failed, treating as misses: {e}")
+        texts = [decode_text(found[k]) if found.get(k) is not None else None for k in keys]
+        hits = sum(t is not None for t in texts)
+        self.hits += hits
+        self.misses += len(wanted) - hits
+        return texts
+
+    def store(self, entries: List[Tuple[str, str, int]]):
+        """Cache (key, text, ttl seconds) entries in one round trip."""
+        if not entries:
+            return
+        try:
+            self._put_many(entries)
+        except Exception as e:
+            logging.warning(f"Document cache write failed: {e}")
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "hits": self.hits, "misses": self.misses}
+
+    def _get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [None] * len(keys)
+
+    def _put_many(self, entries):
+        pass
+
+
+class RedisDocumentCache(DocumentCache):
+    """
+    Document cache in Redis, shared by ingest workers: one MGET per lookup, one pipeline
+    per write, over a bounded connection pool.
+    """
+
+    def __init__(self, url: str = DOC_CACHE_URL, codec: str = DOC_CACHE_CODEC, client=None):
+        super().__init__()
+        if client is None:
+            from redis import BlockingConnectionPool, Redis
+
+            # Callers beyond the pool size wait up to the timeout for a connection
+            pool = BlockingConnectionPool.from_url(
+                url, max_connections=DOC_CACHE_MAX_CONNECTIONS, timeout=DOC_CACHE_TIMEOUT,
+                socket_timeout=DOC_CACHE_TIMEOUT, socket_connect_timeout=DOC_CACHE_TIMEOUT,
+            )
+            client = Redis(connection_pool=pool)
+        self._redis = client
+        self.codec = load_codec(codec)
+
+    def _get_many(self, keys):
+        return self._redis.mget(keys)
+
+    def _put_many(self, entries):
+        pipe = self._redis.pipeline(transaction=False)
+        for key, text, ttl in entries:
+            pipe.set(key, encode_text(text, self.codec), ex=ttl or None)
+        pipe.execute()
+
+
+def make_document_cache() -> DocumentCache:
+    """Cache selected by RETRIEVER_DOC_CACHE (redis | off)."""
+    try:
+        if DOC_CACHE_BACKEND == "redis":
+            return RedisDocumentCache()
+    except Exception:
+        logging.exception("Could not open the document cache; continuing without it.")
+    return DocumentCache()
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from .config import PERSIST_DIR, EMBED_CACHE_BACKEND, EMBED_CACHE_REDIS_URL, EMBED_CACHE_TTL
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of normalized document vectors.
+
+    Keys are sha256(model, dim, whitespace-normalized text), so a re-ingested document,
+    overlapping chunks or boilerplate shared across files are only embedded once.
+    Backends implement `_get_many` / `_put_many` over those keys.
+    """
+
+    def __init__(self, model_name: str, dim: int):
+        self.model_name = model_name
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\x00{self.dim}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        if not texts:
+            return []
+        try:
+            blobs = self._get_many([self.key(t) for t in texts])
+        except Exception as e:
+            logging.warning(f"Embedding cache lookup failed, treating as misses: {e}")
+            blobs = [None] * len(texts)
+        found = [np.frombuffer(b, dtype=np.float32) if b is not None else None for b in blobs]
+        hits = sum(v is not None for v in found)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return found
+
+    def store(self, texts: List[str], vectors: np.ndarray):
+        if not texts:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        try:
+            self._put_many([(self.key(t), v.tobytes()) for t, v in zip(texts, vectors)])
+        except Exception as e:
+            logging.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+    def _get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [None] * len(keys)
+
+    def _put_many(self, items):
+        pass
+
+
+class LocalEmbeddingCache(EmbeddingCache):
+    """SQLite file next to the retriever state."""
+
+    BATCH = 900  # stays under SQLite's bound-parameter limit
+
+    def __init__(self, model_name: str, dim: int, path: str = None):
+        super().__init__(model_name, dim)
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+        self._db = sqlite3.connect(path or os.path.join(PERSIST_DIR, "embed_cache.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _get_many(self, keys):
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.BATCH):
+                batch = keys[i:i + self.BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                found.update(rows)
+        return [found.get(k) for k in keys]
+
+    def _put_many(self, items):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", items)
+            self._db.commit()
+
+
+class RedisEmbeddingCache(EmbeddingCache):
+    """Shared cache across workers: one MGET per lookup, pipelined writes."""
+
+    PREFIX = "emb:"
+
+    def __init__(self, model_name: str, dim: int, url: str = EMBED_CACHE_REDIS_URL):
+        super().__init__(model_name, dim)
+        from redis import Redis
+        self._redis = Redis.from_url(url)
+
+    def _get_many(self, keys):
+        return self._redis.mget([self.PREFIX + k for k in keys])
+
+    def _put_many(self, items):
+        pipe = self._redis.pipeline(transaction=False)
+        for key, blob in items:
+            pipe.set(self.PREFIX + key, blob, ex=EMBED_CACHE_TTL or None)
+        pipe.execute()
+
+
+def make_embedding_cache(model_name: str, dim: int) -> EmbeddingCache:
+    """Cache selected by RETRIEVER_EMBED_CACHE (local | redis | off)."""
+    try:
+        if EMBED_CACHE_BACKEND == "redis":
+            return RedisEmbeddingCache(model_name, dim)
+        if EMBED_CACHE_BACKEND == "local":
+            return LocalEmbeddingCache(model_name, dim)
+    except Exception:
+        logging.exception(f"Could not open the {EMBED_CACHE_BACKEND} embedding cache; continuing without it.")
+    return EmbeddingCache(model_name, dim)
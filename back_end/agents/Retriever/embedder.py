@@ -0,0 +1,246 @@
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, List
+
+import numpy as np
+
+from .utils import RetrieverUtils
+from .config import (
+    EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_MAX_RETRIES, EMBED_RETRY_BACKOFF,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_BATCH_WINDOW_MS, QUERY_MAX_BATCH,
+)
+
+
+class BatchEmbedder:
+    """
+    Embed large text lists as provider-sized batches on a bounded thread pool.
+
+    Batches are retried individually with exponential backoff, and `embed` yields each
+    one as soon as it completes, so callers can index partial progress and a failing
+    batch never discards the others.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+        max_retries: int = EMBED_MAX_RETRIES,
+        backoff: float = EMBED_RETRY_BACKOFF,
+    ):
+        self.embed_fn = embed_fn
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return np.asarray(self.embed_fn(texts), dtype=np.float32)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.warning(f"Embedding batch of {len(texts)} failed ({e}); retrying in {delay:.1f}s.")
+                time.sleep(delay)
+
+    def embed(self, texts: List[str]):
+        """Yield (start, end, vectors, error) for texts[start:end] in completion order."""
+        spans = [(s, min(s + self.batch_size, len(texts))) for s in range(0, len(texts), self.batch_size)]
+        if not spans:
+            return
+
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrency, len(spans)), thread_name_prefix="embed")
+        try:
+            futures = {pool.submit(self._run, texts[s:e]): (s, e) for s, e in spans}
+            for future in as_completed(futures):
+                s, e = futures[future]
+                try:
+                    yield s, e, future.result(), None
+                except Exception as err:
+                    logging.error(f"Embedding batch {s}:{e} failed after {self.max_retries} retries: {err}")
+                    yield s, e, None, err
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ChunkEmbedder:
+    """
+    Document vectors through the content-addressed embedding cache: hits are read from the
+    cache, misses are embedded in provider batches by a BatchEmbedder, normalized and stored.
+    """
+
+    def __init__(self, provider, dim: int, cache):
+        self.provider = provider
+        self.dim = dim
+        self.cache = cache
+        self._batches = BatchEmbedder(provider.embed_documents, batch_size=provider.batch_size, concurrency=provider.concurrency)
+
+    def embed_into(self, texts: List[str], on_vectors):
+        """
+        Embed `texts`, calling on_vectors(indices, vectors) with normalized vectors as they
+        become available: cache hits first, then provider batches as they complete.
+        Returns (indices whose batch failed, first index of each distinct text sent to the provider).
+        """
+        missing, hit_idx, hit_vecs = {}, [], []
+        for i, vec in enumerate(self.cache.lookup(texts)):
+            if vec is None:
+                missing.setdefault(texts[i], []).append(i)
+            else:
+                hit_idx.append(i)
+                hit_vecs.append(vec)
+        if hit_idx:
+            on_vectors(hit_idx, hit_vecs)
+
+        miss_texts, failed = list(missing), []
+        for start, end, fresh, error in self._batches.embed(miss_texts):
+            batch = miss_texts[start:end]
+            if error is not None:
+                failed.extend(i for t in batch for i in missing[t])
+                continue
+            if fresh.shape[1] != self.dim:
+                raise RuntimeError(f"{self.provider.model_id} returned dim {fresh.shape[1]}, expected {self.dim}; set EMBEDDING_DIM.")
+            fresh = RetrieverUtils.normalize_rows(fresh)
+            self.cache.store(batch, fresh)
+            on_vectors(
+                [i for t in batch for i in missing[t]],
+                [vec for t, vec in zip(batch, fresh) for _ in missing[t]],
+            )
+        logging.info(f"Embedded {len(miss_texts)} of {len(texts)} chunk texts; cache {self.cache.stats()}")
+        return failed, [indices[0] for indices in missing.values()]
+
+
+class QueryEmbedder:
+    """
+    Query vectors with an LRU (optionally TTL) cache and cross-request micro-batching.
+
+    Single-query cache misses from concurrent callers are queued; a single batcher thread
+    waits up to `window_ms` for more to arrive and embeds them with one provider call. A
+    caller that already brings several misses (`embed_all`) embeds them inline with one
+    call. Concurrent requests for the same query share one pending result.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], List[List[float]]],
+        normalize: Callable[[np.ndarray], np.ndarray],
+        max_size: int = QUERY_CACHE_SIZE,
+        ttl: float = QUERY_CACHE_TTL,
+        window_ms: float = QUERY_BATCH_WINDOW_MS,
+        max_batch: int = QUERY_MAX_BATCH,
+    ):
+        self.embed_many = embed_many
+        self.normalize = normalize
+        self.max_size = max_size
+        self.ttl = ttl
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.hits = 0
+        self.misses = 0
+        self.provider_calls = 0
+
+        self._cache = OrderedDict()  # key -> (vector, stored_at)
+        self._inflight = {}          # key -> Future
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    @staticmethod
+    def key(query: str) -> str:
+        return " ".join(query.split())
+
+    def embed(self, query: str) -> np.ndarray:
+        return self.embed_all([query])[0]
+
+    def embed_all(self, queries: List[str]) -> np.ndarray:
+        """Normalized (len(queries), dim) matrix, sharing cache and in-flight requests."""
+        keys = [self.key(q) for q in queries]
+        results, futures, own = {}, {}, []
+        with self._lock:
+            now = time.monotonic()
+            for key in keys:
+                if key in results or key in futures:
+                    continue
+                entry = self._cache.get(key)
+                if entry is not None and (not self.ttl or now - entry[1] < self.ttl):
+                    self._cache.move_to_end(key)
+                    results[key] = entry[0]
+                    self.hits += 1
+                    continue
+                self.misses += 1
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    own.append((key, future))
+                futures[key] = future
+
+        if len(own) > 1 or (own and self.window <= 0):
+            self._flush(own)  # already a batch, or no batching window: embed inline
+        elif own:
+            self._submit(*own[0])
+        for key, future in futures.items():
+            results[key] = future.result()
+        return np.stack([results[k] for k in keys])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "provider_calls": self.provider_calls,
+        }
+
+    # -------- Batching --------
+    def _submit(self, key: str, future: Future):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="query-embed", daemon=True)
+            self._worker.start()
+        self._queue.put((key, future))
+
+    def _drain(self, first, deadline):
+        batch = [first]
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            self._flush(self._drain(first, time.monotonic() + self.window))
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        keys = [key for key, _ in batch]
+        try:
+            self.provider_calls += 1
+            vectors = self.normalize(np.asarray(self.embed_many(keys), dtype=np.float32))
+        except Exception as e:
+            with self._lock:
+                for key, future in batch:
+                    self._inflight.pop(key, None)
+                    future.set_exception(e)
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            for (key, future), vec in zip(batch, vectors):
+                self._cache[key] = (vec, now)
+                self._cache.move_to_end(key)
+                self._inflight.pop(key, None)
+                future.set_result(vec)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from .config import (
+    FETCH_MAX_CONNECTIONS, FETCH_PER_HOST, FETCH_TIMEOUT, FETCH_PARSE_WORKERS, FETCH_VALIDATOR_CACHE,
+)
+from .utils import FETCH_HEADERS, html_to_text
+
+
+class UrlFetcher:
+    """
+    Async page fetcher for ingest.
+
+    One pooled httpx client is shared by all requests, with at most `per_host` in flight
+    per host. Pages seen before are re-requested with If-None-Match / If-Modified-Since and
+    a 304 reuses the cached text. HTML is parsed in a process pool (`parse_workers=0`
+    parses on a thread instead), so the event loop only waits on sockets. Synchronous code
+    fetches through `fetch_urls`.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = FETCH_MAX_CONNECTIONS,
+        per_host: int = FETCH_PER_HOST,
+        timeout: float = FETCH_TIMEOUT,
+        parse_workers: int = FETCH_PARSE_WORKERS,
+        validator_cache: int = FETCH_VALIDATOR_CACHE,
+    ):
+        self.max_connections = max_connections
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self.parse_workers = parse_workers
+        self.validator_cache = validator_cache
+        self.fetched = 0
+        self.not_modified = 0
+
+        self._validators = OrderedDict()  # url -> (etag, last_modified, text)
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop = None
+        self._host_limits = {}
+        self._parse_pool = None
+
+    # -------- Client --------
+    def _get_client(self) -> httpx.AsyncClient:
+        # httpx clients and semaphores are bound to the loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                headers=FETCH_HEADERS,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._loop = loop
+            self._host_limits = {}
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
+            self._parse_pool = None
+
+    # -------- Parsing --------
+    async def _parse(self, html: str) -> str:
+        # Daemonic processes (Celery's prefork workers) may not start a pool of their own
+        if self.parse_workers <= 0 or multiprocessing.current_process().daemon:
+            return await asyncio.to_thread(html_to_text, html)
+        if self._parse_pool is None:
+            with self._lock:
+                if self._parse_pool is None:
+                    self._parse_pool = ProcessPoolExecutor(
+                        max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+        return await asyncio.get_running_loop().run_in_executor(self._parse_pool, html_to_text, html)
+
+    # -------- Validators --------
+    def _cached(self, url: str):
+        with self._lock:
+            entry = self._validators.get(url)
+            if entry is not None:
+                self._validators.move_to_end(url)
+            return entry
+
+    def _remember(self, url: str, resp: httpx.Response, text: str):
+        etag, last_modified = resp.headers.get("etag"), resp.headers.get("last-modified")
+        if not (etag or last_modified) or self.validator_cache <= 0:
+            return
+        with self._lock:
+            self._validators[url] = (etag, last_modified, text)
+            self._validators.move_to_end(url)
+            while len(self._validators) > self.validator_cache:
+                self._validators.popitem(last=False)
+
+    # -------- Fetching --------
+    async def fetch_text(self, url: str) -> str:
+        """Cleaned text of `url`; raises RuntimeError on network or HTTP errors."""
+        client = self._get_client()
+        cached = self._cached(url)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            async with self._host_limit(url):
+                resp = await client.get(url, headers=headers)
+            if resp.status_code == 304 and cached is not None:
+                self.not_modified += 1
+                return cached[2]
+            resp.raise_for_status()
+        except Exception as e:
+            raise RuntimeError(f"Failed to fetch URL {url}: {e}")
+
+        self.fetched += 1
+        text = await self._parse(resp.text)
+        self._remember(url, resp, text)
+        return text
+
+    async def fetch_many(self, urls: List[str]) -> List[Union[str, Exception]]:
+        """Fetch all urls concurrently; failures are returned in place, not raised."""
+        results = await asyncio.gather(*(self.fetch_text(url) for url in urls), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning(str(result))
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "fetched": self.fetched,
+            "not_modified": self.not_modified,
+            "validators": len(self._validators),
+        }
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> UrlFetcher:
+    """Process-wide fetcher, created on first use."""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = UrlFetcher()
+    return _fetcher
+
+
+_loop = None
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _fetcher_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="url-fetch", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def fetch_urls(urls: List[str]) -> List[Union[str, Exception]]:
+    """
+    `get_fetcher().fetch_many(urls)` from synchronous code, such as ingest tasks. Every call
+    runs on one long-lived event loop, so the fetcher's pooled connections, per-host limits
+    and validators carry over between calls.
+    """
+    return asyncio.run_coroutine_threadsafe(get_fetcher().fetch_many(urls), _background_loop()).result()
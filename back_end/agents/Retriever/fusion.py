@@ -0,0 +1,62 @@
+import numpy as np
+from .config import EPS, RRF_K
+
+FUSION_MODES = ("weighted", "minmax", "zscore", "rrf")
+
+
+def _normalize(scores: np.ndarray, mode: str) -> np.ndarray:
+    """Normalize one source's returned scores so they are comparable across sources."""
+    if scores.size == 0 or mode == "weighted":
+        return scores
+    if mode == "minmax":
+        lo, hi = scores.min(), scores.max()
+        return (scores - lo) / (hi - lo + EPS)
+    return (scores - scores.mean()) / (scores.std() + EPS)
+
+
+def _rrf(scores: np.ndarray, rrf_k: int) -> np.ndarray:
+    """Reciprocal rank contribution of each returned score (rank 1 = best)."""
+    ranks = np.empty(scores.size, dtype=np.float64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, scores.size + 1)
+    return 1.0 / (rrf_k + ranks)
+
+
+def fuse_scores(vec_idx, vec_scores, lex_idx, lex_scores, alpha=0.5, mode="weighted", rrf_k=RRF_K):
+    """
+    Merge vector and lexical candidate lists keyed by chunk position.
+
+    Returns (cand_idx, hybrid, vec, lex): the union of candidate positions, the fused
+    score and the raw per-source scores (0.0 where a source did not return the chunk).
+    """
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Invalid fusion mode: {mode}")
+
+    vec_idx = np.asarray(vec_idx, dtype=np.int64)
+    lex_idx = np.asarray(lex_idx, dtype=np.int64)
+    vec_scores = np.asarray(vec_scores, dtype=np.float64)
+    lex_scores = np.asarray(lex_scores, dtype=np.float64)
+
+    cand_idx, inv = np.unique(np.concatenate([vec_idx, lex_idx]), return_inverse=True)
+    vec_pos, lex_pos = inv[:vec_idx.size], inv[vec_idx.size:]
+
+    vec = np.zeros(cand_idx.size)
+    lex = np.zeros(cand_idx.size)
+    vec[vec_pos] = vec_scores
+    lex[lex_pos] = lex_scores
+
+    if mode == "rrf":
+        v, b = np.zeros(cand_idx.size), np.zeros(cand_idx.size)
+        v[vec_pos] = _rrf(vec_scores, rrf_k)
+        b[lex_pos] = _rrf(lex_scores, rrf_k)
+    elif mode == "weighted":
+        v, b = vec, lex
+    else:
+        # Chunks missing from a source get that source's worst normalized score
+        v_norm, b_norm = _normalize(vec_scores, mode), _normalize(lex_scores, mode)
+        v = np.full(cand_idx.size, v_norm.min() if v_norm.size else 0.0)
+        b = np.full(cand_idx.size, b_norm.min() if b_norm.size else 0.0)
+        v[vec_pos] = v_norm
+        b[lex_pos] = b_norm
+
+    hybrid = alpha * v + (1 - alpha) * b
+    return cand_idx, hybrid, vec, lex
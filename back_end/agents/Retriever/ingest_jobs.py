@@ -0,0 +1,568 @@
+import json
+import time
+import uuid
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .config import (
+    INGEST_REDIS_URL, INGEST_POLL, INGEST_APPLY_BATCH, INGEST_TASK_ITEMS, INGEST_JOB_TTL,
+    EMBED_DIM, DOC_CACHE_CODEC,
+)
+from .doc_cache import DocumentCache, make_document_cache, load_codec, encode_text, decode_text
+from .embed_cache import make_embedding_cache
+from .embedder import ChunkEmbedder
+from .fetcher import fetch_urls
+from .pdf_pool import PdfPageStream
+from .providers import EmbeddingProvider, make_provider
+from .store import RetrieverPersistence
+from .utils import ChunkStream, chunk_documents, make_chunks
+
+COUNTERS = (
+    "documents_prepared", "documents_indexed", "documents_failed", "documents_deleted",
+    "chunks_prepared", "chunks_indexed", "embeddings_completed", "embeddings_computed",
+)
+MAX_ERRORS = 100  # failures kept per job for the status endpoint
+
+
+class IngestJobStore:
+    """
+    Ingest job state in Redis, shared by the API, the Celery workers and the writer.
+
+    Per job: a hash of status and progress counters, the submitted items (so tasks can be
+    re-queued after a crash), the set of item indices whose task has finished (so a
+    redelivered task changes nothing), the prepared documents waiting for the writer and
+    the first MAX_ERRORS failures. Unfinished job ids are kept in one set. Prepared
+    documents are compressed with DOC_CACHE_CODEC, like cached document text, and followed
+    by their chunk vectors as raw float32.
+
+    Delete jobs carry only doc_ids and need no worker; they and compaction requests wait
+    here for the writer, so any API process can accept them.
+    """
+
+    PREFIX = "retriever:ingest:"
+
+    def __init__(self, url: str = INGEST_REDIS_URL, client=None, codec: str = DOC_CACHE_CODEC):
+        if client is None:
+            from redis import Redis
+            client = Redis.from_url(url, decode_responses=True)
+        self._redis = client
+        self.codec = load_codec(codec)
+
+    def _pack(self, doc: dict) -> str:
+        vectors = doc.get("vectors")
+        header = encode_text(json.dumps(doc if vectors is None else {**doc, "vectors": list(vectors.shape)}), self.codec)
+        raw = len(header).to_bytes(4, "little") + header
+        if vectors is not None:
+            raw += np.ascontiguousarray(vectors, dtype="<f4").tobytes()
+        # base64, as replies are decoded to str
+        return base64.b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _unpack(raw: str) -> dict:
+        raw = base64.b64decode(raw)
+        size = int.from_bytes(raw[:4], "little")
+        text = decode_text(raw[4:4 + size])
+        if text is None:
+            raise RuntimeError("A prepared document is compressed with a codec this process cannot read.")
+        doc = json.loads(text)
+        if doc.get("vectors") is not None:
+            doc["vectors"] = np.frombuffer(raw[4 + size:], dtype="<f4").reshape(doc["vectors"])
+        return doc
+
+    def _key(self, job_id: str, part: str = "") -> str:
+        return f"{self.PREFIX}job:{job_id}{part}"
+
+    def _keys(self, job_id: str) -> List[str]:
+        return [self._key(job_id, part) for part in ("", ":items", ":done", ":ready", ":errors")]
+
+    # -------- Submission --------
+    def create(self, items: List[dict], replace: bool = False, kind: str = "ingest") -> str:
+        job_id = uuid.uuid4().hex
+        pipe = self._redis.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            "status": "queued", "kind": kind, "replace": int(replace), "created": time.time(),
+            "documents_total": len(items), **{name: 0 for name in COUNTERS},
+        })
+        pipe.rpush(self._key(job_id, ":items"), *[json.dumps(item) for item in items])
+        pipe.sadd(self.PREFIX + "jobs", job_id)
+        pipe.execute()
+        return job_id
+
+    def create_delete(self, doc_ids: List[str]) -> str:
+        return self.create([{"doc_id": doc_id} for doc_id in doc_ids], kind="delete")
+
+    def request_compaction(self):
+        self._redis.set(self.PREFIX + "compact", 1)
+
+    def kind(self, job_id: str) -> str:
+        return self._redis.hget(self._key(job_id), "kind") or "ingest"
+
+    def replace(self, job_id: str) -> bool:
+        return self._redis.hget(self._key(job_id), "replace") == "1"
+
+    def unfinished_items(self, job_id: str, indices: List[int]) -> List[Tuple[int, dict]]:
+        """(index, item) of `indices` whose task has not finished and whose job still exists, in one round trip."""
+        pipe = self._redis.pipeline(transaction=False)
+        for index in indices:
+            pipe.lindex(self._key(job_id, ":items"), index)
+            pipe.sismember(self._key(job_id, ":done"), index)
+        replies = pipe.execute()
+        return [
+            (index, json.loads(raw))
+            for index, raw, done in zip(indices, replies[::2], replies[1::2])
+            if raw is not None and not done
+        ]
+
+    def pending(self, job_id: str) -> List[int]:
+        """Indices of items whose task has not finished."""
+        total = self._redis.llen(self._key(job_id, ":items"))
+        done = {int(i) for i in self._redis.smembers(self._key(job_id, ":done"))}
+        return [i for i in range(total) if i not in done]
+
+    # -------- Worker side --------
+    def finish_item(self, job_id: str, index: int, doc: dict = None, stats: dict = None, error: str = None) -> bool:
+        """
+        Record the outcome of item `index`: a prepared document for the writer, or an error.
+        Atomic and recorded once; returns False if an earlier delivery already recorded it.
+        """
+        done_key, key = self._key(job_id, ":done"), self._key(job_id)
+
+        def record(pipe):
+            if pipe.sismember(done_key, index):
+                return False
+            pipe.multi()
+            pipe.sadd(done_key, index)
+            pipe.hset(key, "status", "running")
+            if doc is not None:
+                pipe.rpush(self._key(job_id, ":ready"), self._pack(doc))
+                pipe.hincrby(key, "documents_prepared", 1)
+                pipe.hincrby(key, "chunks_prepared", stats["chunks"])
+                pipe.hincrby(key, "embeddings_completed", stats["chunks"] - stats["failed_chunks"])
+                pipe.hincrby(key, "embeddings_computed", stats["embedded"])
+            else:
+                pipe.hincrby(key, "documents_failed", 1)
+                self._push_error(pipe, job_id, index, error)
+            return True
+
+        return self._redis.transaction(record, done_key, value_from_callable=True)
+
+    def _push_error(self, pipe, job_id, index, error, doc_id=None):
+        pipe.rpush(self._key(job_id, ":errors"), json.dumps({"item": index, "doc_id": doc_id, "error": error}))
+        pipe.ltrim(self._key(job_id, ":errors"), 0, MAX_ERRORS - 1)
+
+    # -------- Writer side --------
+    def active(self) -> List[str]:
+        return sorted(self._redis.smembers(self.PREFIX + "jobs"))
+
+    def take_compaction(self) -> bool:
+        """Whether compaction was requested since the last call."""
+        return bool(self._redis.delete(self.PREFIX + "compact"))
+
+    def doc_ids(self, job_id: str) -> List[str]:
+        return [json.loads(raw)["doc_id"] for raw in self._redis.lrange(self._key(job_id, ":items"), 0, -1)]
+
+    def peek_ready(self, job_id: str, limit: int) -> List[dict]:
+        return [self._unpack(raw) for raw in self._redis.lrange(self._key(job_id, ":ready"), 0, limit - 1)]
+
+    def finish_batch(self, job_id: str, n_docs: int, chunks: int, failed: Dict[str, str]):
+        """Drop the first `n_docs` prepared documents, now indexed except for `failed` (doc_id -> error)."""
+        key = self._key(job_id)
+        pipe = self._redis.pipeline()
+        pipe.ltrim(self._key(job_id, ":ready"), n_docs, -1)
+        pipe.hincrby(key, "documents_indexed", n_docs - len(failed))
+        pipe.hincrby(key, "documents_failed", len(failed))
+        pipe.hincrby(key, "chunks_indexed", chunks)
+        for doc_id, error in failed.items():
+            self._push_error(pipe, job_id, None, error, doc_id)
+        pipe.execute()
+
+    def finish_if_complete(self, job_id: str) -> bool:
+        """Mark the job done once every document is indexed or failed; its keys then expire."""
+        job = self._redis.hgetall(self._key(job_id))
+        if not job:
+            self._redis.srem(self.PREFIX + "jobs", job_id)
+            return True
+        if int(job["documents_indexed"]) + int(job["documents_failed"]) < int(job["documents_total"]):
+            return False
+        self._finish(self._redis.pipeline(), job_id)
+        return True
+
+    def finish_delete(self, job_id: str, deleted: int):
+        """Record that a delete job ran, removing `deleted` of its documents (the rest were not indexed)."""
+        pipe = self._redis.pipeline()
+        pipe.hset(self._key(job_id), "documents_deleted", deleted)
+        self._finish(pipe, job_id)
+
+    def _finish(self, pipe, job_id: str):
+        pipe.hset(self._key(job_id), mapping={"status": "done", "finished": time.time()})
+        pipe.srem(self.PREFIX + "jobs", job_id)
+        for key in self._keys(job_id):
+            pipe.expire(key, INGEST_JOB_TTL)
+        pipe.execute()
+
+    # -------- Status --------
+    def status(self, job_id: str) -> Optional[dict]:
+        job = self._redis.hgetall(self._key(job_id))
+        if not job:
+            return None
+        n = {name: int(job.get(name, 0)) for name in COUNTERS + ("documents_total",)}
+        return {
+            "job_id": job_id,
+            "kind": job.get("kind", "ingest"),
+            "status": job["status"],
+            "replace": job["replace"] == "1",
+            "created": float(job["created"]),
+            "finished": float(job["finished"]) if "finished" in job else None,
+            "documents": {
+                "total": n["documents_total"], "prepared": n["documents_prepared"],
+                "indexed": n["documents_indexed"], "failed": n["documents_failed"],
+                "deleted": n["documents_deleted"],
+            },
+            "chunks": {"prepared": n["chunks_prepared"], "indexed": n["chunks_indexed"]},
+            # completed: chunk vectors ready for the writer; computed: of those, not cache hits
+            "embeddings": {"completed": n["embeddings_completed"], "computed": n["embeddings_computed"]},
+            "errors": [json.loads(raw) for raw in self._redis.lrange(self._key(job_id, ":errors"), 0, -1)],
+        }
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_job_store() -> IngestJobStore:
+    """Process-wide job store, created on first use."""
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = IngestJobStore()
+    return _jobs
+
+
+_doc_cache = None
+
+
+def get_doc_cache() -> DocumentCache:
+    """Process-wide document cache, created on first use."""
+    global _doc_cache
+    if _doc_cache is None:
+        with _jobs_lock:
+            if _doc_cache is None:
+                _doc_cache = make_document_cache()
+    return _doc_cache
+
+
+def submit_job(items: List[dict], replace: bool = False) -> str:
+    """Record a job and queue one task per INGEST_TASK_ITEMS items; returns the job id."""
+    jobs = get_job_store()
+    job_id = jobs.create(items, replace)
+    requeue(job_id, range(len(items)))
+    logging.info(f"Queued ingest job {job_id} with {len(items)} documents.")
+    return job_id
+
+
+def requeue(job_id: str, indices, per_task: int = INGEST_TASK_ITEMS) -> int:
+    """Queue tasks for `indices`; tasks skip finished items, so re-queuing one is harmless."""
+    from .tasks import ingest_documents_task
+
+    indices = list(indices)
+    for start in range(0, len(indices), per_task):
+        ingest_documents_task.delay(job_id, indices[start:start + per_task])
+    return len(indices)
+
+
+# -------- Worker side --------
+class DocumentPreparer:
+    """
+    Chunks and embeds documents for the writer, which indexes the vectors they come with
+    rather than embedding them again, whichever host prepared them. Needs the embedding
+    provider (and cache) but no index, so ingest workers never load the corpus or write to it.
+    """
+
+    def __init__(self, provider: EmbeddingProvider = None):
+        provider = provider or make_provider()
+        self.model_id = provider.model_id
+        dim = EMBED_DIM or provider.dim or RetrieverPersistence.cached_dim(provider.model_id) or provider.probe_dim()
+        self.embedder = ChunkEmbedder(provider, dim, make_embedding_cache(provider.model_id, dim))
+
+    def prepare(self, docs: List[dict], chunk_size=500, chunk_overlap=100) -> List[Union[dict, Exception]]:
+        """
+        Chunk `docs` ({doc_id, title, meta} and `text`) as the writer will and embed their
+        chunks, those of whole texts together in provider batches that span documents. A doc
+        may bring `pages` instead: lists of page texts as they are parsed (see
+        PdfPageStream.ranges), whose chunks are embedded while the next pages parse.
+
+        Per doc: its text, its normalized chunk vectors (None if one of its batches failed)
+        and counts of chunks, texts sent to the provider and failed chunks; or the exception
+        reading its pages raised.
+        """
+        texts = [doc.get("text") for doc in docs]
+        chunks = [[] for _ in docs]
+        vectors = [{} for _ in docs]  # chunk position -> vector
+        failed, computed, errors = [0] * len(docs), [0] * len(docs), {}
+
+        def embed(units):
+            # units: (doc, position of its first chunk, chunks); runs on one thread at a time
+            owners = [(d, start + i) for d, start, new in units for i in range(len(new))]
+
+            def on_vectors(indices, vecs):
+                for j, vec in zip(indices, vecs):
+                    d, pos = owners[j]
+                    vectors[d][pos] = vec
+
+            bad, fresh = self.embedder.embed_into([c.text for _, _, new in units for c in new], on_vectors)
+            for j in bad:
+                failed[owners[j][0]] += 1
+            for j in fresh:
+                computed[owners[j][0]] += 1
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare") as pool:
+            whole = []
+            for d, doc in enumerate(docs):
+                if "pages" not in doc:
+                    chunks[d] = chunk_documents([doc], doc["meta"]["source_type"], chunk_size, chunk_overlap)[0]
+                    whole.append((d, 0, chunks[d]))
+            embedding = [pool.submit(embed, whole)]
+
+            def add(d, chunk_data):
+                new = make_chunks(chunk_data, docs[d]["meta"]["source_type"])
+                if new:
+                    embedding.append(pool.submit(embed, [(d, len(chunks[d]), new)]))
+                    chunks[d].extend(new)
+
+            for d, doc in enumerate(docs):
+                if "pages" not in doc:
+                    continue
+                stream = ChunkStream(chunk_size, chunk_overlap, doc["doc_id"], doc.get("title"), doc["meta"])
+                pieces = []
+                try:
+                    for page_texts in doc["pages"]:
+                        pieces.extend(page_texts)
+                        add(d, [c for text in page_texts for c in stream.feed(text)])
+                except Exception as e:
+                    errors[d] = e
+                    continue
+                add(d, stream.close())
+                texts[d] = " ".join(pieces)
+            for future in embedding:
+                future.result()
+
+        results = []
+        for d, doc_chunks in enumerate(chunks):
+            if d in errors:
+                results.append(errors[d])
+                continue
+            n = len(doc_chunks)
+            results.append({
+                "text": texts[d],
+                "vectors": None if failed[d] else np.array([vectors[d][pos] for pos in range(n)], dtype=np.float32).reshape(n, self.embedder.dim),
+                "chunks": n, "embedded": computed[d], "failed_chunks": failed[d],
+            })
+        return results
+
+
+_preparer = None
+
+
+def get_preparer() -> DocumentPreparer:
+    """Process-wide document preparer, created on first use."""
+    global _preparer
+    if _preparer is None:
+        with _jobs_lock:
+            if _preparer is None:
+                _preparer = DocumentPreparer()
+    return _preparer
+
+
+def item_source(item: dict) -> str:
+    if item.get("source_type"):
+        return item["source_type"]
+    return "text" if item.get("text") else "url" if item.get("url") else "pdf"
+
+
+def item_meta(item: dict) -> dict:
+    meta = {"source_type": item_source(item)}
+    if item.get("text"):
+        return meta
+    if item.get("url"):
+        return {**meta, "url": item["url"]}
+    if item.get("file_path"):
+        return {**meta, "file": item["file_path"]}
+    raise ValueError("Provide text, URL, or file_path.")
+
+
+def extract_texts(items: List[dict]) -> List[Union[Tuple[Union[str, PdfPageStream], dict], Exception]]:
+    """
+    (text, meta) of each ingest item (its raw text or a fetched page), (PdfPageStream, meta)
+    for a PDF, or the exception extracting it raised. PDFs parse in the PDF pool, each within
+    PDF_TIMEOUT, while the pages are fetched together through the process-wide fetcher.
+    """
+    results, urls = [None] * len(items), []
+    for i, item in enumerate(items):
+        try:
+            meta = item_meta(item)
+            if item.get("text"):
+                results[i] = (item["text"].strip(), meta)
+            elif item.get("url"):
+                urls.append((i, meta))
+            else:
+                results[i] = (PdfPageStream(item["file_path"]), meta)
+        except Exception as e:
+            results[i] = e
+    if urls:
+        for (i, meta), text in zip(urls, fetch_urls([items[i]["url"] for i, _ in urls])):
+            results[i] = text if isinstance(text, Exception) else (text or "", meta)
+    return results
+
+
+def prepare_documents(jobs: IngestJobStore, preparer: DocumentPreparer, job_id: str, indices: List[int],
+                      cache: DocumentCache = None) -> dict:
+    """
+    Extract, chunk and embed items `indices` of a job, and hand each to the writer with its
+    chunk vectors. The unfinished items are read in one round trip, the cached texts of their
+    URLs and files in another, and newly extracted texts are cached in a third; the chunks of
+    all items are embedded together, and those of PDFs as their pages parse.
+
+    Returns counts by outcome; items that could not be extracted for a possibly transient
+    reason are left unfinished and returned in "retry" (index -> exception).
+    """
+    cache = cache if cache is not None else get_doc_cache()
+    todo = jobs.unfinished_items(job_id, indices)
+    keys = [cache.key(item) for _, item in todo]
+    texts = cache.lookup(keys)
+    misses = [n for n, text in enumerate(texts) if text is None]
+    extracted = dict(zip(misses, extract_texts([todo[n][1] for n in misses])))
+
+    counts = {"prepared": 0, "duplicate": 0, "failed": 0, "skipped": len(indices) - len(todo)}  # finished or expired
+    retry, fresh, docs = {}, [], []
+    for n, ((index, item), text) in enumerate(zip(todo, texts)):
+        if text is not None:
+            source, meta = text, item_meta(item)
+        elif isinstance(extracted[n], Exception):
+            source, meta = extracted[n], None
+        else:
+            source, meta = extracted[n]
+        doc = {"doc_id": item["doc_id"], "title": item.get("title") or "", "meta": meta}
+        if isinstance(source, PdfPageStream):
+            doc["pages"] = ([page["text"] for page in pages] for pages in source.ranges())
+        elif isinstance(source, str):
+            doc["text"] = source
+        docs.append((n, index, doc, source))
+
+    ready = [(n, index, doc) for n, index, doc, source in docs if not isinstance(source, Exception)]
+    outcomes = dict(zip([n for n, _, _ in ready], preparer.prepare([doc for _, _, doc in ready])))
+    for n, index, doc, source in docs:
+        result = outcomes.get(n, source)
+        if isinstance(result, ValueError):
+            # A malformed item or unreadable file fails the same way every time
+            jobs.finish_item(job_id, index, error=str(result))
+            counts["failed"] += 1
+            continue
+        if isinstance(result, Exception):
+            retry[index] = result
+            continue
+        if texts[n] is None and keys[n] is not None and result["text"]:
+            fresh.append((keys[n], result["text"], cache.ttl(todo[n][1])))
+        doc = {key: value for key, value in doc.items() if key != "pages"}
+        doc.update(text=result.pop("text"), vectors=result.pop("vectors"), model=preparer.model_id)
+        counts["prepared" if jobs.finish_item(job_id, index, doc=doc, stats=result) else "duplicate"] += 1
+    cache.store(fresh)
+    return {**counts, "retry": retry}
+
+
+# -------- Writer side --------
+class IngestJobRunner:
+    """
+    Writer loop that indexes the documents workers have prepared, for every unfinished job,
+    and applies queued deletes and compaction requests.
+
+    Documents are indexed up to `batch` at a time, grouped by source, and the state is saved
+    before they are dropped from the job. A writer that dies in between indexes them again
+    on restart; ingest skips documents already indexed and upserts replace them, so
+    re-indexing leaves the same state. Deletes are likewise saved before their job is done.
+    """
+
+    def __init__(self, engine, jobs: IngestJobStore = None, poll: float = INGEST_POLL, batch: int = INGEST_APPLY_BATCH):
+        self.engine = engine
+        self.jobs = jobs or get_job_store()
+        self.poll = poll
+        self.batch = max(1, batch)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retriever-ingest", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                worked = self.run_once()
+            except Exception:
+                logging.exception("Ingest job runner failed; retrying.")
+                time.sleep(10 * self.poll)
+                continue
+            if not worked:
+                time.sleep(self.poll)
+
+    def run_once(self) -> bool:
+        """Index one batch of every job with prepared documents; False if there was nothing to do."""
+        worked = False
+        for job_id in self.jobs.active():
+            if self.jobs.kind(job_id) == "delete":
+                self._delete(job_id)
+                worked = True
+                continue
+            docs = self.jobs.peek_ready(job_id, self.batch)
+            if docs:
+                self._index(job_id, docs)
+                worked = True
+            self.jobs.finish_if_complete(job_id)
+        if self.jobs.take_compaction():
+            if not self.engine.compact() and not self.engine.maintenance_status()["compacting"]:
+                self.jobs.request_compaction()  # waiting on an ANN build; try again next poll
+            worked = True
+        return worked
+
+    def _delete(self, job_id: str):
+        result = self.engine.delete(self.jobs.doc_ids(job_id))
+        if result["deleted_docs"]:
+            self.engine.save()
+        self.jobs.finish_delete(job_id, len(result["deleted_docs"]))
+        logging.info(f"Delete job {job_id}: deleted {len(result['deleted_docs'])} documents ({result['deleted_chunks']} chunks).")
+
+    def _index(self, job_id: str, docs: List[dict]):
+        replace = self.jobs.replace(job_id)
+        by_source = defaultdict(list)
+        for doc in docs:
+            by_source[doc["meta"]["source_type"]].append(doc)
+        chunks, failed = 0, {}
+        for source, source_docs in by_source.items():
+            result = self.engine.ingest_batch(source_docs, source_type=source, replace=replace)
+            chunks += result["added_chunks"]
+            failed.update((doc_id, "Embedding failed.") for doc_id in result.get("failed_docs", []))
+            empty = "No text to index; its previous version was deleted." if replace else "No text to index."
+            failed.update((doc_id, empty) for doc_id in result.get("empty_docs", []))
+        self.engine.save()
+        self.jobs.finish_batch(job_id, len(docs), chunks, failed)
+        logging.info(f"Ingest job {job_id}: indexed {len(docs) - len(failed)} documents ({chunks} chunks).")
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_ingest_runner(engine) -> IngestJobRunner:
+    """Start the writer's job runner once per process."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = IngestJobRunner(engine)
+            _runner.start()
+    return _runner
@@ -0,0 +1,240 @@
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+def merge_postings(parts, n_terms: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Concatenate postings per term: `parts` are (lengths per term, docs, tfs), each docs/tfs
+    grouped by term; returns one CSR (offsets, docs, tfs) with the parts in order per term.
+    """
+    lengths = [np.pad(part[0], (0, n_terms - len(part[0]))) for part in parts]
+    offsets = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(sum(lengths, np.zeros(n_terms, dtype=np.int64)), out=offsets[1:])
+    docs = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.int32)
+    start = offsets[:-1].copy()
+    for length, (_, part_docs, part_tfs) in zip(lengths, parts):
+        total = int(length.sum())
+        if total:
+            dest = np.repeat(start - np.concatenate([[0], np.cumsum(length)[:-1]]), length) + np.arange(total)
+            docs[dest], tfs[dest] = part_docs[:total], part_tfs[:total]
+        start += length
+    return offsets, docs, tfs
+
+
+def postings_from_tokens(values: np.ndarray, offsets: np.ndarray, first_row: int, n_terms: int):
+    """
+    CSR postings (offsets, docs, tfs) of consecutive rows given as ragged term ids, the
+    first being position `first_row`; docs ascend within each term.
+    """
+    rows = np.repeat(np.arange(first_row, first_row + len(offsets) - 1), np.diff(offsets))
+    tids = np.asarray(values[offsets[0]:offsets[-1]], dtype=np.int64)
+    order = np.lexsort((rows, tids))
+    tids, rows = tids[order], rows[order]
+    starts = np.flatnonzero(np.concatenate([[True], (tids[1:] != tids[:-1]) | (rows[1:] != rows[:-1])])) if tids.size else tids
+    tfs = np.diff(np.append(starts, tids.size)).astype(np.int32)
+    lengths = np.bincount(tids[starts], minlength=n_terms)
+    csr = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(lengths, out=csr[1:])
+    return csr, rows[starts].astype(np.int32), tfs
+
+
+class InvertedIndex:
+    """
+    Incremental BM25 index.
+
+    Each term keeps a postings list of (chunk position, term frequency); document lengths
+    and frequencies are updated on `add`, so ingest never rebuilds the whole index and a
+    query only touches the postings of its own terms. Term ids from `intern` double as the
+    chunk store's token ids.
+
+    A loaded index keeps the saved postings as read-only CSR arrays, one per saved segment
+    (memory-mapped when possible, so processes serving the same snapshot share them);
+    postings added afterwards go to per-term arrays.
+
+    One thread writes; queries score a `view()`, which only sees the documents and terms
+    present when it was taken, so they need no lock while ingest appends.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.terms: List[str] = []  # term id -> term
+        self._post_docs: List[array] = []
+        self._post_tfs: List[array] = []
+        self._bases = []  # (offsets, docs, tfs) of each loaded postings segment, in position order
+        self._doc_len = np.zeros(0, dtype=np.int32)
+        self._n_docs = 0
+        self._total_len = 0
+
+    def __len__(self):
+        return self._n_docs
+
+    # -------- Ingest --------
+    def intern(self, tokens: List[str]) -> np.ndarray:
+        """Term ids of `tokens` (int32), registering unseen terms."""
+        ids = np.empty(len(tokens), dtype=np.int32)
+        for i, term in enumerate(tokens):
+            tid = self.vocab.get(term)
+            if tid is None:
+                tid = len(self.terms)
+                self._post_docs.append(array("i"))
+                self._post_tfs.append(array("i"))
+                self.terms.append(term)
+                self.vocab[term] = tid  # last: a reader finding the term finds its postings
+            ids[i] = tid
+        return ids
+
+    def empty_like(self) -> "InvertedIndex":
+        """An index with the same parameters and term ids but no documents."""
+        index = InvertedIndex(self.k1, self.b)
+        index.vocab = dict(self.vocab)
+        index.terms = list(self.terms)
+        index._post_docs = [array("i") for _ in index.terms]
+        index._post_tfs = [array("i") for _ in index.terms]
+        return index
+
+    def sync_terms(self, other: "InvertedIndex"):
+        """Register the terms `other` interned since this index was copied from it, with the same ids."""
+        self.intern(other.terms[len(self.terms):])
+
+    def add(self, docs: Iterable[List[str]]):
+        """Append tokenized documents; positions continue from the current size."""
+        self.add_ids(self.intern(tokens) for tokens in docs)
+
+    def add_ids(self, docs: Iterable[np.ndarray]):
+        """Append documents given as interned term ids."""
+        for ids in docs:
+            pos = self._n_docs
+            for tid, tf in zip(*np.unique(ids, return_counts=True)):
+                self._post_docs[tid].append(pos)
+                self._post_tfs[tid].append(int(tf))
+            self._append_len(len(ids))
+
+    def _append_len(self, n_tokens: int):
+        if self._n_docs == len(self._doc_len):
+            grown = np.zeros(max(1024, 2 * len(self._doc_len)), dtype=np.int32)
+            grown[:self._n_docs] = self._doc_len[:self._n_docs]
+            self._doc_len = grown
+        self._doc_len[self._n_docs] = n_tokens
+        self._n_docs += 1
+        self._total_len += n_tokens
+
+    def _postings(self, tid: int, n_docs: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Postings of `tid` among the first `n_docs` documents."""
+        docs, tfs = [], []
+        for offsets, base_docs, base_tfs in self._bases:
+            if tid < len(offsets) - 1:
+                s, e = offsets[tid], offsets[tid + 1]
+                docs.append(base_docs[s:e])
+                tfs.append(base_tfs[s:e])
+        # Slicing copies without exporting a buffer, so the writer can keep appending; the two
+        # copies may differ past `n_docs`, which is cut off below
+        docs.append(np.frombuffer(self._post_docs[tid][:], dtype=np.int32))
+        tfs.append(np.frombuffer(self._post_tfs[tid][:], dtype=np.int32))
+        docs = np.concatenate(docs)
+        k = int(np.searchsorted(docs, n_docs))  # positions ascend within a term
+        return docs[:k].astype(np.int64), np.concatenate(tfs)[:k].astype(np.float32)
+
+    # -------- Scoring --------
+    def score(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 scores for every chunk containing a query term, as (positions, scores)."""
+        return self.score_many([query_tokens])[0]
+
+    def score_many(self, queries: List[List[str]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        `score` for several queries at once. Each distinct term's postings are weighted once,
+        and all (query, chunk) sums come from a single unique/bincount.
+        """
+        return self.view().score_many(queries)
+
+    def view(self) -> "LexicalView":
+        """The index as it is now, unaffected by documents and terms added later."""
+        return LexicalView(self, self._n_docs, self._total_len, len(self.terms), self._doc_len)
+
+    def _score_many(self, queries, n: int, total_len: int, n_terms: int, doc_len: np.ndarray):
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not n or not queries:
+            return [empty for _ in queries]
+
+        avgdl = total_len / n
+        term_docs, term_weights = {}, {}
+        docs, weights = [], []
+        for q, tokens in enumerate(queries):
+            for term, qtf in Counter(tokens).items():
+                tid = self.vocab.get(term)
+                if tid is None or tid >= n_terms:
+                    continue
+                if tid not in term_docs:
+                    d, tf = self._postings(tid, n)
+                    idf = math.log(1.0 + (n - d.size + 0.5) / (d.size + 0.5))
+                    norm = self.k1 * (1 - self.b + self.b * doc_len[d] / avgdl)
+                    term_docs[tid] = d
+                    term_weights[tid] = idf * tf * (self.k1 + 1) / (tf + norm)
+                docs.append(term_docs[tid] + q * n)  # (query, chunk) packed into one key
+                weights.append(qtf * term_weights[tid])
+
+        if not docs:
+            return [empty for _ in queries]
+
+        keys, inv = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(weights), minlength=keys.size).astype(np.float32)
+        bounds = np.searchsorted(keys, np.arange(len(queries) + 1) * n)
+        return [
+            (keys[lo:hi] - q * n, scores[lo:hi])
+            for q, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+
+    # -------- Persistence --------
+    @classmethod
+    def from_segments(cls, terms: List[str], bases, doc_len: np.ndarray, k1: float = 1.5, b: float = 0.75) -> "InvertedIndex":
+        """An index over saved postings segments (offsets, docs, tfs) and per-document lengths."""
+        index = cls(k1=k1, b=b)
+        index.terms = terms
+        index.vocab = {t: i for i, t in enumerate(terms)}
+        index._post_docs = [array("i") for _ in terms]
+        index._post_tfs = [array("i") for _ in terms]
+        index._bases = list(bases)
+        index._doc_len = doc_len
+        index._n_docs = len(doc_len)
+        index._total_len = int(doc_len.sum())
+        return index
+
+    def extend_segments(self, terms: List[str], bases, doc_len: np.ndarray):
+        """
+        Follow a newer snapshot of the same index: register `terms` added since, take its
+        postings segments (covering these and any newer documents) and the new lengths.
+        """
+        self._doc_len = doc_len
+        self._total_len = int(doc_len.sum())
+        self._n_docs = len(doc_len)
+        self.intern(terms)
+        self._bases = list(bases)
+
+
+class LexicalView:
+    """
+    Read-only view of an InvertedIndex: BM25 over its first `n_docs` documents and `n_terms`
+    terms, with the collection statistics they had when the view was taken.
+    """
+
+    def __init__(self, index: InvertedIndex, n_docs: int, total_len: int, n_terms: int, doc_len: np.ndarray):
+        self.index = index
+        self.n_docs = n_docs
+        self.total_len = total_len
+        self.n_terms = n_terms
+        self.doc_len = doc_len  # the writer grows the lengths into a new array, never this one's prefix
+
+    def __len__(self):
+        return self.n_docs
+
+    def score(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.score_many([query_tokens])[0]
+
+    def score_many(self, queries: List[List[str]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return self.index._score_many(queries, self.n_docs, self.total_len, self.n_terms, self.doc_len)
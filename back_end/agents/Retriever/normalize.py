@@ -0,0 +1,55 @@
+import re
+from typing import Dict, Optional, Sequence
+
+
+class TextNormalizer:
+    """
+    Drop noise patterns and collapse whitespace in one regex pass.
+
+    The patterns are compiled into a single alternation tried in the given order at each
+    position. A dropped span also takes its trailing whitespace, so no double spaces are
+    left behind. Patterns are case-sensitive unless they scope a flag, e.g. `(?i:...)`.
+    """
+
+    def __init__(self, drop: Sequence[str], max_chars: Optional[int] = None):
+        self.max_chars = max_chars
+        self._pattern = re.compile("|".join(f"(?:{p})\\s*" for p in drop) + r"|(?P<ws>\s+)")
+
+    @staticmethod
+    def _replace(m: re.Match) -> str:
+        return " " if m.group("ws") else ""
+
+    def __call__(self, text: str) -> str:
+        if not text:
+            return ""
+        text = self._pattern.sub(self._replace, text).strip()
+        return text[:self.max_chars] if self.max_chars else text
+
+
+PROFILES: Dict[str, TextNormalizer] = {
+    # Applied once per chunk at ingest; retrieval serves the stored text as-is
+    "retriever": TextNormalizer([
+        r"\b97[89][0-9]{10}\b",                                # ISBNs
+        r"(?i:\b\d+(\.\d+)?\s?(cm|mm|inch|inches|kg|lbs)\b)",  # product dimensions
+        r"\b[A-Z0-9]{8,}\b",                                   # ASINs / SKU-like codes
+        r"(?i:\bPage\s?\d+\b)",                                # page numbers
+    ]),
+    # Evidence handed to the extractor by the pipeline
+    "pipeline": TextNormalizer([
+        r"(?i:Cached - Similar pages.*|Search Preferences.*|Next Search.*)",  # search-page chrome, to end of line
+        r"(?i:\bISBN[- ]?\d+\b)",
+        r"\b\d{4}\b",
+        r"\b\d+(\.\d+)?\s*(cm|kg|lbs|in|mm)\b",
+        r"\b[A-Z0-9]{8,}\b",
+        r"\b\d{5,}\b",
+    ], max_chars=1000),
+}
+
+
+def normalize_text(text: str, profile: str = "retriever") -> str:
+    """Clean `text` with a named profile from PROFILES."""
+    try:
+        normalizer = PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Invalid normalization profile: {profile}")
+    return normalizer(text)
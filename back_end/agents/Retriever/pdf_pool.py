@@ -0,0 +1,106 @@
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List
+
+from PyPDF2 import PdfReader
+
+from .config import PDF_WORKERS, PDF_PAGES_PER_TASK, PDF_TIMEOUT
+from .utils import clean_text
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> Executor:
+    """
+    Shared pool for PDF parsing, created on first use: processes, or threads in a process
+    that may not start children (Celery's prefork workers are daemonic).
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None and multiprocessing.current_process().daemon:
+                _pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+            elif _pool is None:
+                # spawn: the API process runs threads (loader, FAISS) that fork would copy mid-state
+                _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _open(file_path: str) -> PdfReader:
+    reader = PdfReader(file_path)
+    if reader.is_encrypted:
+        reader.decrypt("")  # try empty password
+    return reader
+
+
+def _extract_range(file_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Worker: clean text of pages [start, end), skipping empty pages."""
+    reader = _open(file_path)
+    pages = []
+    for i in range(start, min(end, len(reader.pages))):
+        page_text = clean_text(reader.pages[i].extract_text() or "")
+        if page_text:
+            pages.append({"page": i + 1, "text": page_text})
+    return pages
+
+
+class PdfPageStream:
+    """
+    Pages of one PDF, extracted in the shared process pool.
+
+    Work is submitted on construction: small files as a single task, large ones as page
+    ranges of `pages_per_task`, so several files and ranges parse in parallel. `ranges`
+    yields the pages of each range in order as it completes (iterating yields single
+    pages), so callers can use the first pages while the rest parse.
+
+    A missing or unreadable file raises ValueError, as it fails the same way every time;
+    exceeding `timeout` seconds or a crashed worker raise RuntimeError. On a thread pool
+    the timed-out ranges still finish in the background, but the caller moves on.
+    """
+
+    def __init__(self, file_path: str, pages_per_task: int = PDF_PAGES_PER_TASK, timeout: float = PDF_TIMEOUT):
+        self.file_path = file_path
+        self.timeout = timeout
+        try:
+            n_pages = len(_open(file_path).pages)
+        except Exception as e:
+            raise ValueError(f"Failed to read PDF {file_path}: {e}")
+
+        pool = get_pdf_pool()
+        self._started = time.monotonic()
+        self._futures = [
+            pool.submit(_extract_range, file_path, start, start + pages_per_task)
+            for start in range(0, n_pages, max(1, pages_per_task))
+        ]
+
+    def ranges(self) -> Iterator[List[Dict[str, Any]]]:
+        try:
+            for future in self._futures:
+                remaining = self.timeout - (time.monotonic() - self._started)
+                try:
+                    pages = future.result(timeout=max(0.0, remaining))
+                except FutureTimeout:
+                    raise RuntimeError(f"Timed out after {self.timeout}s reading PDF {self.file_path}")
+                except BrokenProcessPool as e:
+                    _reset_pool()
+                    raise RuntimeError(f"PDF worker crashed reading {self.file_path}: {e}")
+                except Exception as e:
+                    raise ValueError(f"Failed to read PDF {self.file_path}: {e}")
+                yield pages
+        finally:
+            for future in self._futures:
+                future.cancel()
+
+    def __iter__(self):
+        for pages in self.ranges():
+            yield from pages
@@ -0,0 +1,199 @@
+import os
+import zlib
+import logging
+import functools
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from .config import (
+    EMBED_PROVIDER, OPENAI_API_KEY, COHERE_API_KEY, EMBED_MODEL, OPENAI_EMBED_MODEL, KNOWN_EMBED_DIMS,
+    EMBED_BATCH_SIZE, EMBED_CONCURRENCY,
+    LOCAL_EMBED_MODEL, LOCAL_EMBED_DEVICE, LOCAL_EMBED_THREADS, LOCAL_EMBED_BATCH_SIZE,
+    LOCAL_EMBED_BACKEND, LOCAL_EMBED_INT8, LOCAL_EMBED_ONNX_FILE, HASHING_EMBED_DIM,
+)
+
+
+class EmbeddingProvider:
+    """
+    Source of document and query embeddings.
+
+    A provider declares `model_id` (recorded in the index manifest and embedding cache keys,
+    so vectors from different models never mix) and `dim` (None if only known after a probe),
+    plus the batch size and concurrency ingest should use with it. Vectors come back as a
+    float32 (n, dim) array; the engine normalizes them.
+    """
+
+    name = "base"
+    model_id: str = ""
+    dim: Optional[int] = None
+    batch_size: int = EMBED_BATCH_SIZE
+    concurrency: int = EMBED_CONCURRENCY
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        return self.embed_documents(texts)
+
+    def probe_dim(self) -> int:
+        return len(self.embed_queries(["dimension-check-phrase"])[0])
+
+
+class OpenAIProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_EMBED_MODEL):
+        from langchain.embeddings import OpenAIEmbeddings
+
+        self.model_id = model
+        self.dim = KNOWN_EMBED_DIMS.get(model)
+        self._client = OpenAIEmbeddings(model=model)
+
+    def embed_documents(self, texts):
+        return np.asarray(self._client.embed_documents(texts), dtype=np.float32)
+
+
+class CohereProvider(EmbeddingProvider):
+    name = "cohere"
+
+    def __init__(self, model: str = EMBED_MODEL, api_key: str = COHERE_API_KEY):
+        from langchain_community.embeddings import CohereEmbeddings
+
+        self.model_id = model
+        self.dim = KNOWN_EMBED_DIMS.get(model)
+        self._client = CohereEmbeddings(model=model, cohere_api_key=api_key)
+
+    def embed_documents(self, texts):
+        return np.asarray(self._client.embed_documents(texts), dtype=np.float32)
+
+    def embed_queries(self, texts):
+        # Cohere embeds queries and documents differently; embed_query uses this input type
+        return np.asarray(self._client.embed(texts, input_type="search_query"), dtype=np.float32)
+
+
+def local_model_id(model: str, backend: str = "torch", int8: bool = False, onnx_file: str = None) -> str:
+    """
+    model_id of a local model: its absolute path if it is a directory on disk, else its hub
+    id, so two models in different directories never share vectors; plus the variant run.
+    """
+    name = os.path.abspath(model) if os.path.isdir(model) else model
+    if backend == "onnx":
+        variant = os.path.splitext(os.path.basename(onnx_file))[0] if onnx_file else "onnx"
+    else:
+        variant = "int8" if int8 else None
+    return f"local:{name}" + (f"+{variant}" if variant else "")
+
+
+class LocalProvider(EmbeddingProvider):
+    """
+    On-disk sentence-embedding model run on CPU with sentence-transformers.
+
+    `backend="onnx"` runs the model with ONNX Runtime (`onnx_file` picks e.g. an int8
+    export); `int8=True` on the torch backend applies dynamic int8 quantization to the
+    linear layers. Inference uses `threads` intra-op threads and one batch at a time, as
+    parallel batches would only compete for the same cores. Each `encode` call sorts its
+    texts by length, so batches carry little padding.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model: str = LOCAL_EMBED_MODEL,
+        device: str = LOCAL_EMBED_DEVICE,
+        threads: int = LOCAL_EMBED_THREADS,
+        batch_size: int = LOCAL_EMBED_BATCH_SIZE,
+        backend: str = LOCAL_EMBED_BACKEND,
+        int8: bool = LOCAL_EMBED_INT8,
+        onnx_file: str = LOCAL_EMBED_ONNX_FILE,
+    ):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("The local embedding provider needs the sentence-transformers package.")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Invalid local embedding backend: {backend}")
+
+        self.batch_size = max(1, batch_size)
+        self.concurrency = 1
+        self._lock = threading.Lock()
+        model_kwargs = {}
+        if backend == "onnx":
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            model_kwargs = {"session_options": options, "provider": "CPUExecutionProvider"}
+            if onnx_file:
+                model_kwargs["file_name"] = onnx_file
+        else:
+            import torch
+
+            if threads:
+                torch.set_num_threads(threads)
+
+        self._model = SentenceTransformer(model, device=device, backend=backend, model_kwargs=model_kwargs or None)
+        if backend == "torch" and int8:
+            import torch
+
+            self._model = torch.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self.model_id = local_model_id(model, backend, int8, onnx_file)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        logging.info(f"Loaded local embedding model {self.model_id} (dim {self.dim}, {backend}).")
+
+    def embed_documents(self, texts):
+        with self._lock:
+            return self._model.encode(
+                list(texts), batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+            ).astype(np.float32)
+
+
+class HashingProvider(EmbeddingProvider):
+    """
+    Deterministic, offline embeddings by signed feature hashing of lower-cased words.
+    Texts sharing words get similar vectors, which is enough for tests and benchmarks.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = HASHING_EMBED_DIM):
+        self.dim = dim
+        self.model_id = f"hashing-{dim}"
+
+    def embed_documents(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                col, sign = _bucket(word, self.dim)
+                out[i, col] += sign
+        return out
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _bucket(word: str, dim: int):
+    """(column, sign) of a word; cached for frequent words, bounded for large vocabularies."""
+    h = zlib.crc32(word.encode("utf-8"))
+    return h % dim, 1.0 if (h >> 16) & 1 else -1.0
+
+
+PROVIDERS = {p.name: p for p in (OpenAIProvider, CohereProvider, LocalProvider, HashingProvider)}
+
+
+def make_provider(name: str = EMBED_PROVIDER) -> EmbeddingProvider:
+    """Provider from RETRIEVER_EMBED_PROVIDER; "auto" picks OpenAI or Cohere by which API key is set."""
+    if name == "auto":
+        if OPENAI_API_KEY:
+            name = "openai"
+        elif COHERE_API_KEY:
+            name = "cohere"
+        else:
+            raise RuntimeError("No API key found for embeddings; set RETRIEVER_EMBED_PROVIDER=local or hashing to run offline.")
+    try:
+        provider = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Invalid embedding provider: {name}")
+    return provider()
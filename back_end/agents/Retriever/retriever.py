@@ -1,157 +1,639 @@
+import re
 import uuid
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any
 import numpy as np
 import faiss
-from rank_bm25 import BM25Okapi
 
-from langchain.embeddings import OpenAIEmbeddings
-from langchain_community.embeddings import CohereEmbeddings
 
 from model.extractor_model import Evidence, RetrievalOutput
-from .schema import Chunk
-from .utils import RetrieverUtils,chunk_text
+from .utils import RetrieverUtils, chunk_documents
 from .store import RetrieverPersistence
-from .config import OPENAI_API_KEY, COHERE_API_KEY, EMBED_MODEL
+from .chunk_store import ChunkStore
+from .fusion import fuse_scores
+from .diversify import mmr_select
+from .lexical import InvertedIndex, LexicalView
+from . import ann
+from .embed_cache import make_embedding_cache
+from .embedder import ChunkEmbedder, QueryEmbedder
+from .providers import EmbeddingProvider, make_provider
+from .config import (
+    EMBED_DIM, READY_TIMEOUT,
+    ANN_INDEX_TYPE, ANN_PROMOTE_THRESHOLD, ANN_TAIL_MAX, FILTER_EXACT_MAX,
+    COMPACT_RATIO, COMPACT_MIN_DELETED, DELETED_OVERFETCH_MAX,
+    RETRIEVER_ROLE, SNAPSHOT_POLL, SEGMENT_MAX,
+)
+
+
+class RetrieverNotReady(RuntimeError):
+    """Raised when the engine is still loading its corpus or failed to load it."""
+
+
+class RetrieverReadOnly(RuntimeError):
+    """Raised when a reader process is asked to modify the index."""
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    What one query searches: the first `n` chunks of `store` with the tombstones and BM25
+    statistics they had when it was published, and an ANN index over a prefix of them (the
+    rest are searched exactly).
+    """
+
+    store: ChunkStore
+    lexical: LexicalView
+    index: Any
+    n: int
+    tombstones: np.ndarray
+    n_deleted: int
+
 
 class RetrieverEngine:
-    SOURCES = ("pdf", "url")
+    """
+    Hybrid (vector + BM25) retriever over one index shared by all sources.
+
+    Every chunk records its source type ("pdf", "url", "text", ...); sources and doc_ids are
+    filters on that single index, so a multi-source query is ranked in one list. Chunks live
+    in a columnar ChunkStore whose vector matrix is searched exactly until the corpus is
+    promoted to an ANN index.
+
+    Deleted and replaced documents are tombstoned: searches skip them at once, and a
+    background compaction rebuilds the store and indexes without them. Until then BM25
+    statistics still count the deleted chunks.
+
+    Queries never lock. One writer at a time (under `_write_lock`) appends to the store and
+    indexes, then publishes a Snapshot by swapping one reference; a query reads `_state`
+    once and only sees what that snapshot covers. Nothing a snapshot covers is modified
+    afterwards: rows are appended past it, tombstones are copied on delete, and the ANN
+    index is replaced by an extended copy rather than added to.
+
+    With role "reader" the engine serves the writer's published snapshots read-only from
+    memory-mapped files and follows new generations as they are published. A would-be
+    writer that finds another process holding the writer lock starts as a reader.
+
+    Embeddings come from an EmbeddingProvider (RETRIEVER_EMBED_PROVIDER by default); its
+    model id is recorded with the index, which refuses to load under a different model.
+    """
+
+    def __init__(self, background: bool = True, role: str = RETRIEVER_ROLE, provider: EmbeddingProvider = None):
+        if role not in ("writer", "reader"):
+            raise ValueError(f"Invalid retriever role: {role}")
+        if role == "writer" and not RetrieverPersistence.acquire_writer():
+            # e.g. one of several uvicorn workers: the first to start writes, the rest serve snapshots
+            logging.info("Another process holds the retriever writer lock; serving snapshots read-only.")
+            role = "reader"
+        self.role = role
+        self.provider = provider or make_provider()
+        self.model_name = self.provider.model_id
+        self.query_embedder = QueryEmbedder(self.provider.embed_queries, RetrieverUtils.normalize_rows)
+
+        self.dim = (
+            EMBED_DIM
+            or self.provider.dim
+            or RetrieverPersistence.cached_dim(self.model_name)
+        )
+        # Swapped as one reference, so a query never mixes generations; the ANN index is None
+        # while the store's vectors are searched exactly
+        self._state = Snapshot(None, InvertedIndex().view(), None, 0, np.zeros(0, dtype=np.bool_), 0)
+        self.index_type = ANN_INDEX_TYPE
+        self._promoting = False
+        self._compacting = False
+        self._merging = False
+        self.generation = None  # snapshot generation the state was loaded from or last saved as
+        self._write_lock = threading.Lock()
+        self.embed_cache = None
+        self.chunk_embedder = None
 
-    def __init__(self):
-        if OPENAI_API_KEY:
-            self._embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-        elif COHERE_API_KEY:
-            self._embeddings = CohereEmbeddings(model=EMBED_MODEL, cohere_api_key=COHERE_API_KEY)
+        self.status = "loading"
+        self.error = None
+        self.ready_timeout = READY_TIMEOUT  # how long a query waits for the corpus to load
+        self.progress = {"chunks_loaded": 0}
+        self._ready = threading.Event()
+        if background:
+            threading.Thread(target=self._load, name="retriever-load", daemon=True).start()
         else:
-            raise RuntimeError("No API key found for embeddings.")
+            self._load()
 
-        self.dim = len(self._embeddings.embed_query("dimension-check-phrase"))
-        self.faiss_indices = {src: faiss.IndexFlatIP(self.dim) for src in self.SOURCES}
-        self.chunks = {src: [] for src in self.SOURCES}
-        self._bm25 = {src: None for src in self.SOURCES}
-        self._texts_for_bm25 = {src: [] for src in self.SOURCES}
+    @property
+    def store(self) -> ChunkStore:
+        return self._state.store
 
-        RetrieverPersistence.load(self.chunks, self.faiss_indices, self._bm25, self._texts_for_bm25, self.SOURCES)
+    @property
+    def _lexical(self) -> InvertedIndex:
+        return self._state.lexical.index
+
+    @property
+    def faiss_index(self):
+        return self._state.index
+
+    def _publish(self, store: ChunkStore, lexical: InvertedIndex, index):
+        """Make the current state of `store` and the indexes what new queries search; writer (or follower) only."""
+        n = len(store)
+        self._state = Snapshot(store, lexical.view(), index, n, store.tombstones.view[:n], store.n_deleted)
+
+    # -------- Startup --------
+    def _load(self):
+        try:
+            if not self.dim:
+                # Unknown model and no previous run to learn from: probe once
+                self.dim = self.provider.probe_dim()
+            self.embed_cache = make_embedding_cache(self.model_name, self.dim)
+            self.chunk_embedder = ChunkEmbedder(self.provider, self.dim, self.embed_cache)
+            state = RetrieverPersistence.load(self.dim, self.model_name, readonly=self.role == "reader")
+            if state is None:
+                store = ChunkStore(self.dim)
+                store.terms = self._lexical.terms
+                self._publish(store, self._lexical, None)
+            else:
+                self.generation, store, index, lexical = state
+                self._publish(store, lexical, index)
+            self.progress["chunks_loaded"] = len(self.store)
+            self.status = "ready"
+            if self.role == "reader":
+                threading.Thread(target=self._follow_snapshots, name="retriever-snapshots", daemon=True).start()
+            else:
+                self._maybe_promote()
+                self._maybe_compact()
+        except Exception as e:
+            logging.exception("Retriever failed to load.")
+            self.status, self.error = "error", str(e)
+        finally:
+            self._ready.set()
+
+    def _follow_snapshots(self):
+        """Reader: swap in each newly published generation."""
+        while True:
+            time.sleep(SNAPSHOT_POLL)
+            try:
+                generation = RetrieverPersistence.current_generation()
+                if generation is None or generation == self.generation:
+                    continue
+                # Extends the served state in place when the writer only appended to it
+                store, index, lexical = RetrieverPersistence.follow(
+                    (self.store, self.faiss_index, self._lexical), generation, self.dim, self.model_name
+                )
+                self._publish(store, lexical, index)
+                self.generation = generation
+                self.progress["chunks_loaded"] = len(store)
+                logging.info(f"Serving retriever snapshot {generation} ({len(store)} chunks).")
+            except Exception:
+                # e.g. the generation was pruned while loading; the next poll picks up a newer one
+                logging.exception("Failed to load the published retriever snapshot.")
+
+    def _require_writer(self):
+        if self.role != "writer":
+            raise RetrieverReadOnly("This process serves a read-only retriever snapshot; send writes to the writer.")
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout) and self.status == "ready"
+
+    def _require_ready(self, timeout: float):
+        if not self._ready.wait(timeout):
+            raise RetrieverNotReady("Retriever is still loading its index.")
+        if self.status != "ready":
+            raise RetrieverNotReady(f"Retriever failed to load: {self.error}")
+
+    def maintenance_status(self) -> dict:
+        """Which background jobs are running: ANN promotion, compaction, segment merging."""
+        return {"promoting": self._promoting, "compacting": self._compacting, "merging": self._merging}
+
+    def source_counts(self) -> dict:
+        snap = self._state
+        return snap.store.source_counts(snap.n, ~snap.tombstones) if snap.store is not None else {}
+
+    @staticmethod
+    def _allowed(store, sources, doc_ids, n: int):
+        """Sorted positions (< n) passing the source and doc_id filters, or None if unfiltered."""
+        allowed = None
+        if sources is not None:
+            allowed = store.positions_for_sources(sources, n)
+        if doc_ids:
+            in_docs = store.positions_for_docs(doc_ids, n)
+            allowed = in_docs if allowed is None else np.intersect1d(allowed, in_docs, assume_unique=True)
+        return allowed
+
+    @staticmethod
+    def _search(store, index, qv: np.ndarray, allowed, top_n: int, n: int, nprobe=None, ef_search=None):
+        """(positions, scores) matrices of the top_n vectors per query row among `allowed` (< n)."""
+        if index is None or (allowed is not None and allowed.size <= FILTER_EXACT_MAX):
+            return ann.exact_search(store.vectors[:n], qv, top_n, allowed)
+        if index.ntotal < n:
+            # A reader's ANN file can lag the newest segments; those rows are searched exactly
+            m = index.ntotal
+            head = None if allowed is None else allowed[:np.searchsorted(allowed, m)]
+            tail = np.arange(m, n) if allowed is None else allowed[head.size:]
+            I, D = RetrieverEngine._search(store, index, qv, head, top_n, m, nprobe, ef_search)
+            tail_I, tail_D = ann.exact_search(store.vectors[:n], qv, top_n, tail)
+            I, D = np.concatenate([I, tail_I], axis=1), np.concatenate([D, tail_D], axis=1)
+            if I.shape[1] > top_n:
+                top = np.argpartition(-D, top_n - 1, axis=1)[:, :top_n]
+                I, D = np.take_along_axis(I, top, axis=1), np.take_along_axis(D, top, axis=1)
+            return I, D
+        if allowed is None:
+            D, I = index.search(qv, top_n, params=ann.search_params(index, nprobe, ef_search))
+            return I, D
+        # Broad filters (e.g. a whole source) stay on the index and skip the other chunks
+        params = ann.search_params(
+            index, nprobe, ef_search, selector=faiss.IDSelectorBatch(allowed), selectivity=allowed.size / index.ntotal
+        )
+        D, I = index.search(qv, top_n, params=params)
+        return I, D
+
+    # -------- ANN tiers --------
+    def _maybe_promote(self):
+        """
+        Start a background build of the next ANN index: the first one once the corpus reaches
+        ANN_PROMOTE_THRESHOLD, then an extended copy once ANN_TAIL_MAX chunks are searched
+        exactly beside it.
+        """
+        snap = self._state
+        if snap.index is None:
+            due = self.index_type != "flat" and snap.n >= ANN_PROMOTE_THRESHOLD
+        else:
+            due = snap.n - snap.index.ntotal >= ANN_TAIL_MAX
+        if not due or self._promoting or self._compacting:
+            return
+        with self._write_lock:
+            if self._promoting or self._compacting:
+                return
+            self._promoting = True
+        threading.Thread(target=self._promote, args=(self.index_type,), name="retriever-ann", daemon=True).start()
+
+    def _promote(self, kind: str):
+        try:
+            snap = self._state
+            store, n = snap.store, snap.n
+            if snap.index is None:
+                logging.info(f"Building {kind} index over {n} chunks.")
+                index = ann.build_trained(kind, store.vectors[:n])
+            else:
+                # Queries keep searching the published index meanwhile, so a copy is extended
+                kind = ann.index_kind(snap.index)
+                index = faiss.clone_index(snap.index)
+                index.add(np.ascontiguousarray(store.vectors[index.ntotal:n]))
+            with self._write_lock:
+                # Catch up on chunks ingested while the index was being built
+                tail = store.vectors[index.ntotal:len(store)]
+                if len(tail):
+                    index.add(np.ascontiguousarray(tail))
+                self._publish(store, self._lexical, index)
+            logging.info(f"Published a {kind} index over {index.ntotal} chunks.")
+        except Exception:
+            logging.exception("Building the ANN index failed; new chunks stay searched exactly.")
+        finally:
+            self._promoting = False
+
+    # -------- Compaction --------
+    def _maybe_compact(self):
+        store = self.store
+        if store.n_deleted >= max(COMPACT_MIN_DELETED, COMPACT_RATIO * len(store)):
+            self._start_compaction()
+
+    def compact(self) -> bool:
+        """Start a background compaction; False if one (or an ANN promotion) is already running."""
+        self._require_writer()
+        self._require_ready(timeout=None)
+        return self._start_compaction()
+
+    def _start_compaction(self) -> bool:
+        with self._write_lock:
+            if self._compacting or self._promoting:
+                return False
+            self._compacting = True
+        threading.Thread(target=self._compact, name="retriever-compact", daemon=True).start()
+        return True
+
+    def _compact(self):
+        """
+        Rebuild the store, lexical index and ANN index from the live chunks, then swap them in.
+
+        The rebuild reads a fixed prefix of the current store while queries and ingest carry
+        on; only the catch-up (chunks added or deleted meanwhile) runs under the write lock.
+        """
+        try:
+            old = self.store
+            with self._write_lock:
+                n = len(old)
+                lexical = self._lexical.empty_like()
+            store, keep = old.compact(n)
+            store.terms = lexical.terms
+            lexical.add_ids(store.tokens[i] for i in range(len(store)))
+            index = None
+            if self.faiss_index is not None:
+                index = ann.build_trained(ann.index_kind(self.faiss_index), store.vectors)
+
+            with self._write_lock:
+                # Documents deleted while rebuilding, then the live chunks added meanwhile
+                died = np.flatnonzero(old.tombstones.view[keep])
+                if died.size:
+                    store.delete_docs({store.doc_id(int(i)) for i in died})
+                tail = np.arange(n, len(old))
+                tail = tail[~old.tombstones.view[tail]]
+                if tail.size:
+                    lexical.sync_terms(self._lexical)
+                    store.copy_rows(old, tail)
+                    lexical.add_ids(old.tokens[int(i)] for i in tail)
+                    if index is not None:
+                        index.add(np.ascontiguousarray(old.vectors[tail]))
+                self._publish(store, lexical, index)
+            logging.info(f"Compacted the index from {len(old)} to {len(store)} chunks.")
+            self.save()
+        except Exception:
+            logging.exception("Compaction failed; deleted chunks stay tombstoned.")
+        finally:
+            self._compacting = False
+
+    # -------- Indexing --------
+    def _add_chunks(self, new_chunks, replace=False):
+        with self._write_lock:
+            store, lexical = self.store, self._lexical
+            token_ids = [lexical.intern(c.tokens) for c in new_chunks]
+            lexical.add_ids(token_ids)
+            if replace:
+                store.delete_docs({c.doc_id for c in new_chunks})
+            store.extend(new_chunks, token_ids)
+            # Old versions stop matching in the same snapshot that adds the new chunks; the
+            # ANN index catches up in the background (see _maybe_promote)
+            self._publish(store, lexical, self.faiss_index)
 
     # -------- Persistence --------
     def save(self):
-        RetrieverPersistence.save(self.chunks, self.SOURCES)
+        """Publish the current state as a new snapshot generation."""
+        self._require_writer()
+        self._require_ready(timeout=None)
+        with self._write_lock:
+            self.generation = RetrieverPersistence.save(self.store, self.faiss_index, self._lexical, self.model_name)
+        self._maybe_merge()
+
+    def _maybe_merge(self):
+        """Merge postings segments in the background once saves have appended more than SEGMENT_MAX."""
+        with self._write_lock:
+            if self._merging or RetrieverPersistence.segment_count() <= SEGMENT_MAX:
+                return
+            self._merging = True
+        threading.Thread(target=self._merge_segments, name="retriever-merge", daemon=True).start()
+
+    def _merge_segments(self):
+        try:
+            while True:
+                generation = RetrieverPersistence.merge_segments()
+                if generation is None:
+                    break
+                with self._write_lock:
+                    # A save may have published a newer generation meanwhile
+                    self.generation = max(self.generation or "", generation)
+        except Exception:
+            logging.exception("Merging postings segments failed.")
+        finally:
+            self._merging = False
 
     # -------- Ingest --------
-    def ingest_batch(self, items, source_type: str, chunk_size=500, chunk_overlap=100):
-        if source_type not in self.SOURCES:
-            raise ValueError(f"Invalid source_type: {source_type}")
+    def ingest_batch(self, items, source_type: str, chunk_size=500, chunk_overlap=100, replace=False):
+        """
+        Chunk, embed and index `items` under `source_type`, which may be any source name.
+        Documents already indexed are skipped, or replaced when `replace` is set. Documents
+        without any text to index are reported as `empty_docs`; replacing one deletes it.
 
-        existing_ids = {c.doc_id for c in self.chunks[source_type]}
-        items = [it for it in items if it["doc_id"] not in existing_ids]
+        An item may carry the `vectors` of its chunks (and the `model` that made them), as
+        ingest workers prepare them; those of this engine's model are indexed as they are.
+        """
+        if not source_type or not isinstance(source_type, str):
+            raise ValueError(f"Invalid source_type: {source_type!r}")
+        self._require_writer()
+        self._require_ready(timeout=None)
+
+        replaced = [it["doc_id"] for it in items if self.store.has_doc(it["doc_id"])]
+        if not replace:
+            items = [it for it in items if not self.store.has_doc(it["doc_id"])]
         if not items:
-            return {"added_docs": 0, "added_chunks": 0, "chunks_total": len(self.chunks[source_type])}
+            return {"added_docs": 0, "added_chunks": 0, "chunks_total": len(self.store)}
 
-        new_chunks, texts = [], []
+        doc_chunks = chunk_documents(items, source_type, chunk_size, chunk_overlap)
+        empty = sorted({it["doc_id"] for it, chunks in zip(items, doc_chunks) if not chunks})
+        if replace and empty:
+            # No chunk of theirs will be added, so nothing else drops the old versions
+            with self._write_lock:
+                self.store.delete_docs(empty)
+                self._publish(self.store, self._lexical, self.faiss_index)
 
-        for it in items:
-            chunk_data = chunk_text(it["text"], chunk_size, chunk_overlap, it["doc_id"], it.get("title"), it.get("meta", {}))
-            for c in chunk_data:
-                c["text"] = RetrieverUtils.filter_irrelevant_numbers(c["text"])
-                if not c["text"]:
-                    continue
-                chunk = Chunk(**c)
-                chunk.tokens = RetrieverUtils.tokenize(chunk.text)
-                texts.append(chunk.text)
-                new_chunks.append(chunk)
+        # A document is indexed as soon as all of its chunks have vectors, so a failed
+        # batch only holds back the documents it touches and they can be re-ingested.
+        flat = [c for chunks in doc_chunks for c in chunks]
+        owner = [d for d, chunks in enumerate(doc_chunks) for _ in chunks]
+        pending = [len(chunks) for chunks in doc_chunks]
+        added_chunks = 0
+
+        def on_vectors(indices, vectors):
+            nonlocal added_chunks
+            completed = []
+            for i, vec in zip(indices, vectors):
+                flat[i].vector = vec
+                pending[owner[i]] -= 1
+                if not pending[owner[i]]:
+                    completed.append(owner[i])
+            ready = [c for d in sorted(completed) for c in doc_chunks[d]]
+            if ready:
+                self._add_chunks(ready, replace)
+                added_chunks += len(ready)
+
+        # Vectors an ingest worker prepared with this model are indexed as they are
+        todo, given_idx, given, start = [], [], [], 0
+        for it, chunks in zip(items, doc_chunks):
+            span = range(start, start + len(chunks))
+            start += len(chunks)
+            vectors = it.get("vectors")
+            if vectors is not None and it.get("model") == self.model_name and vectors.shape == (len(chunks), self.dim):
+                given_idx.extend(span)
+                given.extend(vectors)
+            else:
+                todo.extend(span)
+        if given_idx:
+            on_vectors(given_idx, given)
+        failed, _ = self.chunk_embedder.embed_into(
+            [flat[i].text for i in todo], lambda indices, vectors: on_vectors([todo[j] for j in indices], vectors)
+        )
+        failed = [todo[j] for j in failed]
+        self._maybe_promote()
+        if replace:
+            self._maybe_compact()
 
-        embeddings = self._embeddings.embed_documents(texts)
-        for i, vec in enumerate(embeddings):
-            new_chunks[i].vector = RetrieverUtils.normalize_vector(np.array(vec, dtype=np.float32))
-            self.faiss_indices[source_type].add(new_chunks[i].vector.reshape(1, -1))
+        failed_docs = sorted({items[owner[i]]["doc_id"] for i in failed})
+        if failed_docs:
+            logging.error(f"Embedding failed for {len(failed_docs)} '{source_type}' documents: {failed_docs}")
 
-        self.chunks[source_type].extend(new_chunks)
-        self._texts_for_bm25[source_type] = [c.tokens for c in self.chunks[source_type]]
-        self._bm25[source_type] = BM25Okapi(self._texts_for_bm25[source_type])
+        result = {
+            "added_docs": len(items) - len(failed_docs) - len(empty),
+            "added_chunks": added_chunks,
+            "chunks_total": len(self.store),
+            "failed_docs": failed_docs,
+            "empty_docs": empty,
+        }
+        if replace:
+            # A document whose embedding failed keeps its previous version
+            result["replaced_docs"] = sorted(set(replaced) - set(failed_docs) - set(empty))
+        return result
+
+    def upsert(self, items, source_type: str, chunk_size=500, chunk_overlap=100):
+        """Index `items`, replacing any documents already indexed under the same doc_id."""
+        return self.ingest_batch(items, source_type, chunk_size, chunk_overlap, replace=True)
 
+    def delete(self, doc_ids):
+        """Tombstone every chunk of `doc_ids`; they stop matching immediately."""
+        self._require_writer()
+        self._require_ready(timeout=None)
+        with self._write_lock:
+            store = self.store
+            deleted = sorted(d for d in set(doc_ids) if store.has_doc(d))
+            positions = store.delete_docs(deleted)
+            self._publish(store, self._lexical, self.faiss_index)
+        self._maybe_compact()
         return {
-            "added_docs": len(items),
-            "added_chunks": len(new_chunks),
-            "chunks_total": len(self.chunks[source_type]),
+            "deleted_docs": deleted,
+            "deleted_chunks": int(positions.size),
+            "chunks_deleted_total": self.store.n_deleted,
         }
 
     # -------- Retrieval --------
-    def retrieve(self, query: str, k=5, alpha=0.5, source_type="pdf", doc_ids=None):
-        if source_type not in self.SOURCES or not self.chunks[source_type]:
-            return []
+    def retrieve(self, query: str, k=5, alpha=0.5, source_type=None, doc_ids=None, fusion="weighted",
+                 nprobe=None, ef_search=None, mmr_lambda=None, max_per_doc=None):
+        return self.retrieve_many(
+            [query], k, alpha, source_type, doc_ids, fusion, nprobe, ef_search, mmr_lambda, max_per_doc
+        )[0]
+
+    def retrieve_many(self, queries, k=5, alpha=0.5, source_type=None, doc_ids=None, fusion="weighted",
+                      nprobe=None, ef_search=None, mmr_lambda=None, max_per_doc=None):
+        """
+        Hybrid retrieval for a list of queries, returning one ranked result list per query.
 
-        candidates = [c for c in self.chunks[source_type] if not doc_ids or c.doc_id in doc_ids]
-        if not candidates:
+        `source_type` is a source name, a list of them or None for every source. Queries are
+        embedded together, searched as one (n_queries x dim) matrix and scored against the
+        lexical index in one pass; only fusion runs per query.
+
+        `mmr_lambda` (0..1) reranks the fused candidates by maximal marginal relevance, trading
+        relevance for distance to the chunks already picked; `max_per_doc` caps the results
+        taken from any one document.
+        """
+        if mmr_lambda is not None and not 0.0 <= mmr_lambda <= 1.0:
+            raise ValueError(f"mmr_lambda must be in [0, 1], got {mmr_lambda}")
+        if max_per_doc is not None and max_per_doc < 1:
+            raise ValueError(f"max_per_doc must be at least 1, got {max_per_doc}")
+        self._require_ready(self.ready_timeout)
+        if not queries:
             return []
+        snap = self._state
+        store, index, n = snap.store, snap.index, snap.n
+        sources = [source_type] if isinstance(source_type, str) else source_type
+        allowed = self._allowed(store, sources, doc_ids, n) if n else None
 
-        n_docs = len(candidates)
-        qv = RetrieverUtils.normalize_vector(np.array(self._embeddings.embed_query(query), dtype=np.float32)).reshape(1, -1)
-        top_n = min(max(k * 5, 50), n_docs)
-
-        bm25 = BM25Okapi([c.tokens for c in candidates])
-        bm25_scores = np.array(bm25.get_scores(RetrieverUtils.tokenize(query)))
-        bm25_idx = np.argsort(-bm25_scores)[:top_n]
-
-        if not doc_ids:
-            D, I = self.faiss_indices[source_type].search(qv, top_n)
-            vec_idx, vec_scores = I[0], D[0]
-            valid = vec_idx < len(self.chunks[source_type])
-            vec_idx, vec_scores = vec_idx[valid], vec_scores[valid]
-            cand_idx = np.unique(np.concatenate([vec_idx, bm25_idx]))
-            v = np.array([vec_scores[list(vec_idx).index(idx)] if idx in vec_idx else 0.0 for idx in cand_idx])
-            b = np.array([bm25_scores[idx] if idx in bm25_idx else 0.0 for idx in cand_idx])
-        else:
-            cand_idx = bm25_idx
-            v, b = np.zeros(len(cand_idx)), bm25_scores[cand_idx]
-
-        hybrid_scores = alpha * v + (1 - alpha) * b
-        order = np.argsort(-hybrid_scores)[:min(k, len(cand_idx))]
-
-        results = []
-        for idx_pos in order:
-            idx = int(cand_idx[idx_pos])
-            chunk = candidates[idx]
-            clean_text = RetrieverUtils.filter_irrelevant_numbers(chunk.text)
-            if not clean_text:
-                continue
-            results.append({
-                "chunk_id": chunk.chunk_id,
-                "doc_id": chunk.doc_id,
-                "title": chunk.title,
-                "text": clean_text,
-                "score_hybrid": float(hybrid_scores[idx_pos]),
-                "meta": chunk.meta,
-            })
-        return results
+        # Tombstoned chunks: filter them out, or when there are few, fetch that many extra
+        # candidates (they can displace at most as many live ones) and drop them afterwards
+        live, extra = None, 0
+        if n and snap.n_deleted:
+            live = ~snap.tombstones
+            if allowed is not None:
+                allowed = allowed[live[allowed]]
+            elif snap.n_deleted <= DELETED_OVERFETCH_MAX:
+                extra = snap.n_deleted
+            else:
+                allowed = np.flatnonzero(live)
+        n_live = n if live is None else int(live.sum())
+        if not n_live or (allowed is not None and not allowed.size):
+            return [[] for _ in queries]
+
+        mask = live
+        if allowed is not None:
+            mask = np.zeros(n, dtype=bool)
+            mask[allowed] = True
+        qv = self.query_embedder.embed_all(queries)
+        top_n = min(max(k * 5, 50), n_live if allowed is None else allowed.size)
+
+        I, D = self._search(store, index, qv, allowed, min(top_n + extra, n), n, nprobe, ef_search)
+        lexical = snap.lexical.score_many([RetrieverUtils.tokenize(q) for q in queries])
+
+        all_results = []
+        for q, (lex_idx, lex_scores) in enumerate(lexical):
+            if mask is not None:
+                keep = mask[lex_idx]
+                lex_idx, lex_scores = lex_idx[keep], lex_scores[keep]
+            if lex_idx.size > top_n:
+                top = np.argpartition(-lex_scores, top_n - 1)[:top_n]
+                lex_idx, lex_scores = lex_idx[top], lex_scores[top]
+
+            valid = (I[q] >= 0) & (I[q] < n)
+            if mask is not None:
+                valid[valid] = mask[I[q][valid]]
+            cand_idx, hybrid_scores, v, b = fuse_scores(
+                I[q][valid], D[q][valid], lex_idx, lex_scores, alpha=alpha, mode=fusion
+            )
+            order = np.argsort(-hybrid_scores)
+            if mmr_lambda is not None or max_per_doc is not None:
+                pool = order[:top_n]
+                pool_idx = cand_idx[pool]
+                order = pool[mmr_select(
+                    hybrid_scores[pool], k,
+                    vectors=store.vectors[pool_idx] if mmr_lambda is not None else None, lambda_=mmr_lambda,
+                    groups=store.doc_codes[pool_idx], max_per_group=max_per_doc,
+                )]
+            else:
+                order = order[:k]
+
+            results = []
+            for idx_pos in order:
+                chunk = store[int(cand_idx[idx_pos])]
+                results.append({
+                    "chunk_id": chunk.chunk_id,
+                    "doc_id": chunk.doc_id,
+                    "source": chunk.source,
+                    "title": chunk.title,
+                    "text": chunk.text,
+                    "score_bm25": float(b[idx_pos]),
+                    "score_vec": float(v[idx_pos]),
+                    "score_hybrid": float(hybrid_scores[idx_pos]),
+                    "meta": {**chunk.meta, "raw_numbers": chunk.raw_numbers},
+                })
+            all_results.append(results)
+        return all_results
 
     # -------- Format for extractor --------
-    def format_for_extractor(self, query: str, source_type: str, run_id: str = None, k=5, alpha=0.5, doc_ids=None):
-        hits = self.retrieve(query, k=k, alpha=alpha, source_type=source_type, doc_ids=doc_ids)
+    def format_for_extractor(self, query: str, source_type=None, run_id: str = None, k=5, alpha=0.5, doc_ids=None, fusion="weighted",
+                             mmr_lambda=None, max_per_doc=None):
+        hits = self.retrieve(query, k=k, alpha=alpha, source_type=source_type, doc_ids=doc_ids, fusion=fusion,
+                             mmr_lambda=mmr_lambda, max_per_doc=max_per_doc)
         if not hits:
             return None
 
-        evidence_chunks = []
-        for h in hits:
-            clean_text = RetrieverUtils.filter_irrelevant_numbers(h["text"])
-            if not clean_text:
-                continue
-            evidence_chunks.append(Evidence(
+        # Chunk text was normalized at ingest
+        evidence_chunks = [
+            Evidence(
                 chunk_id=h["chunk_id"],
                 doc_id=h["doc_id"],
-                text=clean_text,
+                text=h["text"],
                 title=h.get("title"),
                 meta=h.get("meta", {}),
-            ))
+            )
+            for h in hits
+        ]
 
         if len(evidence_chunks) < 3:
             return None
 
-        import re
+        sources = [source_type] if isinstance(source_type, str) else source_type
         numeric_tokens = re.findall(r"\d+(\.\d+)?", " ".join([c.text for c in evidence_chunks]))
         provenance = {
             "alpha": alpha,
             "k": k,
-            "embedding_model": EMBED_MODEL,
+            "fusion": fusion,
+            "mmr_lambda": mmr_lambda,
+            "max_per_doc": max_per_doc,
+            "embedding_model": self.model_name,
             "source_type": source_type,
-            "chunks_indexed": len(self.chunks[source_type]),
+            "chunks_indexed": sum(
+                count for src, count in self.source_counts().items() if sources is None or src in sources
+            ),
             "chunks_used": len(evidence_chunks),
         }
         if len(set(numeric_tokens)) < 2:
@@ -163,4 +645,17 @@ class RetrieverEngine:
             evidence_chunks=evidence_chunks,
             provenance=provenance,
         )
-engine = RetrieverEngine()
\ No newline at end of file
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> RetrieverEngine:
+    """Return the shared engine, creating it on first use; the corpus loads in the background."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RetrieverEngine()
+    return _engine
@@ -12,12 +12,7 @@ class Chunk:
     title: str
     text: str
     meta: Dict[str, Any]
+    raw_numbers: Optional[List[float]] = None
+    source: Optional[str] = None  # source type, e.g. "pdf" or "url"
     vector: Optional[np.ndarray] = None
     tokens: Optional[List[str]] = None
-    score_bm25: float = 0.0
-    score_vec: float = 0.0
-    score_hybrid: float = 0.0
-
-
-# External models (already in model/extractor_model)
-from model.extractor_model import Evidence, RetrievalOutput
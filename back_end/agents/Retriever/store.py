@@ -1,40 +1,503 @@
 import os
+import json
+import fcntl
+import shutil
 import pickle
+import threading
+import dataclasses
 import numpy as np
 import logging
-from rank_bm25 import BM25Okapi
-from .config import PERSIST_DIR
+import faiss
+from .config import PERSIST_DIR, SNAPSHOT_KEEP, SEGMENT_MAX, SEGMENT_MERGE_FACTOR, ANN_REWRITE_RATIO
 from .schema import Chunk
+from .lexical import InvertedIndex, merge_postings, postings_from_tokens
+from .chunk_store import ChunkStore
+from .ann import index_kind
+from .utils import RetrieverUtils
+
+FORMAT_VERSION = 6
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path, write):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _append(path, committed: int, chunks) -> int:
+    """
+    Append byte buffers to a log file after its first `committed` bytes (dropping anything a
+    crashed save left past them) and sync it; returns the new committed size.
+    """
+    with open(path, "ab") as f:
+        f.truncate(committed)
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def _read_range(path, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+# Serializes saves and merges in the writer; each reads the published manifest and publishes the next
+_publish_lock = threading.Lock()
+# Writer locks this process holds, by lock file path; each stays open (and locked) until exit
+_writer_locks = {}
+
 
 class RetrieverPersistence:
+    """
+    On-disk layout (one index for all sources). Saves append to logs that are never
+    rewritten, and publish what they appended as a new snapshot generation: a small
+    manifest holding the committed length of every log. CURRENT names the published
+    manifest and is replaced atomically, so readers (possibly other processes) always see a
+    complete generation and a crash mid-save leaves earlier ones intact:
+
+        <PERSIST_DIR>/index/CURRENT                              name of the current manifest
+        <PERSIST_DIR>/index/WRITER.lock                          held by the writer process
+        <PERSIST_DIR>/index/gen-<n>.json                         manifest: format, dim, count, index type,
+                                                                 embedding model, log lengths, segments
+        <PERSIST_DIR>/index/epoch-<e>/<column>.bin               chunk columns (vectors, codes, ids, texts,
+                                                                 tokens, numbers) and the deleted positions
+        <PERSIST_DIR>/index/epoch-<e>/docs.jsonl                 interned documents, one per line
+        <PERSIST_DIR>/index/epoch-<e>/terms.txt                  lexical vocabulary, one term per line
+        <PERSIST_DIR>/index/epoch-<e>/segments/seg-<a>-<b>/      postings (CSR .npy) of chunks a..b-1
+        <PERSIST_DIR>/index/epoch-<e>/ann-<n>.faiss              ANN index, absent while searched exactly
+
+    A save costs what it appends: new rows, documents, terms and deletions, one postings
+    segment for the new chunks and, now and then, the ANN index. Segments are merged in the
+    background to keep their number bounded. Compaction renumbers chunks, so it starts a new
+    epoch. Logs are memory-mapped on load, and a reader following the writer only maps the
+    longer logs and reads the new segments.
+
+    Only one process writes: the writer holds an exclusive lock on index/WRITER.lock for as
+    long as it runs (see `acquire_writer`). The newest SNAPSHOT_KEEP generations are kept; files no kept generation uses are only
+    unlinked, so processes still mapping them keep working. A legacy meta.pkl is migrated on
+    first load.
+    """
 
     @staticmethod
-    def save(chunks, sources):
-        meta = {"chunks": {src: [c.__dict__ for c in chunks[src]] for src in sources}}
-        with open(os.path.join(PERSIST_DIR, "meta.pkl"), "wb") as f:
-            pickle.dump(meta, f)
-        logging.info("Retriever state saved.")
+    def _dir():
+        return os.path.join(PERSIST_DIR, "index")
 
     @staticmethod
-    def load(chunks, faiss_indices, bm25, texts_for_bm25, sources):
-        path = os.path.join(PERSIST_DIR, "meta.pkl")
+    def _read_manifest(path):
         if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def acquire_writer() -> bool:
+        """
+        Take the writer lock of PERSIST_DIR for this process; False if another process holds
+        it. The lock is released when the process exits, however it exits.
+        """
+        root = RetrieverPersistence._dir()
+        path = os.path.join(root, "WRITER.lock")
+        with _publish_lock:
+            if path in _writer_locks:
+                return True
+            os.makedirs(root, exist_ok=True)
+            f = open(path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            _writer_locks[path] = f
+        return True
+
+    @staticmethod
+    def current_generation():
+        """Name of the published generation, or None before the first save."""
+        try:
+            with open(os.path.join(RetrieverPersistence._dir(), "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _current():
+        """(generation, manifest) of the published generation, or (None, None)."""
+        generation = RetrieverPersistence.current_generation()
+        if generation is None:
+            return None, None
+        return generation, RetrieverPersistence._read_manifest(os.path.join(RetrieverPersistence._dir(), generation))
+
+    @staticmethod
+    def cached_dim(model_name):
+        """Vector dim recorded by a previous run with the same embedding model, if any."""
+        _, manifest = RetrieverPersistence._current()
+        if manifest and manifest.get("embedding_model") == model_name:
+            return manifest["dim"]
+        return None
+
+    # -------- Save --------
+    @staticmethod
+    def save(store, index, lexical, model_name):
+        """Append the state's changes since its last save and publish them; returns the generation name."""
+        root = RetrieverPersistence._dir()
+        os.makedirs(root, exist_ok=True)
+        with _publish_lock:
+            _, current = RetrieverPersistence._current()
+            number = RetrieverPersistence._next_number(root)
+            if store.persisted is not None and current and current.get("epoch") == store.persisted["epoch"]:
+                base = current
+            else:
+                # A new store (first save, compaction, migration) starts a fresh set of logs
+                base = RetrieverPersistence._empty_manifest(f"epoch-{number:08d}")
+                os.makedirs(os.path.join(root, base["epoch"], "segments"))
+            path = os.path.join(root, base["epoch"])
+            n = len(store)
+
+            columns = {}
+            for name, arr in store.log_columns(n).items():
+                count = base["columns"].get(name, [0])[0]
+                row_bytes = arr.itemsize * int(np.prod(arr.shape[1:]))
+                _append(os.path.join(path, f"{name}.bin"), count * row_bytes, [np.ascontiguousarray(arr[count:]).data])
+                columns[name] = [len(arr), arr.dtype.str]
+            n_docs = len(store.doc_ids)
+            docs_bytes = _append(os.path.join(path, "docs.jsonl"), base["docs_bytes"], [
+                (json.dumps([store.doc_ids[i], store.titles[i], store.metas[i]]) + "\n").encode("utf-8")
+                for i in range(base["docs"], n_docs)
+            ])
+            terms = lexical.terms
+            n_terms = len(terms)
+            # Tokens come from str.split(), so they never contain a newline
+            terms_bytes = _append(os.path.join(path, "terms.txt"), base["terms_bytes"], [
+                "".join(t + "\n" for t in terms[base["terms"]:n_terms]).encode("utf-8")
+            ])
+
+            segments = list(base["segments"])
+            if n > base["count"]:
+                tokens = store.tokens
+                postings = postings_from_tokens(tokens.values.view, tokens.offsets.view[base["count"]:n + 1], base["count"], n_terms)
+                segments.append(RetrieverPersistence._write_segment(path, base["count"], n, postings))
+
+            ann = base["ann"]
+            if index is None:
+                ann = None
+            elif ann is None or ann["kind"] != index_kind(index) or index.ntotal - ann["ntotal"] > ANN_REWRITE_RATIO * index.ntotal:
+                ann = {"file": f"ann-{number:08d}.faiss", "ntotal": int(index.ntotal), "kind": index_kind(index)}
+                faiss.write_index(index, os.path.join(path, ann["file"] + ".tmp"))
+                os.replace(os.path.join(path, ann["file"] + ".tmp"), os.path.join(path, ann["file"]))
+
+            manifest = {
+                "format_version": FORMAT_VERSION,
+                "dim": store.dim,
+                "count": n,
+                "index_type": index_kind(index),
+                "embedding_model": model_name,
+                "epoch": base["epoch"],
+                "columns": columns,
+                "docs": n_docs,
+                "docs_bytes": docs_bytes,
+                "sources": list(store.sources),
+                "terms": n_terms,
+                "terms_bytes": terms_bytes,
+                "lexical": [lexical.k1, lexical.b],
+                "segments": segments,
+                "ann": ann,
+            }
+            generation = RetrieverPersistence._publish(root, number, manifest)
+            store.persisted = manifest
+        logging.info(f"Retriever state saved as {generation} ({n - base['count']} new chunks).")
+        return generation
+
+    @staticmethod
+    def _empty_manifest(epoch):
+        return {
+            "epoch": epoch, "count": 0, "columns": {}, "docs": 0, "docs_bytes": 0,
+            "terms": 0, "terms_bytes": 0, "segments": [], "ann": None,
+        }
+
+    @staticmethod
+    def _next_number(root):
+        names = [name for name in os.listdir(root) if name.startswith(("gen-", "epoch-"))]
+        return max((int(name.split("-")[1].split(".")[0]) for name in names), default=0) + 1
+
+    @staticmethod
+    def _write_segment(path, start, end, postings, final=True):
+        """Write postings of chunks start..end-1 as a segment directory; returns its manifest entry."""
+        name = f"seg-{start:012d}-{end:012d}"
+        tmp = os.path.join(path, "segments", f".tmp-{name}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for part, arr in zip(("offsets", "docs", "tfs"), postings):
+            with open(os.path.join(tmp, f"{part}.npy"), "wb") as f:
+                np.save(f, arr)
+                f.flush()
+                os.fsync(f.fileno())
+        if final:
+            RetrieverPersistence._finish_segment(path, name)
+        return {"name": name, "rows": [start, end], "postings": int(postings[0][-1])}
+
+    @staticmethod
+    def _finish_segment(path, name):
+        final = os.path.join(path, "segments", name)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(os.path.join(path, "segments", f".tmp-{name}"), final)
+        _fsync_dir(os.path.join(path, "segments"))
+
+    @staticmethod
+    def _publish(root, number, manifest):
+        """Write the manifest, point CURRENT at it, and drop what no kept generation uses."""
+        generation = f"gen-{number:08d}.json"
+        _atomic_write(os.path.join(root, generation), lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+        _atomic_write(os.path.join(root, "CURRENT"), lambda f: f.write(generation.encode("utf-8")))
+        _fsync_dir(root)
+
+        generations = sorted(name for name in os.listdir(root) if name.startswith("gen-") and not name.endswith(".tmp"))
+        for old in generations[:max(0, len(generations) - SNAPSHOT_KEEP)]:
+            os.remove(os.path.join(root, old))
+
+        used = {}
+        for name in generations[-SNAPSHOT_KEEP:]:
+            kept = RetrieverPersistence._read_manifest(os.path.join(root, name))
+            if kept:
+                files = used.setdefault(kept["epoch"], set())
+                files.update(seg["name"] for seg in kept["segments"])
+                if kept["ann"]:
+                    files.add(kept["ann"]["file"])
+        for epoch in (name for name in os.listdir(root) if name.startswith("epoch-")):
+            if epoch not in used:
+                shutil.rmtree(os.path.join(root, epoch), ignore_errors=True)
+                continue
+            epoch_path = os.path.join(root, epoch)
+            stale = [name for name in os.listdir(epoch_path) if name.startswith("ann-") and name not in used[epoch]]
+            stale += [os.path.join("segments", name) for name in os.listdir(os.path.join(epoch_path, "segments"))
+                      if not name.startswith(".") and name not in used[epoch]]
+            for name in stale:
+                shutil.rmtree(os.path.join(epoch_path, name), ignore_errors=True) if os.path.isdir(
+                    os.path.join(epoch_path, name)) else os.remove(os.path.join(epoch_path, name))
+        return generation
+
+    # -------- Segment merging --------
+    @staticmethod
+    def segment_count():
+        _, manifest = RetrieverPersistence._current()
+        return len(manifest["segments"]) if manifest else 0
+
+    @staticmethod
+    def merge_segments(max_segments=SEGMENT_MAX, factor=SEGMENT_MERGE_FACTOR):
+        """
+        Merge the `factor` adjacent postings segments holding the fewest postings into one,
+        if there are more than `max_segments`. The merged segment is written without holding
+        up saves, and published in place of its parts only if they are still current.
+        Returns the generation published, or None.
+        """
+        root = RetrieverPersistence._dir()
+        with _publish_lock:
+            _, manifest = RetrieverPersistence._current()
+            if not manifest or len(manifest["segments"]) <= max_segments:
+                return None
+            segments = manifest["segments"]
+            factor = min(factor, len(segments))
+            sizes = [sum(seg["postings"] for seg in segments[i:i + factor]) for i in range(len(segments) - factor + 1)]
+            start = int(np.argmin(sizes))
+            window = segments[start:start + factor]
+            epoch, n_terms = manifest["epoch"], manifest["terms"]
+        path = os.path.join(root, epoch)
+
+        parts = []
+        for seg in window:
+            offsets, docs, tfs = RetrieverPersistence._read_segment(path, seg["name"])
+            parts.append((np.diff(offsets), docs, tfs))
+        merged = RetrieverPersistence._write_segment(
+            path, window[0]["rows"][0], window[-1]["rows"][1], merge_postings(parts, n_terms), final=False
+        )
+
+        with _publish_lock:
+            _, manifest = RetrieverPersistence._current()
+            names = [seg["name"] for seg in manifest["segments"]] if manifest and manifest.get("epoch") == epoch else []
+            at = names.index(window[0]["name"]) if window[0]["name"] in names else -1
+            if at < 0 or names[at:at + factor] != [seg["name"] for seg in window]:
+                shutil.rmtree(os.path.join(path, "segments", f".tmp-{merged['name']}"), ignore_errors=True)
+                return None  # compacted meanwhile
+            RetrieverPersistence._finish_segment(path, merged["name"])
+            manifest["segments"][at:at + factor] = [merged]
+            generation = RetrieverPersistence._publish(root, RetrieverPersistence._next_number(root), manifest)
+        logging.info(f"Merged {factor} postings segments into {merged['name']} ({generation}).")
+        return generation
+
+    # -------- Load --------
+    @staticmethod
+    def load(dim, model_name, readonly=False):
+        """
+        (generation, store, index, lexical) from disk, migrating a legacy meta.pkl; None if
+        there is no state. A `readonly` load only opens a published generation and never migrates.
+        """
+        generation = RetrieverPersistence.current_generation()
+        if generation is not None:
+            state = RetrieverPersistence.load_generation(generation, dim, readonly, model_name)
+        elif readonly:
+            logging.warning("No published retriever snapshot yet.")
+            return None
+        elif os.path.exists(os.path.join(PERSIST_DIR, "meta.pkl")):
+            state = RetrieverPersistence._migrate_legacy(os.path.join(PERSIST_DIR, "meta.pkl"), dim, model_name)
+        else:
             logging.warning("No retriever state found.")
-            return
+            return None
+        logging.info("Retriever state loaded.")
+        return state
+
+    @staticmethod
+    def load_generation(generation, dim, readonly=False, model_name=None):
+        path = os.path.join(RetrieverPersistence._dir(), generation)
+        manifest = RetrieverPersistence._read_manifest(path)
+        if manifest is None:
+            raise RuntimeError(f"Retriever snapshot {generation} has no manifest")
+        RetrieverPersistence._check(path, manifest, dim, model_name)
+        return (generation,) + RetrieverPersistence._load_logs(manifest, dim, readonly)
+
+    @staticmethod
+    def _check(path, manifest, dim, model_name=None):
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported retriever format {manifest.get('format_version')} in {path}")
+        stored_model = manifest.get("embedding_model")
+        if model_name and stored_model and stored_model != model_name:
+            # Vectors from different models are not comparable even when their dims match
+            raise RuntimeError(f"Stored vectors were embedded with {stored_model} but the embedding model is {model_name}")
+        if manifest["dim"] != dim:
+            raise RuntimeError(f"Stored vectors have dim {manifest['dim']} but the embedding model produces {dim}")
+
+    @staticmethod
+    def _read_columns(path, columns, dim):
+        data = {}
+        for name, (count, dtype) in columns.items():
+            shape = (count, dim) if name == "vectors" else (count,)
+            data[name] = np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=shape) if count \
+                else np.zeros(shape, dtype=dtype)
+        return data
+
+    @staticmethod
+    def _read_docs(path, start, end):
+        lines = _read_range(os.path.join(path, "docs.jsonl"), start, end).decode("utf-8").splitlines()
+        docs = [json.loads(line) for line in lines]
+        return {"doc_ids": [d[0] for d in docs], "titles": [d[1] for d in docs], "metas": [d[2] for d in docs]}
+
+    @staticmethod
+    def _read_terms(path, start, end):
+        return _read_range(os.path.join(path, "terms.txt"), start, end).decode("utf-8").split("\n")[:-1]
+
+    @staticmethod
+    def _read_segment(path, name):
+        return tuple(np.load(os.path.join(path, "segments", name, f"{part}.npy"), mmap_mode="r") for part in ("offsets", "docs", "tfs"))
+
+    @staticmethod
+    def _read_ann(path, manifest, store, readonly):
+        if not manifest["ann"]:
+            return None
+        # Readers never add to the index, so its vectors can stay memory-mapped
+        index = faiss.read_index(os.path.join(path, manifest["ann"]["file"]), faiss.IO_FLAG_MMAP_IFC if readonly else 0)
+        if not readonly and index.ntotal < len(store):
+            index.add(np.ascontiguousarray(store.vectors[index.ntotal:]))
+        return index
 
+    @staticmethod
+    def _load_logs(manifest, dim, readonly=False):
+        path = os.path.join(RetrieverPersistence._dir(), manifest["epoch"])
+        tables = RetrieverPersistence._read_docs(path, 0, manifest["docs_bytes"])
+        tables["sources"] = list(manifest["sources"])
+        store = ChunkStore.from_columns(dim, RetrieverPersistence._read_columns(path, manifest["columns"], dim), tables)
+        store.persisted = manifest
+        lexical = InvertedIndex.from_segments(
+            RetrieverPersistence._read_terms(path, 0, manifest["terms_bytes"]),
+            [RetrieverPersistence._read_segment(path, seg["name"]) for seg in manifest["segments"]],
+            np.diff(store.tokens.offsets.view).astype(np.int32),
+            *manifest["lexical"],
+        )
+        store.terms = lexical.terms
+        index = RetrieverPersistence._read_ann(path, manifest, store, readonly)
+        if not (len(lexical) == len(store) == manifest["count"]):
+            raise RuntimeError(f"Retriever state is inconsistent: {path}")
+        return store, index, lexical
+
+    @staticmethod
+    def follow(state, generation, dim, model_name=None):
+        """
+        Reader: (store, index, lexical) for `generation`. A newer generation of the same epoch
+        extends `state` in place with what was appended; anything else is loaded afresh.
+        """
+        root = RetrieverPersistence._dir()
+        manifest = RetrieverPersistence._read_manifest(os.path.join(root, generation))
+        if manifest is None:
+            raise RuntimeError(f"Retriever snapshot {generation} has no manifest")
+        store, index, lexical = state
+        old = store.persisted if store is not None else None
+        if old is None or manifest["epoch"] != old["epoch"] or manifest["count"] < old["count"]:
+            return RetrieverPersistence.load_generation(generation, dim, readonly=True, model_name=model_name)[1:]
+        RetrieverPersistence._check(generation, manifest, dim, model_name)
+
+        path = os.path.join(root, manifest["epoch"])
+        tables = RetrieverPersistence._read_docs(path, old["docs_bytes"], manifest["docs_bytes"])
+        tables["sources"] = manifest["sources"][len(old["sources"]):]
+        store.follow(RetrieverPersistence._read_columns(path, manifest["columns"], dim), tables)
+        loaded = {seg["name"]: base for seg, base in zip(old["segments"], lexical._bases)}
+        lexical.extend_segments(
+            RetrieverPersistence._read_terms(path, old["terms_bytes"], manifest["terms_bytes"]),
+            [loaded.get(seg["name"]) or RetrieverPersistence._read_segment(path, seg["name"]) for seg in manifest["segments"]],
+            np.diff(store.tokens.offsets.view).astype(np.int32),
+        )
+        if manifest["ann"] != old["ann"]:
+            index = RetrieverPersistence._read_ann(path, manifest, store, readonly=True)
+        store.persisted = manifest
+        return store, index, lexical
+
+    # -------- Migrations --------
+    @staticmethod
+    def _rebuild(chunks, dim, model_name):
+        """Columnar store and lexical index over migrated chunks, written in the current layout."""
+        lexical = InvertedIndex()
+        token_ids = [lexical.intern(c.tokens or RetrieverUtils.tokenize(c.text)) for c in chunks]
+        lexical.add_ids(token_ids)
+        store = ChunkStore(dim)
+        store.terms = lexical.terms
+        if chunks:
+            store.extend(chunks, token_ids)
+        # Starts exact; the engine promotes it to its ANN type if the corpus is large enough
+        generation = RetrieverPersistence.save(store, None, lexical, model_name)
+        return generation, store, None, lexical
+
+    @staticmethod
+    def _migrate_legacy(path, dim, model_name):
+        """Load a pickled meta.pkl (format 1) and rewrite it in the binary layout."""
+        logging.info("Migrating legacy retriever state from meta.pkl.")
         with open(path, "rb") as f:
             meta = pickle.load(f)
 
-        for src in sources:
-            chunks[src] = []
-            for c in meta.get("chunks", {}).get(src, []):
-                chunk = Chunk(**c)
-                if chunk.vector is not None:
-                    chunk.vector = np.array(chunk.vector, dtype=np.float32)
-                    faiss_indices[src].add(chunk.vector.reshape(1, -1))
-                if chunk.tokens:
-                    texts_for_bm25[src].append(chunk.tokens)
-                chunks[src].append(chunk)
-            if texts_for_bm25[src]:
-                bm25[src] = BM25Okapi(texts_for_bm25[src])
-        logging.info("Retriever metadata loaded.")
+        fields = {f.name for f in dataclasses.fields(Chunk)}
+        chunks = []
+        for src, src_chunks in meta.get("chunks", {}).items():
+            for c in src_chunks:
+                chunk = Chunk(**{key: val for key, val in c.items() if key in fields}, source=src)
+                if chunk.vector is None:
+                    continue  # never reached FAISS in format 1, so it had no valid position
+                chunk.vector = np.asarray(chunk.vector, dtype=np.float32)
+                if chunk.raw_numbers is None and "raw_numbers" in (chunk.meta or {}):
+                    # Format 1 kept numbers in the chunk meta; meta is now stored per document
+                    chunk.meta = dict(chunk.meta)
+                    chunk.raw_numbers = chunk.meta.pop("raw_numbers")
+                chunks.append(chunk)
+
+        state = RetrieverPersistence._rebuild(chunks, dim, model_name)
+        os.replace(path, path + ".migrated")
+        logging.info("Legacy retriever state migrated.")
+        return state
@@ -0,0 +1,29 @@
+from typing import List
+
+from celery_app import celery_app
+from .config import INGEST_TASK_RETRIES
+from .ingest_jobs import get_job_store, get_preparer, prepare_documents
+
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=INGEST_TASK_RETRIES, default_retry_delay=5)
+def ingest_documents_task(self, job_id: str, indices: List[int]) -> dict:
+    """
+    Prepare documents `indices` of an ingest job. Acknowledged only once it returns, so a
+    task whose worker dies is delivered again; a retry only redoes the documents that have
+    not finished. Workers load no index: they embed through the shared embedding cache and
+    leave indexing to the writer.
+    """
+    jobs = get_job_store()
+    try:
+        result = prepare_documents(jobs, get_preparer(), job_id, indices)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        result = {"retry": {index: e for index in indices}}
+    retry = result.pop("retry")
+    if retry and self.request.retries < self.max_retries:
+        raise self.retry(exc=next(iter(retry.values())))
+    for index, e in retry.items():
+        jobs.finish_item(job_id, index, error=str(e) or type(e).__name__)
+    return {**result, "failed": result.get("failed", 0) + len(retry)}
+
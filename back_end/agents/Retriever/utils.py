@@ -1,12 +1,14 @@
 import re
-import uuid
-from typing import List, Dict, Any
+import hashlib
+from itertools import chain
+from typing import List, Dict, Any, Iterator
 from collections import Counter
-from PyPDF2 import PdfReader
 from bs4 import BeautifulSoup
-import requests
 import numpy as np
 
+from .schema import Chunk
+from .normalize import normalize_text
+
 
 # ------------------- Text Cleaning -------------------
 def clean_text(text: str) -> str:
@@ -28,43 +30,21 @@ def extract_keywords(text: str, top_n=5) -> List[str]:
     return [w for w, _ in freq.most_common(top_n)]
 
 
-# ------------------- PDF Extraction -------------------
-def extract_pdf_text(file_path: str) -> List[Dict[str, Any]]:
-    """Extract clean text from each page of a PDF."""
-    texts = []
-    try:
-        reader = PdfReader(file_path)
-        if reader.is_encrypted:
-            reader.decrypt("")  # try empty password
-        for i, page in enumerate(reader.pages):
-            page_text = clean_text(page.extract_text() or "")
-            if page_text:
-                texts.append({"page": i + 1, "text": page_text})
-    except Exception as e:
-        raise RuntimeError(f"Failed to read PDF {file_path}: {e}")
-    return texts
+# ------------------- URL Fetching -------------------
+FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/115.0 Safari/537.36"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+}
 
 
-# ------------------- URL Fetching -------------------
-def fetch_and_clean_url(url: str) -> str:
-    """Download a webpage and return cleaned text."""
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/115.0 Safari/537.36"
-        ),
-        "Accept-Language": "en-US,en;q=0.9",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    }
-
-    try:
-        resp = requests.get(url, headers=headers, timeout=15)
-        resp.raise_for_status()
-    except Exception as e:
-        raise RuntimeError(f"Failed to fetch URL {url}: {e}")
-
-    soup = BeautifulSoup(resp.text, "html.parser")
+def html_to_text(html: str) -> str:
+    """Cleaned visible text of an HTML page."""
+    soup = BeautifulSoup(html, "html.parser")
 
     # Remove scripts, style, and non-content tags
     for tag in soup(["script", "style", "noscript", "header", "footer", "form", "meta", "link"]):
@@ -75,13 +55,20 @@ def fetch_and_clean_url(url: str) -> str:
 
 
 # ------------------- Numbers Extraction -------------------
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
 def extract_numbers(text: str) -> List[float]:
     """Extract numeric values from text."""
-    matches = re.findall(r'-?\d+(?:\.\d+)?', text)
+    matches = NUMBER_RE.findall(text)
     return [float(m) for m in matches]
 
 
 # ------------------- Text Chunking -------------------
+TOKEN_RE = re.compile(r"\S+")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
 def chunk_text(
     text: str,
     chunk_size: int = 500,
@@ -89,30 +76,112 @@ def chunk_text(
     doc_id: str = None,
     title: str = None,
     meta: Dict[str, Any] = None
-) -> List[Dict[str, Any]]:
-    """Split text into overlapping chunks with metadata."""
+) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield overlapping chunks of `chunk_size` whitespace tokens.
+
+    Only token and number offsets are held for the document; each chunk's text is sliced
+    from the source when it is yielded. Chunk ids are derived from doc_id, token offset and
+    content, so re-chunking the same text gives the same ids. `meta` is shared by all
+    chunks of the document, not copied.
+    """
     meta = meta or {}
-    tokens = text.split()
-    chunks = []
-    start = 0
-    while start < len(tokens):
-        end = min(start + chunk_size, len(tokens))
-        chunk_tokens = tokens[start:end]
-        chunk_text_str = " ".join(chunk_tokens)
-        chunk_meta = meta.copy()
-        chunk_meta["raw_numbers"] = extract_numbers(chunk_text_str)
-        chunk = {
-            "chunk_id": str(uuid.uuid4()),
-            "doc_id": doc_id or "unknown",
+    doc_id = doc_id or "unknown"
+    spans = np.fromiter(
+        chain.from_iterable(m.span() for m in TOKEN_RE.finditer(text)), dtype=np.int64
+    ).reshape(-1, 2)
+
+    # Numbers never contain whitespace, so each belongs to exactly one token
+    num_pos, num_vals = [], []
+    for m in NUMBER_RE.finditer(text):
+        num_pos.append(m.start())
+        num_vals.append(float(m.group()))
+    num_token = np.searchsorted(spans[:, 0], num_pos, side="right") - 1
+
+    step = max(1, chunk_size - chunk_overlap)
+    for start in range(0, len(spans), step):
+        end = min(start + chunk_size, len(spans))
+        chunk_text_str = WHITESPACE_RE.sub(" ", text[spans[start, 0]:spans[end - 1, 1]])
+        lo, hi = np.searchsorted(num_token, [start, end])
+        digest = hashlib.sha256(chunk_text_str.encode("utf-8")).hexdigest()[:16]
+        yield {
+            "chunk_id": f"{doc_id}:{start}:{digest}",
+            "doc_id": doc_id,
             "title": title,
             "text": chunk_text_str,
-            "meta": chunk_meta
+            "meta": meta,
+            "raw_numbers": num_vals[lo:hi],
         }
+
+
+class ChunkStream:
+    """
+    chunk_text over text that arrives in pieces, such as the pages of a PDF as they are
+    parsed, joined by single spaces. `feed` returns the chunks whose tokens have all
+    arrived and `close` the rest; together they are what chunk_text yields for the joined
+    text, with the same offsets and ids.
+    """
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100, doc_id: str = None,
+                 title: str = None, meta: Dict[str, Any] = None):
+        self.chunk_size = chunk_size
+        self.step = max(1, chunk_size - chunk_overlap)
+        self.doc_id = doc_id or "unknown"
+        self.title = title
+        self.meta = meta or {}
+        self._tokens = []
+        self._numbers = []  # per token; numbers never contain whitespace
+        self._next = 0      # token offset of the next chunk
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        for token in TOKEN_RE.findall(text):
+            self._tokens.append(token)
+            self._numbers.append([float(m) for m in NUMBER_RE.findall(token)])
+        return self._emit(final=False)
+
+    def close(self) -> List[Dict[str, Any]]:
+        return self._emit(final=True)
+
+    def _emit(self, final: bool) -> List[Dict[str, Any]]:
+        chunks, n = [], len(self._tokens)
+        # A chunk is complete once the tokens past its end have arrived, or the text has ended
+        while self._next < n and (final or self._next + self.chunk_size <= n):
+            start, end = self._next, min(self._next + self.chunk_size, n)
+            text = " ".join(self._tokens[start:end])
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            chunks.append({
+                "chunk_id": f"{self.doc_id}:{start}:{digest}",
+                "doc_id": self.doc_id,
+                "title": self.title,
+                "text": text,
+                "meta": self.meta,
+                "raw_numbers": [x for nums in self._numbers[start:end] for x in nums],
+            })
+            self._next += self.step
+        return chunks
+
+
+def make_chunks(chunk_data, source_type: str) -> List[Chunk]:
+    """Normalized, tokenized Chunks of chunk_text output, dropping chunks left empty."""
+    chunks = []
+    for c in chunk_data:
+        c["text"] = normalize_text(c["text"], "retriever")
+        if not c["text"]:
+            continue
+        chunk = Chunk(**c, source=source_type)
+        chunk.tokens = RetrieverUtils.tokenize(chunk.text)
         chunks.append(chunk)
-        start += chunk_size - chunk_overlap
     return chunks
 
 
+def chunk_documents(items, source_type: str, chunk_size: int = 500, chunk_overlap: int = 100) -> List[List[Chunk]]:
+    """Normalized, tokenized chunks of each item ({doc_id, text, title?, meta?}), one list per item."""
+    return [
+        make_chunks(chunk_text(it["text"], chunk_size, chunk_overlap, it["doc_id"], it.get("title"), it.get("meta", {})), source_type)
+        for it in items
+    ]
+
+
 # ------------------- Retriever Utils -------------------
 class RetrieverUtils:
     EPS = 1e-10
@@ -127,14 +196,6 @@ class RetrieverUtils:
         return v / (norm + RetrieverUtils.EPS)
 
     @staticmethod
-    def filter_irrelevant_numbers(text: str) -> str:
-        """Drop noisy number-like patterns (ISBNs, SKUs, dimensions, etc.)."""
-        # Drop ISBNs
-        text = re.sub(r"\b97[89][0-9]{10}\b", "", text)
-        # Drop product dimensions
-        text = re.sub(r"\b\d+(\.\d+)?\s?(cm|mm|inch|inches|kg|lbs)\b", "", text, flags=re.I)
-        # Drop ASINs / SKU-like codes
-        text = re.sub(r"\b[A-Z0-9]{8,}\b", "", text)
-        # Drop page numbers
-        text = re.sub(r"\bPage\s?\d+\b", "", text, flags=re.I)
-        return text.strip()
+    def normalize_rows(m: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        return m / (norms + RetrieverUtils.EPS)
@@ -1,12 +1,14 @@
 # Agents/Pipeline/pipeline.py
 import re
 import uuid
+import asyncio
 from fastapi import APIRouter
 from typing import Union
 
 from model.retriever_model import RetrieveRequest
 from model.extractor_model import Evidence, RetrievalOutput, ExtractionOutput, ExtractionError
-from agents.Retriever.retriever import engine
+from agents.Retriever.retriever import get_engine, RetrieverNotReady
+from agents.Retriever.normalize import normalize_text
 from agents.Extractor.run_extraction import run_extraction
 from agents.experimentation.tasks import run_experiment_task
 from agents.experimentation.models import TwoSampleInput, ExperimentOutput
@@ -64,10 +66,27 @@ async def pipeline_run(req: RetrieveRequest):
         if isinstance(section_filters, str):
             section_filters = [s.strip() for s in section_filters.split(",")]
 
-        for src in section_filters:
-            all_results.extend(
-                engine.retrieve(query=req.query, k=req.k, alpha=req.alpha, source_type=src)
+        try:
+            # One search over all requested sources, ranked together; run off the event loop,
+            # as it blocks while the index is still loading
+            all_results = await asyncio.to_thread(
+                get_engine().retrieve, query=req.query, k=req.k, alpha=req.alpha,
+                source_type=section_filters, doc_ids=req.doc_ids,
+                fusion=req.fusion, nprobe=req.nprobe, ef_search=req.ef_search,
+                mmr_lambda=req.mmr_lambda, max_per_doc=req.max_per_doc,
             )
+        except RetrieverNotReady as e:
+            return {
+                "status": "error",
+                "error": str(e),
+                "reason_code": "RETRIEVER_NOT_READY"
+            }
+        except ValueError as e:
+            return {
+                "status": "error",
+                "error": str(e),
+                "reason_code": "INVALID_REQUEST"
+            }
 
     if not all_results:
         return {
@@ -79,22 +98,8 @@ async def pipeline_run(req: RetrieveRequest):
     # --- Step 2: Clean chunks ---
     cleaned_chunks = []
     for c in all_results:
-        text = re.sub(
-            r"(Cached - Similar pages.*|Search Preferences.*|Next Search.*)",
-            "",
-            c["text"],
-            flags=re.IGNORECASE
-        )
-        text = re.sub(r"\s+", " ", text).strip()[:1000]
-
+        text = normalize_text(c["text"], "pipeline")
         if text:
-            # Drop irrelevant numeric noise
-            text = re.sub(r"\bISBN[- ]?\d+\b", "", text, flags=re.IGNORECASE)
-            text = re.sub(r"\b\d{4}\b", "", text)
-            text = re.sub(r"\b\d+(\.\d+)?\s*(cm|kg|lbs|in|mm)\b", "", text)
-            text = re.sub(r"\b[A-Z0-9]{8,}\b", "", text)
-            text = re.sub(r"\b\d{5,}\b", "", text)
-
             cleaned_chunks.append({
                 "chunk_id": c["chunk_id"],
                 "doc_id": c["doc_id"],
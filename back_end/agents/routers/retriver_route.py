@@ -1,65 +1,119 @@
 # Agents/Retriever/retriever.py
-import os
-import uuid
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from model.retriever_model import IngestRequest
-from agents.Retriever.utils import extract_pdf_text, fetch_and_clean_url
-from redis_client import get_cached_chunk, set_cached_chunk
-from agents.Retriever.retriever import engine  # your ingestion engine
+import logging
+from fastapi import APIRouter, HTTPException
+from model.retriever_model import IngestRequest, DeleteRequest, RetrieveBatchRequest, RetrieveBatchResponse
+from agents.Retriever.fetcher import get_fetcher
+from agents.Retriever.retriever import get_engine, RetrieverNotReady
+from agents.Retriever.ingest_jobs import get_job_store, submit_job, requeue
+from agents.Retriever import ann
 
 retriever_router = APIRouter(prefix="/retriever", tags=["retriever"])
 
 @retriever_router.get("/health")
 def health():
+    engine = get_engine()
     return {
-        "ok": True,
-        "sources": {src: len(engine.chunks[src]) for src in engine.SOURCES},
-        "model": os.getenv("EMBEDDING_MODEL", "embed-english-v3.0"),
+        "ok": engine.status != "error",
+        "status": engine.status,
+        "role": engine.role,
+        "generation": engine.generation,
+        "progress": engine.progress,
+        "error": engine.error,
+        "sources": engine.source_counts() if engine.status == "ready" else {},
+        "index": ann.index_kind(engine.faiss_index) if engine.faiss_index is not None else None,
+        **engine.maintenance_status(),
+        "deleted_chunks": engine.store.n_deleted if engine.status == "ready" else 0,
+        "embed_cache": engine.embed_cache.stats() if engine.embed_cache else None,
+        "query_cache": engine.query_embedder.stats(),
+        "model": engine.model_name,
+        "fetcher": get_fetcher().stats(),
     }
 
-async def get_text_from_item(item):
-    """Helper to fetch text from PDF, URL, or raw text, with Redis caching."""
-    key = item.doc_id or item.url or item.file_path
-    cached = await get_cached_chunk(key)
-    if cached:
-        return cached, {"source_type": "text" if getattr(item, "text", None) else "url" if getattr(item, "url", None) else "pdf"}
-
-    if getattr(item, "text", None):
-        text_data = item.text.strip()
-        meta = {"source_type": "text"}
-    elif getattr(item, "url", None):
-        raw = fetch_and_clean_url(item.url)
-        text_data = " ".join([p.get("text", "") for p in raw]) if isinstance(raw, list) else raw or ""
-        meta = {"source_type": "url", "url": item.url}
-    elif getattr(item, "file_path", None):
-        raw = extract_pdf_text(item.file_path)
-        text_data = " ".join([p.get("text", "") for p in raw]) if isinstance(raw, list) else raw or ""
-        meta = {"source_type": "pdf", "file": item.file_path}
-    else:
-        raise HTTPException(400, "Provide text, URL, or file_path.")
-
-    await set_cached_chunk(key, text_data)
-    return text_data, meta
+@retriever_router.post("/retrieve/batch", response_model=RetrieveBatchResponse)
+def retrieve_batch(req: RetrieveBatchRequest):
+    if not req.queries:
+        raise HTTPException(400, "No queries provided.")
+    engine = get_engine()
+    try:
+        hits = engine.retrieve_many(
+            req.queries, k=req.k, alpha=req.alpha, source_type=req.source_type, doc_ids=req.doc_ids,
+            fusion=req.fusion, nprobe=req.nprobe, ef_search=req.ef_search,
+            mmr_lambda=req.mmr_lambda, max_per_doc=req.max_per_doc,
+        )
+    except RetrieverNotReady as e:
+        raise HTTPException(503, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    provenance = {
+        "k": req.k, "alpha": req.alpha, "fusion": req.fusion, "source_type": req.source_type,
+        "mmr_lambda": req.mmr_lambda, "max_per_doc": req.max_per_doc,
+    }
+    return {"results": [{"query": q, "results": h, "provenance": provenance} for q, h in zip(req.queries, hits)]}
+
+def _queue(submit, n_docs):
+    # Writes are applied by the writer process, whichever process accepts them
+    try:
+        job_id = submit()
+    except Exception as e:
+        logging.exception("Could not queue retriever job.")
+        raise HTTPException(503, f"Could not queue retriever job: {e}")
+    return {"status": "queued", "job_id": job_id, "documents": n_docs}
+
+
+def _submit(items, replace=False):
+    return _queue(lambda: submit_job([item.model_dump() for item in items], replace), len(items))
+
 
 @retriever_router.post("/ingest")
-async def ingest(req: IngestRequest, background_tasks: BackgroundTasks):
+def ingest(req: IngestRequest):
+    """Queue an ingest job: workers prepare each document, the writer indexes them."""
+    if not req.items:
+        raise HTTPException(400, "No items provided.")
+    return _submit(req.items)
+
+
+@retriever_router.post("/upsert")
+def upsert(req: IngestRequest):
+    """Ingest items, replacing documents already indexed under the same doc_id."""
     if not req.items:
         raise HTTPException(400, "No items provided.")
+    return _submit(req.items, replace=True)
+
+
+@retriever_router.get("/ingest/{job_id}")
+def ingest_status(job_id: str):
+    """Progress of an ingest, upsert or delete job: documents, chunks and embeddings completed."""
+    status = get_job_store().status(job_id)
+    if status is None:
+        raise HTTPException(404, f"Unknown or expired ingest job: {job_id}")
+    return status
+
+
+@retriever_router.post("/ingest/{job_id}/resume")
+def resume_ingest(job_id: str):
+    """Re-queue the documents of a job whose tasks were lost, e.g. with a broker restart."""
+    jobs = get_job_store()
+    if jobs.status(job_id) is None:
+        raise HTTPException(404, f"Unknown or expired ingest job: {job_id}")
+    if jobs.kind(job_id) == "delete":
+        return {"job_id": job_id, "requeued": 0}  # applied by the writer, with no tasks to lose
+    return {"job_id": job_id, "requeued": requeue(job_id, jobs.pending(job_id))}
+
+
+@retriever_router.post("/delete")
+def delete(req: DeleteRequest):
+    """Queue a delete job: the writer removes the documents, which compaction later reclaims."""
+    if not req.doc_ids:
+        raise HTTPException(400, "No doc_ids provided.")
+    return _queue(lambda: get_job_store().create_delete(req.doc_ids), len(req.doc_ids))
+
 
-    async def process_batch():
-        batch = {"pdf": [], "url": [], "text": []}
-        for item in req.items:
-            text_data, meta = await get_text_from_item(item)
-            batch[meta["source_type"]].append({
-                "doc_id": item.doc_id or str(uuid.uuid4()),
-                "title": item.title or "",
-                "text": text_data,
-                "meta": meta,
-            })
-        for src, items in batch.items():
-            if items:
-                engine.ingest_batch(items, source_type=src)
-        engine.save()
-
-    background_tasks.add_task(process_batch)
-    return {"status": "processing"}
+@retriever_router.post("/compact")
+def compact():
+    """Ask the writer to compact the index once no ANN build is running."""
+    try:
+        get_job_store().request_compaction()
+    except Exception as e:
+        logging.exception("Could not queue compaction.")
+        raise HTTPException(503, f"Could not queue compaction: {e}")
+    return {"status": "queued"}
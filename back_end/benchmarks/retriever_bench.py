@@ -0,0 +1,233 @@
+"""
+Retriever benchmark: synthetic corpora, the offline hashing embedder and a JSON report.
+
+Run from back_end/:
+
+    python -m benchmarks.retriever_bench --sizes 10000,100000,1000000 --out bench.json
+    python -m benchmarks.retriever_bench --sizes 10000 --baseline bench.json
+
+Each corpus size runs in its own process, so peak RSS is per size. Measured per size:
+ingest throughput, save time, cold-start load time, p50/p95/p99 query latency for
+vector-only, BM25-only and hybrid retrieval per index type, and recall@k of approximate
+indexes against exact search. Queries run one at a time with the query cache and
+micro-batching window off, so latencies are the engine's own cost.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+import numpy as np
+
+WORDS_PER_CHUNK = 60
+CHUNKS_PER_DOC = 10
+N_TOPICS = 200
+VOCAB_SIZE = 20000
+INGEST_BATCH_DOCS = 500
+
+
+# -------- Synthetic corpus --------
+def _topic_words(rng):
+    """Per-topic word ids: each topic draws from its own Zipf-weighted slice of the vocabulary."""
+    ranks = np.arange(1, VOCAB_SIZE // 10 + 1)
+    weights = 1.0 / ranks
+    weights /= weights.sum()
+    return [rng.permutation(VOCAB_SIZE)[:ranks.size] for _ in range(N_TOPICS)], weights
+
+
+def make_corpus(n_chunks: int, seed: int = 0):
+    """Documents of CHUNKS_PER_DOC chunks of WORDS_PER_CHUNK words, each on one topic."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"w{i}" for i in range(VOCAB_SIZE)])
+    topics, weights = _topic_words(rng)
+    docs = []
+    for d in range(max(1, n_chunks // CHUNKS_PER_DOC)):
+        topic = topics[d % N_TOPICS]
+        words = vocab[topic[rng.choice(topic.size, size=WORDS_PER_CHUNK * CHUNKS_PER_DOC, p=weights)]]
+        docs.append({"doc_id": f"doc{d}", "title": f"Document {d}", "text": " ".join(words.tolist()), "meta": {}})
+    return docs
+
+
+def make_queries(n_queries: int, seed: int = 1):
+    rng = np.random.default_rng(0)
+    vocab = np.array([f"w{i}" for i in range(VOCAB_SIZE)])
+    topics, weights = _topic_words(rng)
+    rng = np.random.default_rng(seed)
+    return [
+        " ".join(vocab[topics[rng.integers(N_TOPICS)][rng.choice(weights.size, size=4, p=weights)]].tolist())
+        for _ in range(n_queries)
+    ]
+
+
+# -------- Measurements --------
+def _latency(fn, queries):
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        times.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3)}
+
+
+def _recall(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0].tolist()) & set(e.tolist())) for f, e in zip(found, exact))
+    return round(hits / exact.size, 4)
+
+
+def run_size(n_chunks: int, opts: dict) -> dict:
+    """Benchmark one corpus size; runs in a fresh process so env and RSS are its own."""
+    persist_dir = tempfile.mkdtemp(prefix="retriever-bench-")
+    try:
+        return _run_size(n_chunks, opts, persist_dir)
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+
+def _run_size(n_chunks: int, opts: dict, persist_dir: str) -> dict:
+    os.environ.update(
+        RETRIEVER_PERSIST_DIR=persist_dir,
+        RETRIEVER_EMBED_CACHE="off",
+        RETRIEVER_QUERY_CACHE_SIZE="0",
+        RETRIEVER_QUERY_BATCH_WINDOW_MS="0",  # queries are sequential; nothing to batch with
+        RETRIEVER_ANN_THRESHOLD=str(10 ** 12),  # indexes are built explicitly below
+    )
+    from agents.Retriever import ann
+    from agents.Retriever.providers import HashingProvider
+    from agents.Retriever.retriever import RetrieverEngine
+    from agents.Retriever.utils import RetrieverUtils
+
+    k = opts["k"]
+    provider = HashingProvider(opts["dim"])
+    result = {"chunks": n_chunks}
+
+    docs = make_corpus(n_chunks)
+    queries = make_queries(opts["queries"])
+    engine = RetrieverEngine(background=False, provider=provider)
+
+    start = time.perf_counter()
+    for i in range(0, len(docs), INGEST_BATCH_DOCS):
+        engine.ingest_batch(docs[i:i + INGEST_BATCH_DOCS], "bench", chunk_size=WORDS_PER_CHUNK, chunk_overlap=0)
+    seconds = time.perf_counter() - start
+    result["chunks"] = len(engine.store)
+    result["ingest"] = {"seconds": round(seconds, 3), "chunks_per_s": round(len(engine.store) / seconds, 1)}
+    del docs
+
+    start = time.perf_counter()
+    engine.save()
+    result["save_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    engine = RetrieverEngine(background=False, provider=provider)
+    result["load_s"] = round(time.perf_counter() - start, 3)
+
+    store, lexical = engine.store, engine._lexical
+    n = len(store)
+    qv = engine.query_embedder.embed_all(queries)
+    exact_I, _ = ann.exact_search(store.vectors, qv, k)
+
+    def bm25(q):
+        pos, scores = lexical.score(RetrieverUtils.tokenize(q))
+        return pos[np.argpartition(-scores, k)[:k]] if pos.size > k else pos
+
+    result["bm25"] = _latency(bm25, queries)
+    result["indexes"] = {}
+    for kind in opts["indexes"]:
+        entry = {}
+        index = None
+        if kind != "flat":
+            start = time.perf_counter()
+            index = ann.build_trained(kind, store.vectors)
+            entry["build_s"] = round(time.perf_counter() - start, 3)
+            _, I = index.search(qv, k)
+            entry[f"recall@{k}"] = _recall(I, exact_I)
+        engine._publish(store, lexical, index)
+
+        def vector(q):
+            return engine._search(store, index, engine.query_embedder.embed(q)[None, :], None, k, n)
+
+        entry["vector"] = _latency(vector, queries)
+        entry["hybrid"] = _latency(lambda q: engine.retrieve(q, k=k), queries)
+        result["indexes"][kind] = entry
+
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+# -------- Report --------
+def _meta(opts: dict) -> dict:
+    import faiss
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+        "cpus": os.cpu_count(),
+        "options": opts,
+    }
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, sub, out)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    return out
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.1):
+    """Print metrics that moved by more than `threshold` against a baseline report."""
+    old_runs = {run["chunks"]: run for run in baseline["runs"]}
+    for run in report["runs"]:
+        old = old_runs.get(run["chunks"])
+        if old is None:
+            continue
+        new_flat, old_flat = _flatten("", run, {}), _flatten("", old, {})
+        for key, value in sorted(new_flat.items()):
+            before = old_flat.get(key)
+            if before and abs(value - before) / abs(before) > threshold:
+                print(f"{run['chunks']:>9} {key:<40} {before:>12} -> {value:<12} ({(value - before) / before:+.0%})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated corpus sizes in chunks")
+    parser.add_argument("--indexes", default="flat,hnsw,ivf_flat", help="index types to measure; flat is exact search")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--out", default="retriever_bench.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+
+    opts = {"queries": args.queries, "k": args.k, "dim": args.dim, "indexes": args.indexes.split(",")}
+    report = {"meta": _meta(opts), "runs": []}
+    ctx = multiprocessing.get_context("spawn")
+    for size in (int(s) for s in args.sizes.split(",")):
+        with ctx.Pool(1) as pool:
+            run = pool.apply(run_size, (size, opts))
+        print(json.dumps(run), flush=True)
+        report["runs"].append(run)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,4 +12,4 @@ celery_app = Celery(
     backend=REDIS_URL,
 )
 
-celery_app.autodiscover_tasks(["agents.experimentation.tasks"])
+celery_app.autodiscover_tasks(["agents.experimentation.tasks", "agents.Retriever.tasks"])
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from dotenv import load_dotenv
 from agents.routers.retriver_route import retriever_router
@@ -5,10 +6,25 @@ from agents.routers.extractor_route import extractor_router
 from agents.routers.pipeline import router as pipeline_router
 from agents.routers.experimentation_router import experimentation_router
 from agents.routers.judging_router import judging_router
+from agents.Retriever.retriever import get_engine
+from agents.Retriever.fetcher import get_fetcher
+from agents.Retriever.ingest_jobs import start_ingest_runner
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start loading the retriever corpus in the background; requests are served meanwhile
+    engine = get_engine()
+    if engine.role == "writer":
+        # Indexes documents that ingest workers have prepared, including jobs left by a previous run
+        start_ingest_runner(engine)
+    yield
+    await get_fetcher().aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 
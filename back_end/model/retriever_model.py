@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any, TypedDict, Union
+from typing import List, Optional, Dict, Any, TypedDict, Union, Literal
 from pydantic import BaseModel, Field
 
 
@@ -12,6 +12,8 @@ class IngestItem(BaseModel):
     
     url: Optional[str] = None         # web links
     file_path: Optional[str] = None   # PDFs, reports
+    text: Optional[str] = None        # raw text
+    source_type: Optional[str] = None # any source name; defaults to text / url / pdf
     meta: Optional[dict] = None       # extra metadata (author, year, etc.)
 
 
@@ -19,6 +21,10 @@ class IngestRequest(BaseModel):
     items: List[IngestItem]
 
 
+class DeleteRequest(BaseModel):
+    doc_ids: List[str]
+
+
 class IngestTextRequest(BaseModel):
     items: List[IngestItem]
     chunk_size: int = 900
@@ -32,16 +38,36 @@ class RetrieveRequest(BaseModel):
     query: str
     k: int = 5
     alpha: float = 0.5
+    fusion: Literal["weighted", "minmax", "zscore", "rrf"] = "weighted"
     section_filter: Union[str, List[str]] = "pdf"  # <-- accept str or list
     source_type: Optional[str] = None
+    doc_ids: Optional[List[str]] = None  # restrict retrieval to these documents
+    nprobe: Optional[int] = None     # IVF lists probed per query (ANN indexes only)
+    ef_search: Optional[int] = None  # HNSW search breadth (ANN indexes only)
+    mmr_lambda: Optional[float] = None  # 0..1; reranks results for diversity (1 = relevance only)
+    max_per_doc: Optional[int] = None   # at most this many chunks from one document
     # NEW: allow direct evidence injection
     pdfs: Optional[List[Dict[str, str]]] = None   # [{"doc_id":.., "title":.., "content":..}]
     urls: Optional[List[Dict[str, str]]] = None   # [{"doc_id":.., "title":.., "content":..}]
 
 
+class RetrieveBatchRequest(BaseModel):
+    queries: List[str]
+    k: int = 5
+    alpha: float = 0.5
+    fusion: Literal["weighted", "minmax", "zscore", "rrf"] = "weighted"
+    source_type: Optional[Union[str, List[str]]] = None  # one or more sources; None searches all
+    doc_ids: Optional[List[str]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    mmr_lambda: Optional[float] = None
+    max_per_doc: Optional[int] = None
+
+
 class ChunkOut(BaseModel):
     chunk_id: str
     doc_id: str
+    source: Optional[str] = None
     title: Optional[str] = None
     text: str
     meta: Dict[str, Any] = Field(default_factory=dict)
@@ -58,6 +84,10 @@ class RetrieveResponse(BaseModel):
     provenance: Dict[str, Any]
 
 
+class RetrieveBatchResponse(BaseModel):
+    results: List[RetrieveResponse]  # one per query, in request order
+
+
 # =========================================================
 # Variable Specification (Schemas, Configs)
 # =========================================================
@@ -71,10 +101,13 @@ __all__ = [
     "IngestItem",
     "IngestRequest",
     "IngestTextRequest",
+    "DeleteRequest",
     # Retrieval
     "RetrieveRequest",
+    "RetrieveBatchRequest",
     "ChunkOut",
     "RetrieveResponse",
+    "RetrieveBatchResponse",
     # Extra Specs
     "VariableSpec",
 ]
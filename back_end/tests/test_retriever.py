@@ -0,0 +1,969 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from back_end.agents.Retriever.fusion import fuse_scores
+from back_end.agents.Retriever.diversify import mmr_select
+from back_end.agents.Retriever.lexical import InvertedIndex
+from back_end.agents.Retriever import ann
+from back_end.agents.Retriever.chunk_store import ChunkStore
+from back_end.agents.Retriever import store as persistence
+from back_end.agents.Retriever.schema import Chunk
+from back_end.agents.Retriever.embed_cache import LocalEmbeddingCache
+from back_end.agents.Retriever.embedder import BatchEmbedder, QueryEmbedder
+from back_end.agents.Retriever.utils import ChunkStream, chunk_text
+from back_end.agents.Retriever.fetcher import UrlFetcher
+from back_end.agents.Retriever.pdf_pool import PdfPageStream
+from back_end.agents.Retriever.ingest_jobs import IngestJobStore, extract_texts, item_source
+from back_end.agents.Retriever.doc_cache import DocumentCache, decode_text, encode_text, load_codec
+from back_end.agents.Retriever.normalize import normalize_text
+from back_end.agents.Retriever.providers import HashingProvider, local_model_id, make_provider
+from back_end.benchmarks import retriever_bench
+
+
+def test_weighted_fusion_scatters_scores_by_position():
+    cand, hybrid, vec, lex = fuse_scores([4, 1], [0.9, 0.5], [1, 7], [3.0, 1.0], alpha=0.5)
+
+    assert cand.tolist() == [1, 4, 7]
+    assert vec.tolist() == [0.5, 0.9, 0.0]
+    assert lex.tolist() == [3.0, 0.0, 1.0]
+    assert np.allclose(hybrid, [1.75, 0.45, 0.5])
+
+
+@pytest.mark.parametrize("mode", ["minmax", "zscore", "rrf"])
+def test_normalized_fusion_ranks_shared_hit_first(mode):
+    cand, hybrid, _, _ = fuse_scores([2, 0, 5], [0.8, 0.7, 0.1], [2, 3], [12.0, 2.0], alpha=0.5, mode=mode)
+
+    assert cand[np.argmax(hybrid)] == 2
+
+
+def test_unknown_fusion_mode_rejected():
+    with pytest.raises(ValueError):
+        fuse_scores([0], [1.0], [0], [1.0], mode="max")
+
+
+def test_mmr_skips_near_duplicates_and_caps_documents():
+    vectors = np.array([[1, 0], [0.999, 0.045], [0.6, 0.8], [0, 1]], dtype=np.float32)
+    relevance = [0.9, 0.89, 0.5, 0.4]
+
+    assert mmr_select(relevance, 2).tolist() == [0, 1]
+    assert mmr_select(relevance, 2, vectors=vectors, lambda_=0.5).tolist() == [0, 3]
+    assert mmr_select(relevance, 3, groups=["a", "a", "a", "b"], max_per_group=1).tolist() == [0, 3]
+
+
+def test_inverted_index_scores_only_matching_chunks():
+    index = InvertedIndex()
+    index.add([["dropout", "improves", "accuracy"], ["batch", "size"]])
+    index.add([["dropout", "dropout", "rate"]])
+
+    pos, scores = index.score(["dropout"])
+
+    assert pos.tolist() == [0, 2]
+    assert scores[1] > scores[0] > 0
+    assert index.score(["unseen"])[0].size == 0
+
+
+@pytest.fixture
+def persist_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "PERSIST_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _add_chunks(store, index, chunks):
+    token_ids = [index.intern(c.tokens) for c in chunks]
+    index.add_ids(token_ids)
+    store.extend(chunks, token_ids)
+
+
+def _token_chunks(token_lists, first=0):
+    vec = np.array([1, 0], np.float32)
+    return [Chunk(f"c{i}", f"d{i}", "", " ".join(tokens), {}, [], "text", vec, tokens) for i, tokens in enumerate(token_lists, first)]
+
+
+def test_inverted_index_roundtrip(persist_dir):
+    index, store = InvertedIndex(), ChunkStore(dim=2)
+    store.terms = index.terms
+    _add_chunks(store, index, _token_chunks([["a", "b", "b"], ["b", "c"], []]))
+    persistence.RetrieverPersistence.save(store, None, index, "model")
+
+    _, _, _, loaded = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+
+    assert len(loaded) == 3
+    for q in (["b"], ["a", "c"]):
+        assert np.allclose(loaded.score(q)[1], index.score(q)[1])
+
+
+def test_loaded_inverted_index_merges_new_postings_on_save(persist_dir):
+    index, store = InvertedIndex(), ChunkStore(dim=2)
+    store.terms = index.terms
+    _add_chunks(store, index, _token_chunks([["a", "b", "b"], ["b", "c"]]))
+    persistence.RetrieverPersistence.save(store, None, index, "model")
+    _, loaded_store, _, loaded = persistence.RetrieverPersistence.load(2, "model")
+
+    for idx, st in ((index, store), (loaded, loaded_store)):
+        _add_chunks(st, idx, _token_chunks([["b", "d"], ["a"]], first=2))
+    persistence.RetrieverPersistence.save(loaded_store, None, loaded, "model")
+    _, _, _, reloaded = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+
+    for q in (["a"], ["b"], ["d", "c"]):
+        assert reloaded.score(q)[0].tolist() == index.score(q)[0].tolist()
+        assert np.allclose(reloaded.score(q)[1], index.score(q)[1])
+
+
+def test_local_embedding_cache_hits_on_normalized_text(tmp_path):
+    cache = LocalEmbeddingCache("model-a", 3, path=str(tmp_path / "cache.sqlite"))
+    cache.store(["dropout  improves\naccuracy"], np.array([[0.6, 0.8, 0.0]]))
+
+    found = cache.lookup(["dropout improves accuracy", "unseen text"])
+
+    assert np.allclose(found[0], [0.6, 0.8, 0.0])
+    assert found[1] is None
+    assert cache.stats()["hit_rate"] == 0.5
+    assert LocalEmbeddingCache("model-b", 3, path=str(tmp_path / "cache.sqlite")).lookup(["dropout improves accuracy"]) == [None]
+
+
+def test_batch_embedder_retries_and_isolates_failed_batches():
+    attempts = {}
+
+    def embed_fn(texts):
+        attempts[texts[0]] = attempts.get(texts[0], 0) + 1
+        if texts[0] == "bad" or (texts[0] == "flaky" and attempts["flaky"] == 1):
+            raise RuntimeError("provider error")
+        return [[float(len(t)), 1.0] for t in texts]
+
+    embedder = BatchEmbedder(embed_fn, batch_size=2, concurrency=3, max_retries=1, backoff=0)
+    results = {s: (vecs, err) for s, _, vecs, err in embedder.embed(["ok", "fine", "flaky", "x", "bad", "y"])}
+
+    assert results[0][0][:, 0].tolist() == [2.0, 4.0]
+    assert results[2][0] is not None and attempts["flaky"] == 2
+    assert results[4][0] is None and isinstance(results[4][1], RuntimeError)
+
+
+def test_query_embedder_caches_and_batches_concurrent_misses():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    embedder = QueryEmbedder(embed_many, lambda m: m, window_ms=50)
+    with ThreadPoolExecutor(8) as pool:
+        vectors = list(pool.map(embedder.embed, ["q1", "q22", "q333", "q1"] * 4))
+
+    assert [v[0] for v in vectors[:4]] == [2.0, 3.0, 4.0, 2.0]
+    assert sorted(t for batch in calls for t in batch) == ["q1", "q22", "q333"]
+    assert len(calls) < 3
+
+    embedder.embed("  q22 ")
+    assert embedder.stats()["provider_calls"] == len(calls)
+
+
+def test_score_many_matches_per_query_scoring():
+    index = InvertedIndex()
+    index.add([["dropout", "improves", "accuracy"], ["batch", "size"], ["dropout", "rate", "rate"]])
+    queries = [["dropout"], ["unknown"], ["rate", "batch", "dropout"]]
+
+    batched = index.score_many(queries)
+
+    for query, (pos, scores) in zip(queries, batched):
+        single_pos, single_scores = index.score(query)
+        assert pos.tolist() == single_pos.tolist()
+        assert np.allclose(scores, single_scores)
+    assert batched[1][0].size == 0
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_flat"])
+def test_selector_search_only_returns_allowed_positions(kind):
+    import faiss
+
+    vectors = np.random.default_rng(0).random((2000, 16), dtype=np.float32)
+    index = ann.build_trained(kind, vectors)
+    allowed = np.arange(0, 2000, 4, dtype=np.int64)
+    params = ann.search_params(index, selector=faiss.IDSelectorBatch(allowed), selectivity=0.25)
+
+    _, I = index.search(vectors[:5], 10, params=params)
+
+    assert (I >= 0).all() and (I % 4 == 0).all()
+
+
+def test_exact_search_matches_brute_force_across_blocks():
+    rng = np.random.default_rng(1)
+    vectors, queries = rng.random((1000, 8), dtype=np.float32), rng.random((3, 8), dtype=np.float32)
+    positions = np.arange(0, 1000, 3)
+
+    I, D = ann.exact_search(vectors, queries, 5, positions, block=64)
+
+    expected = positions[np.argsort(-(queries @ vectors[positions].T), axis=1)[:, :5]]
+    assert (np.sort(I, axis=1) == np.sort(expected, axis=1)).all()
+    assert np.allclose(D, np.take_along_axis(queries @ vectors.T, I, axis=1))
+
+
+def test_chunk_store_roundtrip_keeps_chunk_fields(persist_dir):
+    index = InvertedIndex()
+    store = ChunkStore(dim=2)
+    store.terms = index.terms
+    chunks = [
+        Chunk("a:0", "a", "Doc A", "dropout 0.5 helps", {"file": "a.pdf"}, [0.5], "pdf", np.array([1, 0], np.float32), ["dropout", "0.5", "helps"]),
+        Chunk("b:0", "b", "Doc B", "batch size", {}, [], "url", np.array([0, 1], np.float32), ["batch", "size"]),
+    ]
+    _add_chunks(store, index, chunks)
+    persistence.RetrieverPersistence.save(store, None, index, "model")
+
+    _, loaded, _, lexical = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+    loaded.terms = lexical.terms
+
+    for i, chunk in enumerate(chunks):
+        got = loaded[i]
+        assert (got.chunk_id, got.doc_id, got.title, got.text, got.meta, got.raw_numbers, got.source, got.tokens) == (
+            chunk.chunk_id, chunk.doc_id, chunk.title, chunk.text, chunk.meta, chunk.raw_numbers, chunk.source, chunk.tokens
+        )
+        assert np.array_equal(loaded.vectors[i], chunk.vector)
+    assert loaded.positions_for_docs(["b", "zzz"], 2).tolist() == [1]
+    assert loaded.source_counts() == {"pdf": 1, "url": 1}
+
+
+def test_chunk_store_tombstones_survive_reload_and_compaction(persist_dir):
+    index, store = InvertedIndex(), ChunkStore(dim=2)
+    store.terms = index.terms
+    vec = np.array([1, 0], np.float32)
+    _add_chunks(store, index, [Chunk("a:0", "a", "old", "x", {}, [], "pdf", vec, ["x"]), Chunk("b:0", "b", "B", "y", {}, [], "url", vec, ["y"])])
+    persistence.RetrieverPersistence.save(store, None, index, "model")
+    _, reader, _, reader_lexical = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+
+    store.delete_docs(["a"])
+    _add_chunks(store, index, [Chunk("a:0", "a", "new", "z", {}, [], "pdf", vec, ["z"])])  # replaced version
+    generation = persistence.RetrieverPersistence.save(store, None, index, "model")
+    followed, _, _ = persistence.RetrieverPersistence.follow((reader, None, reader_lexical), generation, 2, "model")
+    _, loaded, _, _ = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+
+    for got in (followed, loaded):
+        assert got.n_deleted == 1 and got.live_mask(3).tolist() == [False, True, True]
+        # Deleted versions still match, for snapshots taken before the deletion
+        assert got.positions_for_docs(["a"], 3).tolist() == [0, 2]
+
+    compacted, keep = loaded.compact(3)
+    assert keep.tolist() == [1, 2]
+    assert [compacted[i].title for i in range(2)] == ["B", "new"]
+    assert compacted.source_counts() == {"pdf": 1, "url": 1}
+    assert compacted.delete_docs(["b", "zzz"]).tolist() == [0]
+
+
+def test_views_taken_before_a_write_keep_their_contents():
+    index = InvertedIndex()
+    store = ChunkStore(dim=2)
+    vec = np.array([1, 0], np.float32)
+    chunk = Chunk("a:0", "a", "A", "dropout rate", {}, [], "pdf", vec, ["dropout", "rate"])
+    index.add_ids([index.intern(chunk.tokens)])
+    store.extend([chunk], [index.intern(chunk.tokens)])
+    view, n, tombstones = index.view(), len(store), store.tombstones.view[:len(store)]
+    before = view.score(["dropout"])
+
+    # The writer replaces "a" and adds a new term
+    new = Chunk("a:1", "a", "A", "dropout dropout schedule", {}, [], "pdf", vec, ["dropout", "dropout", "schedule"])
+    token_ids = [index.intern(new.tokens)]
+    index.add_ids(token_ids)
+    store.delete_docs(["a"])
+    store.extend([new], token_ids)
+
+    assert tombstones.tolist() == [False] and store.live_mask(2).tolist() == [False, True]
+    assert [a.tolist() for a in view.score(["dropout"])] == [a.tolist() for a in before]
+    assert len(view) == 1 and view.score(["schedule"])[0].size == 0
+    assert index.score(["schedule"])[0].tolist() == [1]
+    assert store.positions_for_docs(["a"], n).tolist() == [0]
+
+
+def test_saves_publish_generations_and_prune_old_ones(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(persistence, "SNAPSHOT_KEEP", 2)
+    index = InvertedIndex()
+    store = ChunkStore(dim=2)
+    store.terms = index.terms
+
+    def add(i):
+        chunk = Chunk(f"c{i}", f"d{i}", "", f"text {i}", {}, [], "text", np.array([1, 0], np.float32), ["text", str(i)])
+        token_ids = [index.intern(chunk.tokens)]
+        index.add_ids(token_ids)
+        store.extend([chunk], token_ids)
+        return persistence.RetrieverPersistence.save(store, None, index, "model")
+
+    for i in range(3):
+        add(i)
+
+    # Every save appended to the same logs and wrote one postings segment
+    assert sorted(os.listdir(tmp_path / "index")) == ["CURRENT", "epoch-00000001", "gen-00000002.json", "gen-00000003.json"]
+    assert persistence.RetrieverPersistence.segment_count() == 3
+    generation, loaded, ann_index, lexical = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+    assert (generation, len(loaded), ann_index, len(lexical)) == ("gen-00000003.json", 3, None, 3)
+    with pytest.raises(RuntimeError):
+        persistence.RetrieverPersistence.load(2, "other-model", readonly=True)
+
+    # A reader follows a later save in place, and merging keeps what the segments hold
+    store.delete_docs({"d0"})
+    generation = add(3)
+    followed, _, lexical = persistence.RetrieverPersistence.follow((loaded, None, lexical), generation, 2, "model")
+    assert followed is loaded and len(followed) == 4 and not followed.has_doc("d0")
+    assert persistence.RetrieverPersistence.merge_segments(max_segments=2, factor=3) == "gen-00000005.json"
+    assert persistence.RetrieverPersistence.segment_count() == 2
+    _, merged, _, merged_lexical = persistence.RetrieverPersistence.load(2, "model", readonly=True)
+    for query in (["text"], ["3"], ["1"]):
+        assert [a.tolist() for a in merged_lexical.score(query)] == [a.tolist() for a in lexical.score(query)]
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    """Writer engines over a fresh persist dir, embedding with the hashing provider."""
+    monkeypatch.syspath_prepend(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # for `model`
+    from back_end.agents.Retriever import embed_cache, retriever
+
+    monkeypatch.setattr(persistence, "PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(embed_cache, "EMBED_CACHE_BACKEND", "off")
+    monkeypatch.setattr(retriever, "ANN_PROMOTE_THRESHOLD", 10 ** 9)
+
+    def make(**kwargs):
+        return retriever.RetrieverEngine(**{"background": False, "provider": HashingProvider(32), **kwargs})
+
+    return make
+
+
+def _docs(n, prefix="d"):
+    topics = ["dropout rate", "batch size", "learning rate", "weight decay"]
+    return [
+        {"doc_id": f"{prefix}{i}", "title": f"Doc {i}", "text": f"{topics[i % 4]} of {i} runs {topics[(i + 1) % 4]}"}
+        for i in range(n)
+    ]
+
+
+def test_doc_id_filters_rank_the_same_on_the_exact_and_index_paths(make_engine, monkeypatch):
+    from back_end.agents.Retriever import retriever
+
+    engine = make_engine()
+    engine.ingest_batch(_docs(60), "text")
+    store, n = engine.store, len(engine.store)
+    engine._publish(store, engine._lexical, ann.build_trained("flat", store.vectors[:n]))
+    wanted = [f"d{i}" for i in range(0, 60, 3)]
+    query = "learning rate of runs"
+    positions = store.positions_for_docs(wanted, n)
+    I, _ = ann.exact_search(store.vectors[:n], engine.query_embedder.embed_all([query]), 5, positions)
+    exact = {store[int(i)].chunk_id for i in I[0]}
+
+    ranked = {}
+    for path, exact_max in (("exact", 10 ** 6), ("index", 0)):
+        monkeypatch.setattr(retriever, "FILTER_EXACT_MAX", exact_max)
+        hits = engine.retrieve(query, k=5, alpha=1.0, doc_ids=wanted)
+        assert len(hits) == 5 and all(h["doc_id"] in wanted for h in hits)
+        assert {h["chunk_id"] for h in hits} == exact
+        ranked[path] = [h["chunk_id"] for h in engine.retrieve(query, k=5, doc_ids=wanted)]
+    assert ranked["exact"] == ranked["index"]
+
+
+def test_baseline_meta_pkl_migrates_to_the_current_layout(make_engine, tmp_path, monkeypatch):
+    import pickle
+
+    engine = make_engine()
+    docs = _docs(12)
+    engine.ingest_batch(docs[:6], "pdf")
+    engine.ingest_batch(docs[6:], "url")
+    queries = ["dropout rate", "weight decay of 7 runs"]
+    expected = [[(h["chunk_id"], h["source"], round(h["score_hybrid"], 5)) for h in engine.retrieve(q, k=4)] for q in queries]
+
+    # The baseline pickled each source's chunks as dicts, with numbers in the chunk meta
+    legacy = {"chunks": {"pdf": [], "url": []}}
+    for i in range(len(engine.store)):
+        c = engine.store[i]
+        legacy["chunks"][c.source].append({
+            "chunk_id": c.chunk_id, "doc_id": c.doc_id, "title": c.title, "text": c.text,
+            "meta": {**c.meta, "raw_numbers": c.raw_numbers}, "vector": np.array(c.vector), "tokens": c.tokens,
+            "score_bm25": 0.0, "score_vec": 0.0, "score_hybrid": 0.0,
+        })
+    legacy_dir = tmp_path / "legacy"
+    legacy_dir.mkdir()
+    with open(legacy_dir / "meta.pkl", "wb") as f:
+        pickle.dump(legacy, f)
+    monkeypatch.setattr(persistence, "PERSIST_DIR", str(legacy_dir))
+
+    migrated = make_engine()
+
+    assert migrated.status == "ready" and migrated.generation is not None
+    assert sorted(os.listdir(legacy_dir)) == ["index", "meta.pkl.migrated"]
+    assert migrated.source_counts() == {"pdf": 6, "url": 6}
+    got = [[(h["chunk_id"], h["source"], round(h["score_hybrid"], 5)) for h in migrated.retrieve(q, k=4)] for q in queries]
+    assert got == expected
+    assert migrated.store[0].raw_numbers == engine.store[0].raw_numbers
+    assert [(h["chunk_id"], h["meta"]) for h in make_engine().retrieve(queries[0])] == [
+        (h["chunk_id"], h["meta"]) for h in migrated.retrieve(queries[0])
+    ]
+
+
+def test_engine_rejects_queries_until_its_corpus_has_loaded(make_engine, monkeypatch):
+    from back_end.agents.Retriever.retriever import RetrieverNotReady
+
+    writer = make_engine()
+    writer.ingest_batch(_docs(4), "text")
+    writer.save()
+    release, load = threading.Event(), persistence.RetrieverPersistence.load
+
+    def slow_load(*args, **kwargs):
+        release.wait(5)
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(persistence.RetrieverPersistence, "load", staticmethod(slow_load))
+    engine = make_engine(background=True)
+    engine.ready_timeout = 0.05
+
+    assert engine.status == "loading" and not engine.wait_ready(0)
+    with pytest.raises(RetrieverNotReady):
+        engine.retrieve("dropout rate")
+    release.set()
+    assert engine.wait_ready(5)
+    assert engine.retrieve("dropout rate")[0]["doc_id"] == writer.retrieve("dropout rate")[0]["doc_id"]
+
+
+def test_engine_promotes_to_an_ann_index_at_the_threshold(make_engine, monkeypatch):
+    from back_end.agents.Retriever import retriever
+
+    monkeypatch.setattr(retriever, "ANN_PROMOTE_THRESHOLD", 20)
+    engine = make_engine()
+    engine.index_type = "hnsw"
+    engine.ingest_batch(_docs(12), "text")
+    assert engine.faiss_index is None and not engine.maintenance_status()["promoting"]
+
+    engine.ingest_batch(_docs(12, prefix="e"), "text")
+    deadline = time.monotonic() + 10
+    while (engine.faiss_index is None or engine.maintenance_status()["promoting"]) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert ann.index_kind(engine.faiss_index) == "hnsw" and engine.faiss_index.ntotal == len(engine.store) == 24
+    hits = {h["chunk_id"] for h in engine.retrieve("batch size of 3 runs")}
+    engine._publish(engine.store, engine._lexical, None)
+    assert hits == {h["chunk_id"] for h in engine.retrieve("batch size of 3 runs")}
+
+
+def test_concurrent_retrieve_calls_share_one_query_embedding_call(make_engine):
+    calls = []
+
+    class CountingProvider(HashingProvider):
+        def embed_queries(self, texts):
+            calls.append(list(texts))
+            return super().embed_queries(texts)
+
+    engine = make_engine(provider=CountingProvider(32))
+    engine.ingest_batch(_docs(8), "text")
+    engine.query_embedder.window = 0.2
+    queries = ["dropout rate", "batch size", "learning rate", "weight decay"]
+    start = threading.Barrier(len(queries))
+
+    def retrieve(query):
+        start.wait()
+        return engine.retrieve(query, k=2)
+
+    with ThreadPoolExecutor(len(queries)) as pool:
+        results = list(pool.map(retrieve, queries))
+
+    assert len(calls) == 1 and sorted(calls[0]) == sorted(queries)
+    assert all(len(hits) == 2 for hits in results)
+
+
+def _ranked(hits):
+    return [(h["chunk_id"], h["source"], round(h["score_hybrid"], 5)) for h in hits]
+
+
+def test_retrieve_many_matches_one_retrieve_per_query_with_filters(make_engine):
+    engine = make_engine()
+    engine.ingest_batch(_docs(24), "text")
+    engine.ingest_batch(_docs(12, prefix="b"), "blog")
+    queries = ["dropout rate of 3 runs", "batch size", "weight decay learning rate", "unseen words"]
+    wanted = ["d1", "d5", "b2", "b7"]
+
+    for filters in (
+        {},
+        {"source_type": "blog"},
+        {"source_type": ["text", "blog"], "doc_ids": wanted, "alpha": 0.2},
+        {"fusion": "rrf", "mmr_lambda": 0.5, "max_per_doc": 1},
+    ):
+        batched = engine.retrieve_many(queries, k=4, **filters)
+
+        assert [_ranked(hits) for hits in batched] == [_ranked(engine.retrieve(q, k=4, **filters)) for q in queries]
+        assert all(batched[:3])
+    assert {h["source"] for hits in engine.retrieve_many(queries, source_type="blog") for h in hits} == {"blog"}
+    assert {h["doc_id"] for hits in engine.retrieve_many(queries, doc_ids=wanted) for h in hits} <= set(wanted)
+    assert engine.retrieve_many([]) == []
+
+
+def test_batch_route_validates_requests_and_answers_in_query_order(make_engine, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    engine = make_engine()
+    engine.ingest_batch(_docs(12), "text")
+    from agents.routers import retriver_route  # the app's import path; make_engine puts back_end on sys.path
+
+    monkeypatch.setattr(retriver_route, "get_engine", lambda: engine)
+    app = FastAPI()
+    app.include_router(retriver_route.retriever_router)
+    client = TestClient(app)
+    queries = ["batch size", "dropout rate"]
+
+    response = client.post("/retriever/retrieve/batch", json={"queries": queries, "k": 3, "doc_ids": ["d0", "d1", "d4"]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["query"] for r in results] == queries
+    assert [[h["chunk_id"] for h in r["results"]] for r in results] == [
+        [h["chunk_id"] for h in hits] for hits in engine.retrieve_many(queries, k=3, doc_ids=["d0", "d1", "d4"])
+    ]
+    assert results[0]["provenance"] == {
+        "k": 3, "alpha": 0.5, "fusion": "weighted", "source_type": None, "mmr_lambda": None, "max_per_doc": None,
+    }
+    assert set(results[0]["results"][0]) >= {"chunk_id", "doc_id", "text", "score_hybrid"}
+
+    url = "/retriever/retrieve/batch"
+    assert client.post(url, json={"queries": []}).status_code == 400
+    assert client.post(url, json={"queries": ["x"], "mmr_lambda": 2}).status_code == 400
+    assert client.post(url, json={"queries": ["x"], "max_per_doc": 0}).status_code == 400
+    assert client.post(url, json={"queries": ["x"], "fusion": "max"}).status_code == 422
+    assert client.post(url, json={"k": 3}).status_code == 422
+
+
+def test_engine_caps_hits_per_document_and_skips_near_duplicates(make_engine):
+    engine = make_engine()
+    engine.ingest_batch(_docs(8), "text", chunk_size=4, chunk_overlap=1)  # three chunks per document
+    duplicate = "dropout rate improves accuracy on cifar"
+    engine.ingest_batch(
+        [{"doc_id": f"dup{i}", "title": "", "text": duplicate} for i in range(3)]
+        + [{"doc_id": "other", "title": "", "text": "cifar accuracy benchmark results"}]
+        + [{"doc_id": f"off{i}", "title": "", "text": f"weight decay of {i} layers"} for i in range(3)],
+        "blog",
+    )
+
+    plain = engine.retrieve("dropout rate", k=6, source_type="text")
+    capped = engine.retrieve("dropout rate", k=6, source_type="text", max_per_doc=1)
+    assert len({h["doc_id"] for h in plain}) < len(plain)
+    assert len(capped) == 6 and len({h["doc_id"] for h in capped}) == 6
+
+    query = "dropout rate accuracy cifar"
+    assert [h["text"] for h in engine.retrieve(query, k=2, source_type="blog")] == [duplicate] * 2
+    diverse = engine.retrieve(query, k=2, source_type="blog", mmr_lambda=0.5)
+    assert [(h["text"], h["doc_id"]) for h in diverse][1:] == [("cifar accuracy benchmark results", "other")]
+    assert diverse[0]["text"] == duplicate
+
+    evidence = engine.format_for_extractor(query, source_type="blog", k=3, mmr_lambda=0.5)
+    assert [c.chunk_id for c in evidence.evidence_chunks][:2] == [h["chunk_id"] for h in diverse]
+    assert evidence.provenance["mmr_lambda"] == 0.5
+
+
+def test_pipeline_passes_diversity_settings_to_the_engine(make_engine, monkeypatch):
+    pytest.importorskip("langchain_groq")  # the pipeline imports the extractor and judging agents
+    from agents.routers import pipeline
+    from model.retriever_model import RetrieveRequest
+
+    calls = []
+
+    class Engine:
+        def retrieve(self, **kwargs):
+            calls.append(kwargs)
+            return []
+
+    monkeypatch.setattr(pipeline, "get_engine", Engine)
+    req = RetrieveRequest(query="dropout rate", section_filter="pdf,blog", mmr_lambda=0.3, max_per_doc=2)
+
+    result = asyncio.run(pipeline.pipeline_run(req))
+
+    assert result["reason_code"] == "MISSING_DATA"
+    assert (calls[0]["mmr_lambda"], calls[0]["max_per_doc"], calls[0]["source_type"]) == (0.3, 2, ["pdf", "blog"])
+
+
+def test_engine_deletes_and_upserts_documents_in_both_rankings(make_engine):
+    engine = make_engine()
+    engine.ingest_batch(_docs(8), "text")
+    assert "d1" in {h["doc_id"] for h in engine.retrieve("batch size of 1 runs", k=8)}
+
+    engine.delete(["d1", "unknown"])
+    engine.upsert([{"doc_id": "d2", "title": "Doc 2", "text": "momentum schedule warmup"}], "text")
+
+    assert all(h["doc_id"] != "d1" for h in engine.retrieve("batch size of 1 runs", k=8))
+    assert all(h["doc_id"] != "d1" for h in engine.retrieve("batch size of 1 runs", k=8, alpha=0.0))  # BM25 only
+    for alpha in (1.0, 0.0):
+        hits = [h for h in engine.retrieve("momentum schedule warmup", k=8, alpha=alpha) if h["doc_id"] == "d2"]
+        assert [h["text"] for h in hits] == ["momentum schedule warmup"]
+    old_version = engine.retrieve("learning rate of 2 runs weight decay", k=8)
+    assert all(h["text"] == "momentum schedule warmup" for h in old_version if h["doc_id"] == "d2")
+    assert engine.source_counts() == {"text": 7}
+
+
+def test_upserting_a_document_without_text_deletes_it(make_engine):
+    engine = make_engine()
+    engine.ingest_batch(_docs(4), "text")
+
+    result = engine.upsert([{"doc_id": "d0", "text": "  "}, {"doc_id": "d1", "text": "momentum"}], "text")
+
+    assert (result["added_docs"], result["empty_docs"], result["replaced_docs"]) == (1, ["d0"], ["d1"])
+    for alpha in (1.0, 0.0):
+        assert all(h["doc_id"] != "d0" for h in engine.retrieve("dropout rate of 0 runs", k=8, alpha=alpha))
+    assert not engine.store.has_doc("d0") and engine.source_counts() == {"text": 3}
+    assert engine.ingest_batch([{"doc_id": "e0", "text": ""}], "text")["empty_docs"] == ["e0"]
+
+
+def test_a_second_writer_process_serves_snapshots_read_only(make_engine, tmp_path):
+    import fcntl
+    from back_end.agents.Retriever.retriever import RetrieverReadOnly
+
+    (tmp_path / "index").mkdir()
+    with open(tmp_path / "index" / "WRITER.lock", "a") as held:  # as another process would hold it
+        fcntl.flock(held, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        engine = make_engine()
+        assert engine.role == "reader"
+        with pytest.raises(RetrieverReadOnly):
+            engine.delete(["d0"])
+
+    writer = make_engine()
+    assert writer.role == "writer" and make_engine().role == "writer"  # the same process keeps the lock
+
+
+class _QueuedJobs:
+    """The job store calls IngestJobRunner makes, for one queued delete and a compaction request."""
+
+    def __init__(self, doc_ids):
+        self.doc_ids_ = doc_ids
+        self.finished = None
+        self.compaction = True
+
+    def active(self):
+        return [] if self.finished is not None else ["job"]
+
+    def kind(self, job_id):
+        return "delete"
+
+    def doc_ids(self, job_id):
+        return self.doc_ids_
+
+    def finish_delete(self, job_id, deleted):
+        self.finished = deleted
+
+    def take_compaction(self):
+        requested, self.compaction = self.compaction, False
+        return requested
+
+    def request_compaction(self):
+        self.compaction = True
+
+
+def test_writer_applies_queued_deletes_and_compaction(make_engine, monkeypatch):
+    from back_end.agents.Retriever.ingest_jobs import IngestJobRunner
+
+    engine = make_engine()
+    engine.ingest_batch(_docs(8), "text")
+    jobs = _QueuedJobs(["d1", "d3", "unknown"])
+    runner = IngestJobRunner(engine, jobs=jobs)
+
+    assert runner.run_once() and jobs.finished == 2
+    deadline = time.monotonic() + 10
+    while engine.maintenance_status()["compacting"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(engine.store) == 6 and engine.store.n_deleted == 0
+    assert persistence.RetrieverPersistence.load(32, engine.model_name, readonly=True)[1].source_counts() == {"text": 6}
+    assert not runner.run_once()
+
+
+def test_embed_all_sends_a_callers_misses_in_one_call():
+    calls = []
+    embedder = QueryEmbedder(lambda texts: calls.append(texts) or [[1.0]] * len(texts), lambda m: m, window_ms=50)
+
+    embedder.embed_all(["a", "b", "a", "c"])
+
+    assert calls == [["a", "b", "c"]]
+
+
+def test_chunk_text_is_lazy_and_deterministic():
+    meta = {"source_type": "pdf"}
+    text = "n=120 subjects  scored 3.5\nvs 2.75 on day 7"
+
+    chunks = chunk_text(text, chunk_size=4, chunk_overlap=1, doc_id="doc", meta=meta)
+    first = next(chunks)
+
+    assert first["text"] == "n=120 subjects scored 3.5"
+    assert first["raw_numbers"] == [120.0, 3.5]
+    assert first["meta"] is meta
+    assert [c["chunk_id"] for c in chunk_text(text, 4, 1, "doc")] == [first["chunk_id"]] + [c["chunk_id"] for c in chunks]
+
+
+class _SlowPage(BaseHTTPRequestHandler):
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        etag = f'"{self.path}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = f"<html><script>x()</script><body><p>page {self.path}</p></body></html>".encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowPage)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_fetcher_fetches_concurrently_and_revalidates(page_server):
+    fetcher = UrlFetcher(per_host=20, parse_workers=1)
+    urls = [f"{page_server}/p{i}" for i in range(12)] + [f"{page_server}/missing"]
+
+    async def run():
+        started = time.monotonic()
+        first = await fetcher.fetch_many(urls)
+        elapsed = time.monotonic() - started
+        again = await fetcher.fetch_text(urls[0])
+        await fetcher.aclose()
+        return first, elapsed, again
+
+    first, elapsed, again = asyncio.run(run())
+
+    assert first[0] == "page /p0"
+    assert isinstance(first[-1], RuntimeError)
+    assert elapsed < 12 * _SlowPage.delay / 2
+    assert again == "page /p0"
+    assert fetcher.not_modified == 1
+
+
+def test_fetcher_limits_requests_per_host(page_server):
+    fetcher = UrlFetcher(per_host=2, parse_workers=0)
+    urls = [f"{page_server}/p{i}" for i in range(4)]
+
+    async def run():
+        started = time.monotonic()
+        await fetcher.fetch_many(urls)
+        await fetcher.aclose()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 2 * _SlowPage.delay
+
+
+def _write_pdf(path, pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def test_pdf_stream_parses_page_ranges_in_order_and_times_out(tmp_path):
+    path = _write_pdf(tmp_path / "paper.pdf", [f"Page {i} dropout" for i in range(1, 6)])
+
+    pages = list(PdfPageStream(path, pages_per_task=2))
+
+    assert [p["page"] for p in pages] == [1, 2, 3, 4, 5]
+    assert pages[2]["text"] == "Page 3 dropout"
+    with pytest.raises(RuntimeError, match="Timed out"):
+        list(PdfPageStream(path, pages_per_task=1, timeout=0))
+    with pytest.raises(ValueError, match="Failed to read PDF"):
+        PdfPageStream(str(tmp_path / "missing.pdf"))
+
+
+def test_ingest_job_items_extract_text_by_kind(page_server, tmp_path):
+    pdf = _write_pdf(tmp_path / "paper.pdf", ["dropout 0.5", "batch size 32"])
+    items = [
+        {"doc_id": "a", "text": "  raw notes "},
+        {"doc_id": "b", "url": f"{page_server}/p1", "source_type": "blog"},
+        {"doc_id": "c", "file_path": pdf},
+        {"doc_id": "d"},
+        {"doc_id": "e", "url": f"{page_server}/missing"},
+    ]
+
+    text, page, paper, malformed, missing = extract_texts(items)
+
+    assert text == ("raw notes", {"source_type": "text"})
+    assert page == ("page /p1", {"source_type": "blog", "url": f"{page_server}/p1"})
+    assert " ".join(p["text"] for p in paper[0]) == "dropout 0.5 batch size 32"
+    assert paper[1] == {"source_type": "pdf", "file": pdf}
+    assert isinstance(malformed, ValueError) and isinstance(missing, RuntimeError)
+    assert item_source({"doc_id": "c", "file_path": "paper.pdf"}) == "pdf"
+
+
+def test_prepared_documents_are_queued_compressed_with_their_vectors():
+    jobs = IngestJobStore(client=object(), codec="zlib")
+    doc = {"doc_id": "a", "title": "", "text": "dropout 0.5 " * 200, "meta": {"source_type": "text"}}
+    vectors = np.arange(6, dtype=np.float32).reshape(2, 3)
+
+    raw = jobs._pack(doc)
+    with_vectors = jobs._unpack(jobs._pack({**doc, "vectors": vectors}))
+
+    assert jobs._unpack(raw) == doc and len(raw) < len(doc["text"]) // 5
+    assert np.array_equal(with_vectors.pop("vectors"), vectors) and with_vectors == doc
+
+
+def test_writer_indexes_the_vectors_workers_prepared_without_embedding(make_engine):
+    from back_end.agents.Retriever.ingest_jobs import DocumentPreparer
+
+    calls = []
+
+    class CountingProvider(HashingProvider):
+        def embed_documents(self, texts):
+            calls.append(len(texts))
+            return super().embed_documents(texts)
+
+    docs = [{**doc, "meta": {"source_type": "text"}} for doc in _docs(6)]
+    preparer = DocumentPreparer(CountingProvider(32))
+    prepared = preparer.prepare(docs, chunk_size=4, chunk_overlap=1)
+    assert len(calls) == 1 and [p["chunks"] for p in prepared] == [3] * 6
+    assert sum(p["embedded"] for p in prepared) == calls[0]
+
+    calls.clear()
+    engine = make_engine(provider=CountingProvider(32))
+    items = [{**doc, "vectors": p["vectors"], "model": preparer.model_id} for doc, p in zip(docs, prepared)]
+    items[0]["model"] = "another-model"
+    engine.ingest_batch(items, "text", chunk_size=4, chunk_overlap=1)
+
+    assert calls == [3]  # only the document prepared with another model
+    expected = make_engine(provider=HashingProvider(32))
+    expected.ingest_batch(docs, "text", chunk_size=4, chunk_overlap=1)
+    vectors = {expected.store[i].chunk_id: expected.store.vectors[i] for i in range(len(expected.store))}
+    assert len(engine.store) == len(vectors) == 18
+    for i in range(len(engine.store)):
+        assert np.allclose(engine.store.vectors[i], vectors[engine.store[i].chunk_id])
+
+
+def test_chunk_stream_matches_chunk_text_over_the_joined_pieces():
+    pieces = ["Dropout 0.5 with", "batch size 32 and lr 3e-4", "", "over 10 epochs of", "training data"]
+    expected = list(chunk_text(" ".join(pieces), 4, 1, "d", "T", {"k": 1}))
+
+    stream, chunks = ChunkStream(4, 1, "d", "T", {"k": 1}), []
+    for piece in pieces:
+        chunks.extend(stream.feed(piece))
+    chunks.extend(stream.close())
+
+    assert chunks == expected and len(chunks) == 5
+
+
+def test_preparer_embeds_streamed_pages_while_later_pages_parse():
+    from back_end.agents.Retriever.ingest_jobs import DocumentPreparer
+
+    embedded = threading.Event()
+
+    class SignallingProvider(HashingProvider):
+        def embed_documents(self, texts):
+            embedded.set()
+            return super().embed_documents(texts)
+
+    pages = [["dropout 0.5 with batch", "size 32"], ["and lr 3e-4 over ten epochs"]]
+
+    def parse():
+        yield pages[0]
+        assert embedded.wait(5)  # the first range is embedded before the next one parses
+        yield pages[1]
+
+    meta = {"source_type": "pdf"}
+    streamed = DocumentPreparer(SignallingProvider(32)).prepare(
+        [{"doc_id": "p", "title": "", "meta": meta, "pages": parse()}], chunk_size=4, chunk_overlap=1)[0]
+    whole = DocumentPreparer(HashingProvider(32)).prepare(
+        [{"doc_id": "p", "title": "", "meta": meta, "text": "dropout 0.5 with batch size 32 and lr 3e-4 over ten epochs"}],
+        chunk_size=4, chunk_overlap=1)[0]
+
+    assert streamed["text"] == whole["text"] and streamed["chunks"] == whole["chunks"] == 4
+    assert np.allclose(streamed["vectors"], whole["vectors"])
+
+    def unreadable():
+        yield pages[0]
+        raise ValueError("Failed to read PDF")
+
+    failed = DocumentPreparer(HashingProvider(32)).prepare([{"doc_id": "p", "title": "", "meta": meta, "pages": unreadable()}])
+    assert isinstance(failed[0], ValueError)
+
+
+def test_document_cache_keys_fingerprint_files_and_payloads_decode_by_tag(tmp_path):
+    path = tmp_path / "paper.pdf"
+    path.write_bytes(b"v1")
+    item = {"doc_id": "p", "file_path": str(path)}
+    key = DocumentCache.key(item)
+
+    assert key == DocumentCache.key(dict(item)) and DocumentCache.key({"doc_id": "t", "text": "x"}) is None
+    os.utime(path, ns=(0, 10 ** 9))
+    assert DocumentCache.key(item) != key  # an edited file misses
+    text = "dropout 0.5 " * 200
+    for codec in ("zlib", "none"):
+        blob = encode_text(text, load_codec(codec))
+        assert decode_text(blob) == text
+    assert len(encode_text(text, load_codec("zlib"))) < len(text) // 10
+    assert decode_text(b"?junk") is None
+
+
+def test_retriever_profile_drops_noise_in_one_pass():
+    text = "Order B07XJ8C8F3 now, 12 cm wide,  Page 4 of the 9781234567897 edition costs 20 dollars"
+
+    assert normalize_text(text) == "Order now, wide, of the edition costs 20 dollars"
+
+
+def test_pipeline_profile_strips_search_chrome_and_truncates():
+    text = "Result from 2019 with 1234567 rows\nCached - Similar pages junk\n" + "word " * 400
+
+    cleaned = normalize_text(text, "pipeline")
+
+    assert cleaned.startswith("Result from with rows word")
+    assert "Cached" not in cleaned and len(cleaned) == 1000
+    with pytest.raises(ValueError):
+        normalize_text(text, "unknown")
+
+
+def test_hashing_provider_is_deterministic_and_declares_its_model():
+    provider = make_provider("hashing")
+    vectors = HashingProvider(dim=32).embed_documents(["dropout rate", "Dropout  rate", "batch size"])
+
+    assert (provider.model_id, provider.dim) == ("hashing-256", 256)
+    assert vectors.shape == (3, 32) and vectors.dtype == np.float32
+    assert np.array_equal(vectors[0], vectors[1]) and not np.array_equal(vectors[0], vectors[2])
+    assert np.array_equal(HashingProvider(32).embed_queries(["dropout rate"])[0], vectors[0])
+    with pytest.raises(ValueError):
+        make_provider("word2vec")
+
+
+def test_local_model_ids_tell_apart_models_in_different_directories(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name / "model").mkdir(parents=True)
+
+    first, second = (local_model_id(str(tmp_path / name / "model") + "/") for name in ("a", "b"))
+
+    assert first == f"local:{tmp_path / 'a' / 'model'}" and first != second
+    assert local_model_id("sentence-transformers/all-MiniLM-L6-v2", int8=True) == "local:sentence-transformers/all-MiniLM-L6-v2+int8"
+    assert local_model_id("BAAI/bge-small-en", "onnx", onnx_file="onnx/model_qint8.onnx") == "local:BAAI/bge-small-en+model_qint8"
+
+
+def test_benchmark_corpus_is_deterministic():
+    docs = retriever_bench.make_corpus(40)
+
+    assert docs == retriever_bench.make_corpus(40) and len(docs) == 4
+    assert retriever_bench._recall(np.array([[1, 2, -1]]), np.array([[2, 1, 3]])) == round(2 / 3, 4)